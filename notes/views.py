@@ -8,6 +8,7 @@ from users.views import UserSerializer
 from notes.models import Note
 
 from webpage.models import WebPage
+from webpage.canonical import url_hash
 from webpage.views import WebPageWithDomainSerializer
 
 # Create your views here.
@@ -24,7 +25,8 @@ class NoteSerializer(serializers.Serializer):
         soup = BeautifulSoup(instance.text, "html.parser")
         links = [anchor.get("href") for anchor in soup.find_all("a")]
         print(links)
-        return WebPageWithDomainSerializer(WebPage.objects.filter(url__in=links), many=True).data
+        hashes = [url_hash(link) for link in links if link]
+        return WebPageWithDomainSerializer(WebPage.objects.filter(url_hash__in=hashes), many=True).data
 
 # ViewSets define the view behavior.
 class NotesViewSet(viewsets.ModelViewSet):
@@ -2,14 +2,12 @@ from django.core.management.base import BaseCommand, CommandError
 from django.db.models import F
 from django.utils import timezone
 
-import asyncio
-from asgiref.sync import async_to_sync, sync_to_async
-
 import math
 import re
 import copy
 
-from webpage.models import Domain, Referral
+from webpage.models import Domain, DomainLink
+from webpage.canonical import url_hash
 from organize_webpages.models import ThothTag
 
 class Command(BaseCommand):
@@ -19,52 +17,42 @@ class Command(BaseCommand):
         DOMAINS_NUMBER = 100
         SENSITIVITY = 0.9
 
-        @async_to_sync
-        async def get_domain_connections():
+        def get_domain_connections():
             domain_connections = {}
-                
-            @sync_to_async
-            def get_reffers(domain):
 
-                reffers_to = list(map(lambda referral: referral.destination_domain, list(domain.referrs_to.filter(destination_domain__in=included_domains).exclude(destination_domain=domain))))
-                reffers_from = list(map(lambda referral: referral.source_domain, list(domain.referrs_from.filter(source_domain__in=included_domains).exclude(source_domain=domain))))
+            start = timezone.now()
+            included_domains = Domain.objects.filter(is_redirect=False, is_source=True).exclude(time_last_requested=None).order_by(F("time_updated").desc(nulls_last=True))
 
-                connections = reffers_to + reffers_from
-                
-                connections_set = set(connections)
+            # Referrals in either direction between two included domains, read from their links
+            # instead of from every referral
+            links = DomainLink.objects.filter(source_domain__in=included_domains, destination_domain__in=included_domains).exclude(source_domain=F("destination_domain"))
+            counts = {}
+            for source, destination, count in links.values_list("source_domain__url", "destination_domain__url", "count"):
+                counts.setdefault(source, {})
+                counts.setdefault(destination, {})
+                counts[source][destination] = counts[source].get(destination, 0) + count
+                counts[destination][source] = counts[destination].get(source, 0) + count
+
+            for domain in included_domains:
+                connections = counts.get(domain.url, {})
+                total_connections = sum(connections.values())
 
                 connection_count = []
-                for connection in connections_set:
+                for url, count in connections.items():
                     connection_count.append({
-                        "url": connection.url,
-                        "count": connections.count(connection),
-                        "strength": connections.count(connection)/len(connections),
+                        "url": url,
+                        "count": count,
+                        "strength": count/total_connections,
                     })
-                    #print(f' - {connection}')
 
                 domain_connections[domain.url] = {
                     "title": domain.title,
                     "description": domain.description,
                     "connections": connection_count,
-                    "total_connections": len(connections),
+                    "total_connections": total_connections,
                     }
 
-            start = timezone.now()
-            included_domains = Domain.objects.filter(is_redirect=False, is_source=True).exclude(time_last_requested=None).order_by(F("time_updated").desc(nulls_last=True))
-            
-            tasks = []
-            async for domain in included_domains:
-                #tasks.append(asyncio.create_task(get_reffers(domain)))
-                await get_reffers(domain)
-            #await asyncio.gather(*tasks)
-
             print((timezone.now() - start).total_seconds())
-            '''
-            print("---")
-            for domain in domain_connections.keys():
-                for connection in domain_connections[domain]["connections"]:
-                    print(f' - {connection["url"]} {connection["count"]}, {connection["strength"]}')
-            '''
             return domain_connections
 
         def get_match(index, clusters, domain_connections):
@@ -275,7 +263,7 @@ class Command(BaseCommand):
                                 print("what the heck???????")
 
                         for domain in cluster:
-                            domainObject = Domain.objects.get(url=domain)
+                            domainObject = Domain.objects.get(url_hash=url_hash(domain))
                             if not names[i] in domainObject.tags.names():
                                 domainObject.tags.add(names[i], through_defaults={"is_direct": is_direct})
 
@@ -13,6 +13,7 @@ import asyncio
 from asgiref.sync import async_to_sync
 
 from webpage.models import Domain, WebPage
+from webpage.canonical import url_hash
 from webpage.views import DomainSerializer, DomainWithWebpagesSerializer, WebPageSerializer, WebPageWithDomainSerializer
 from organize_webpages.models import ThothTag, ThothTaggedItem
 
@@ -117,7 +118,7 @@ def tag_domains(request):
         url_parse = urlparse(url)
         url = url_parse.scheme + "://" + url_parse.hostname
 
-        domain = Domain.objects.filter(url=url).first()
+        domain = Domain.objects.filter(url_hash=url_hash(url)).first()
 
         if domain == None:
 
@@ -152,7 +153,7 @@ def tag_domains(request):
         url = request.data.get('url')
         tag = request.data.get('tag')
 
-        domain = Domain.objects.filter(url=url).first()
+        domain = Domain.objects.filter(url_hash=url_hash(url)).first()
 
         if domain != None:
             if tag in domain.tags.names():
@@ -173,10 +173,99 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 ALLOWED_HOSTS = ["localhost", '*']
 
+# Crawling runs either from cron or as a resident 'python manage.py crawl' daemon, which keeps the
+# models and connection pools loaded between batches. Both take the CRAWL_LOCK_KEY lock so they
+# never overlap; with the daemon running the cron job finds the lock taken and exits straight away.
 CRONJOBS = [
-    ('*/15 * * * *', 'webpage.views.read_all')
+    ('*/15 * * * *', 'webpage.views.read_all'),
+    # Create the coming months' referral partitions and archive those past REFERRAL_RETENTION_MONTHS
+    ('0 3 * * *', 'django.core.management.call_command', ['referral_partitions']),
 ]
 
+# Logging
+# The crawler logs each webpage it reads at DEBUG, so those messages are off by default
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {
+            "format": "{asctime} {levelname} {name} {message}",
+            "style": "{",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "simple",
+        },
+    },
+    "root": {
+        "handlers": ["console"],
+        "level": "WARNING",
+    },
+    "loggers": {
+        "webpage": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
+# Crawling
+
+CRAWL_MAX_CONCURRENT_DOMAINS = 8        # domains read at the same time
+CRAWL_MAX_CONCURRENT_REQUESTS = 32      # requests in flight across every host
+CRAWL_MAX_REQUESTS_PER_DOMAIN = 2       # requests in flight to a single host
+CRAWL_REQUEST_DELAY = 1                 # seconds between the start of two requests to the same host
+CRAWL_PAGES_PER_DOMAIN = 5              # pages read from a domain each time it is crawled
+CRAWL_DNS_CACHE_TTL = 300               # seconds a host's DNS lookup is reused
+CRAWL_KEEPALIVE_TIMEOUT = 30            # seconds an idle connection is kept open for reuse
+CRAWL_FRONTIER_BATCH_SIZE = 200         # frontier entries leased at once
+CRAWL_LEASE_TIME = 30 * 60              # seconds before a leased frontier entry is due again
+CRAWL_MAX_RUN_TIME = 14 * 60            # seconds 'read_all' keeps leasing batches, less than the cron interval
+CRAWL_WORKER_IDLE_SLEEP = 30            # seconds a crawl worker waits before looking at an empty frontier again
+RECRAWL_MIN_INTERVAL = 30 * 60          # seconds, shortest wait before a source webpage is read again
+RECRAWL_MAX_INTERVAL = 7 * 24 * 60 * 60 # seconds, longest wait before a source webpage is read again
+RECRAWL_DEFAULT_INTERVAL = 3 * 60 * 60  # seconds before a source webpage is read again while nothing is known about how often it changes
+RECRAWL_MAX_GROWTH = 2                  # the wait before the next read is at most this many times the last one
+RECRAWL_PRIOR_WEIGHT = 4                # requests the domain's change history counts for in a webpage's estimate
+CHANGE_HISTORY_SIZE = 16                # changes observed for a webpage that are kept
+DOMAIN_CHANGE_HISTORY_SIZE = 64         # changes observed for the webpages of a domain that are kept
+REFERRAL_COPY_MIN_BATCH = 1000          # referrals saved at once before they are COPYed through a staging table instead of INSERTed
+REFERRAL_LAST_SEEN_RESOLUTION = 24 * 60 * 60 # seconds before seeing a hyperlink again moves its referral's 'last_seen'
+REFERRAL_PARTITIONS_AHEAD = 3           # months of referral partitions created ahead of time
+REFERRAL_RETENTION_MONTHS = 12          # months a referral from a re-read webpage (see 'Referral') is kept after it was last seen, then its partition is archived
+DOMAIN_CACHE_SIZE = 10000               # hostnames whose Domain is kept in memory by each process
+DOMAIN_CACHE_TTL = 5 * 60               # seconds before a cached Domain is looked up again, to see changes made by other processes
+CRAWL_LOCK_KEY = "thoth:crawl"          # advisory lock held by 'read_all' and the 'crawl' daemon so they don't overlap
+CRAWL_WRITE_BUFFER_SIZE = 500           # saves a crawl collects before writing them in bulk
+CRAWL_WRITE_BUFFER_DELAY = 5            # seconds a collected save can wait before it is written
+CRAWL_CONNECT_TIMEOUT = 10              # seconds to connect to a host
+CRAWL_READ_TIMEOUT = 30                 # seconds a host can go quiet while we read its response
+CRAWL_REQUEST_TIMEOUT = 2 * 60          # seconds a whole request can take
+CRAWL_MAX_PAGE_FAILURES = 8             # failed reads in a row before a non-source webpage leaves the frontier
+CRAWL_CIRCUIT_BREAKER_THRESHOLD = 5     # failed requests in a row before a domain is skipped
+CRAWL_CIRCUIT_BREAKER_BACKOFF = 5 * 60  # seconds a domain is first skipped for, doubling with every further failure
+CRAWL_MAX_BACKOFF = 7 * 24 * 60 * 60    # longest backoff in seconds for a webpage or domain
+CRAWL_MAX_BODY_SIZE = {                 # bytes of a response we read, by content type
+    "html": 5 * 1024 * 1024,
+    "pdf": 20 * 1024 * 1024,
+    "json": 10 * 1024 * 1024,
+}
+CRAWL_HTML_BODY_PREFIX = 1024 * 1024    # bytes of html we read after the end of its head
+CRAWL_PARSER_PROCESSES = None           # processes parsing html and PDFs, None for one per CPU
+CRAWL_TEXT_HASH = True                  # also skip html that only changed by nonces, comments and cache busting markup
+ROBOTS_TXT_TTL = 24 * 60 * 60           # seconds before a domain's robots.txt is fetched again
+ROBOTS_TXT_MAX_SIZE = 500 * 1024        # bytes of robots.txt we read, as in RFC 9309
+ROBOTS_TXT_MAX_CRAWL_DELAY = 60         # longest 'Crawl-delay' in seconds we respect
+SITEMAP_TTL = 24 * 60 * 60              # seconds before a source domain's sitemaps are read again
+SITEMAP_MAX_SIZE = 50 * 1024 * 1024     # bytes of (uncompressed) xml we read from one sitemap, as in the sitemaps protocol
+SITEMAP_MAX_FILES = 50                  # sitemaps and sitemap indexes read from one domain each time
+SITEMAP_BATCH_SIZE = 1000               # sitemap urls saved at once
+CRAWL_METRICS_PORT = 9108               # port a crawl worker serves its metrics on, None to not serve them
+
 #start = timezone.now()
 QUESTION_ANSWER_MODEL = SentenceTransformer("msmarco-distilbert-dot-v5")
 #print(f'download question answer model {timezone.now() - start}')
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WebPage, Domain, Referral, Embeddings
+from .models import WebPage, Domain, Referral, DomainLink, Embeddings, Frontier
 # Register your models here.
 
 class WebPageAdmin(admin.ModelAdmin):
@@ -12,7 +12,15 @@ class DomainAdmin(admin.ModelAdmin):
   
 class ReferralAdmin(admin.ModelAdmin):
     search_fields = ['source_webpage__url', 'destination_webpage__url']
-    list_display = ("source_webpage", "destination_webpage")
+    list_display = ("source_webpage", "destination_webpage", "time_discovered", "last_seen")
+
+class DomainLinkAdmin(admin.ModelAdmin):
+    search_fields = ['source_domain__url', 'destination_domain__url']
+    list_display = ("source_domain", "destination_domain", "count", "last_seen")
+
+class FrontierAdmin(admin.ModelAdmin):
+    search_fields = ['url']
+    list_display = ("url", "priority", "next_fetch_at", "lease_expires_at")
 
 class EmbeddingsAdmin(admin.ModelAdmin):
     search_fields = ['webpage__url', 'source_attribute']
@@ -25,4 +33,8 @@ admin.site.register(Domain, DomainAdmin)
 
 admin.site.register(Referral, ReferralAdmin)
 
-admin.site.register(Embeddings, EmbeddingsAdmin)
\ No newline at end of file
+admin.site.register(DomainLink, DomainLinkAdmin)
+
+admin.site.register(Embeddings, EmbeddingsAdmin)
+
+admin.site.register(Frontier, FrontierAdmin)
\ No newline at end of file
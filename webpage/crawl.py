@@ -0,0 +1,705 @@
+import asyncio
+import aiohttp
+import math
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.utils import timezone
+from django.db import transaction, DatabaseError
+from asgiref.sync import sync_to_async
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+
+from thoth.settings import (
+    CRAWL_MAX_CONCURRENT_DOMAINS,
+    CRAWL_MAX_CONCURRENT_REQUESTS,
+    CRAWL_MAX_REQUESTS_PER_DOMAIN,
+    CRAWL_REQUEST_DELAY,
+    CRAWL_PAGES_PER_DOMAIN,
+    CRAWL_DNS_CACHE_TTL,
+    CRAWL_KEEPALIVE_TIMEOUT,
+    CRAWL_CONNECT_TIMEOUT,
+    CRAWL_READ_TIMEOUT,
+    CRAWL_REQUEST_TIMEOUT,
+    CRAWL_MAX_BACKOFF,
+    CRAWL_FRONTIER_BATCH_SIZE,
+    CRAWL_LEASE_TIME,
+    ROBOTS_TXT_MAX_CRAWL_DELAY,
+    CRAWL_PARSER_PROCESSES,
+    RECRAWL_MIN_INTERVAL,
+    RECRAWL_MAX_INTERVAL,
+    RECRAWL_DEFAULT_INTERVAL,
+    RECRAWL_MAX_GROWTH,
+    RECRAWL_PRIOR_WEIGHT,
+    CRAWL_WRITE_BUFFER_SIZE,
+    CRAWL_WRITE_BUFFER_DELAY,
+)
+
+from webpage.metrics import READS, STAGE_SECONDS
+from webpage.robots import prune_robots_cache
+
+logger = logging.getLogger(__name__)
+
+HEADER = {'user-agent': 'The Society of Thoth'}
+
+# Process pool the functions in 'webpage/parsing.py' run on, started by the first 'run_parser()'
+PARSER_POOL = None
+
+# Seconds spent in each stage of reading a webpage, by stage, while 'record_stage_timings()' is on
+STAGE_TIMINGS = None
+
+
+def create_session(limit=CRAWL_MAX_CONCURRENT_REQUESTS, limit_per_host=CRAWL_MAX_REQUESTS_PER_DOMAIN, **connector_kwargs):
+    '''
+    Create an aiohttp session meant to be shared by many requests. Connections are kept alive
+    and reused for every request to the same host and DNS lookups are cached for CRAWL_DNS_CACHE_TTL
+    seconds.
+
+    Requests time out if connecting takes CRAWL_CONNECT_TIMEOUT, if the server goes quiet for
+    CRAWL_READ_TIMEOUT or if the whole request takes CRAWL_REQUEST_TIMEOUT seconds.
+
+    Must be created inside a running event loop and closed when it's no longer needed.
+    '''
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=CRAWL_DNS_CACHE_TTL,
+        keepalive_timeout=CRAWL_KEEPALIVE_TIMEOUT,
+        **connector_kwargs,
+        )
+    timeout = aiohttp.ClientTimeout(
+        total=CRAWL_REQUEST_TIMEOUT,
+        sock_connect=CRAWL_CONNECT_TIMEOUT,
+        sock_read=CRAWL_READ_TIMEOUT,
+        )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADER, max_line_size=8190 * 2, max_field_size=8190 * 2)
+
+
+def backoff(failures, base, maximum=CRAWL_MAX_BACKOFF):
+    '''
+    Seconds to wait after 'failures' consecutive failures: 'base' doubled for every failure
+    after the first, up to 'maximum'
+    '''
+    return min(base * 2 ** (failures - 1), maximum)
+
+
+def estimate_change_rate(history, prior=None, prior_weight=RECRAWL_PRIOR_WEIGHT):
+    '''
+    Changes per second estimated from a change 'history' of [seconds between two requests, 1 if
+    the content changed between them else 0] observations, or None without any observations.
+
+    Uses the estimator of Cho and Garcia-Molina ("Estimating frequency of change"), which unlike
+    changes / time doesn't assume a single change was seen per request: with 'n' requests 'I'
+    seconds apart on average of which 'X' found a change, the rate is -ln((n - X + 0.5) / (n + 0.5)) / I.
+
+    The observations of a 'prior' history (the domain's) count for 'prior_weight' requests in
+    total, so a webpage with little history of its own starts out like the rest of its domain.
+    '''
+    n = len(history)
+    changes = sum(changed for seconds, changed in history)
+    seconds = sum(seconds for seconds, changed in history)
+
+    if prior:
+        weight = min(1, prior_weight / len(prior))
+        n = n + len(prior) * weight
+        changes = changes + sum(changed for prior_seconds, changed in prior) * weight
+        seconds = seconds + sum(prior_seconds for prior_seconds, changed in prior) * weight
+
+    if n == 0 or seconds <= 0:
+        return None
+
+    return -math.log((n - changes + 0.5) / (n + 0.5)) / (seconds / n)
+
+
+def recrawl_interval(history, prior=None):
+    '''
+    Seconds until a webpage with change 'history' (see 'estimate_change_rate()') should be read
+    again: the expected time until its next change, between RECRAWL_MIN_INTERVAL and
+    RECRAWL_MAX_INTERVAL. The interval grows by at most RECRAWL_MAX_GROWTH times the last one,
+    so a few reads that found nothing new don't push a webpage straight to the maximum.
+    '''
+    rate = estimate_change_rate(history, prior)
+    if rate == None:
+        return RECRAWL_DEFAULT_INTERVAL
+
+    interval = RECRAWL_MAX_INTERVAL
+    if rate > 0:
+        interval = 1 / rate
+    if len(history) > 0:
+        interval = min(interval, max(history[-1][0], RECRAWL_MIN_INTERVAL) * RECRAWL_MAX_GROWTH)
+
+    return max(RECRAWL_MIN_INTERVAL, min(interval, RECRAWL_MAX_INTERVAL))
+
+
+def is_host_failure(status_code):
+    '''
+    Whether a failed request points to the host being down or overloaded rather than a single
+    webpage being broken: no response at all, a server error or '429 Too Many Requests'
+    '''
+    return status_code == None or status_code >= 500 or status_code == 429
+
+
+async def read_limited(r, limit, marker=None, after_marker=0):
+    '''
+    Read the body of response 'r' as a stream, stopping once 'limit' bytes have been read.
+    If 'marker' is given, reading also stops 'after_marker' bytes after the marker first appears
+    (compared in lowercase). Returns the body and whether it was cut short.
+
+    Without a marker, a body whose declared 'Content-Length' is over the limit isn't read at all.
+    '''
+    if marker == None and r.content_length != None and r.content_length > limit:
+        return b"", True
+
+    body = bytearray()
+    marker_found = False
+    async for chunk in r.content.iter_chunked(64 * 1024):
+        start = len(body)
+        body.extend(chunk)
+
+        if marker != None and not marker_found:
+            # Look back far enough to catch a marker split between two chunks
+            search_from = max(0, start - len(marker))
+            index = body[search_from:].lower().find(marker)
+            if index != -1:
+                marker_found = True
+                limit = min(limit, search_from + index + len(marker) + after_marker)
+
+        if len(body) >= limit:
+            return bytes(body[:limit]), True
+
+    return bytes(body), False
+
+
+def record_stage_timings():
+    '''
+    Start keeping the duration of every 'timed()' stage. Returns the dictionary they are kept in,
+    a list of seconds for each stage.
+    '''
+    global STAGE_TIMINGS
+    STAGE_TIMINGS = {}
+    return STAGE_TIMINGS
+
+
+def record_stage(stage, seconds):
+    '''
+    Observe the duration of a stage in the 'thoth_stage_seconds' metric, and keep it if
+    'record_stage_timings()' is on
+    '''
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if STAGE_TIMINGS != None:
+        if not stage in STAGE_TIMINGS:
+            STAGE_TIMINGS[stage] = []
+        STAGE_TIMINGS[stage].append(seconds)
+
+
+@contextmanager
+def timed(stage):
+    '''
+    Time the code in the block as 'stage' (see 'record_stage()'). Works around awaits too, in which
+    case the time spent waiting is included.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def get_parser_pool():
+    '''
+    Return the parser process pool, starting it if needed. Processes are spawned rather than forked
+    so they don't inherit the event loop, open connections or the models loaded in 'thoth/settings.py'.
+    '''
+    global PARSER_POOL
+    if PARSER_POOL == None:
+        PARSER_POOL = ProcessPoolExecutor(max_workers=CRAWL_PARSER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return PARSER_POOL
+
+
+def shutdown_parser_pool():
+    '''
+    Stop the parser processes, they are started again by the next 'run_parser()'
+    '''
+    global PARSER_POOL
+    if PARSER_POOL != None:
+        PARSER_POOL.shutdown()
+        PARSER_POOL = None
+
+
+async def run_parser(function, *args):
+    '''
+    Run 'function(*args)' from 'webpage/parsing.py' on the parser process pool so parsing large
+    pages doesn't block the event loop. The arguments and result must be picklable.
+
+    If a parser process dies (for example running out of memory on a broken PDF) the pool is
+    replaced for the next call and the error is raised for this one.
+    '''
+    loop = asyncio.get_running_loop()
+    pool = get_parser_pool()
+    try:
+        return await loop.run_in_executor(pool, function, *args)
+    except BrokenProcessPool:
+        if PARSER_POOL is pool:
+            shutdown_parser_pool()
+        raise
+
+
+@asynccontextmanager
+async def request_session(scheduler, url):
+    '''
+    Wait until a request to 'url' is allowed by 'scheduler' and yield the session to make it with.
+    That is the scheduler's pooled session, or a session opened just for this request if there is
+    no scheduler.
+    '''
+    if scheduler == None:
+        async with create_session() as session:
+            yield session
+    elif scheduler.session == None:
+        async with scheduler.request(url), create_session() as session:
+            yield session
+    else:
+        async with scheduler.request(url):
+            yield scheduler.session
+
+
+async def save_later(scheduler, instance, update_fields=None):
+    '''
+    Save 'instance' through the write buffer of 'scheduler' (see 'WriteBuffer'), or right away if
+    there is no scheduler
+    '''
+    if scheduler == None:
+        await instance.asave(update_fields=update_fields)
+    else:
+        await scheduler.writes.save(instance, update_fields)
+
+
+class WriteBuffer:
+    '''
+    Unit of work for the saves made while crawling. Saves of existing rows are collected with the
+    fields they write and new rows are collected as they are, then all of them are written with
+    'bulk_update()' and 'bulk_create()' in a single transaction:
+        - once 'max_size' rows are waiting
+        - once the first waiting row has waited 'max_delay' seconds, checked on every save and by
+          'CrawlScheduler.flush_writes_when_due()' while no saves come in
+        - on '.flush()', which 'CrawlScheduler' calls after every batch and when it is done
+
+    Saving a row again before it is written adds to the fields written for it. Only rows that
+    nothing needs the id of yet can be created through the buffer. Bulk writes don't send
+    'post_save', 'webpage.models.saved_in_bulk()' does what its receivers would.
+    '''
+
+    def __init__(self, max_size=CRAWL_WRITE_BUFFER_SIZE, max_delay=CRAWL_WRITE_BUFFER_DELAY):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.lock = asyncio.Lock()
+        self.clear()
+
+    def clear(self):
+        # (model, pk) to the instance to write and the names of the fields to write
+        self.updates = {}
+        # id() of the instance to the instance, so saving it twice creates it once
+        self.creates = {}
+        self.first_waiting = None
+
+    def __len__(self):
+        return len(self.updates) + len(self.creates)
+
+    async def save(self, instance, update_fields=None):
+        if instance._state.adding:
+            self.creates[id(instance)] = instance
+        else:
+            if update_fields == None:
+                update_fields = [field.name for field in instance._meta.concrete_fields if not field.primary_key]
+            fields = set(update_fields)
+
+            key = (type(instance), instance.pk)
+            if key in self.updates:
+                waiting, waiting_fields = self.updates[key]
+                if waiting is not instance:
+                    # Another copy of the row, loaded without the changes that are still waiting
+                    for name in waiting_fields - fields:
+                        attname = instance._meta.get_field(name).attname
+                        setattr(instance, attname, getattr(waiting, attname))
+                fields = fields | waiting_fields
+            self.updates[key] = (instance, fields)
+
+        if self.first_waiting == None:
+            self.first_waiting = time.monotonic()
+        if len(self) >= self.max_size or self.is_due():
+            await self.flush()
+
+    def is_due(self):
+        return self.first_waiting != None and time.monotonic() - self.first_waiting >= self.max_delay
+
+    def seconds_until_due(self):
+        '''
+        Seconds until the first waiting row has waited 'max_delay', or 'max_delay' if none is waiting
+        '''
+        if self.first_waiting == None:
+            return self.max_delay
+        return max(0, self.first_waiting + self.max_delay - time.monotonic())
+
+    async def flush_if_due(self):
+        if self.is_due():
+            await self.flush()
+
+    async def flush(self):
+        '''
+        Write every waiting row
+        '''
+        async with self.lock:
+            if len(self) == 0:
+                return
+            updates = list(self.updates.values())
+            creates = list(self.creates.values())
+            self.clear()
+            await sync_to_async(write_rows)(updates, creates)
+
+
+def write_rows(updates, creates):
+    '''
+    Write the rows collected by a WriteBuffer: 'updates' is a list of (instance, names of fields to
+    write) and 'creates' a list of unsaved instances. If the transaction fails, for example because
+    a webpage was deleted in the meantime, the rows are saved one at a time so only the rows that
+    can't be saved are lost.
+    '''
+    # Imported here since the models import this module
+    from webpage.models import saved_in_bulk
+
+    # 'bulk_update()' writes the same fields for every instance
+    update_groups = {}
+    for instance, fields in updates:
+        for name in fields:
+            field = instance._meta.get_field(name)
+            setattr(instance, field.attname, field.pre_save(instance, False))
+        update_groups.setdefault((type(instance), frozenset(fields)), []).append(instance)
+
+    create_groups = {}
+    for instance in creates:
+        create_groups.setdefault(type(instance), []).append(instance)
+
+    try:
+        with transaction.atomic():
+            for model, instances in create_groups.items():
+                model.objects.bulk_create(instances)
+            for (model, fields), instances in update_groups.items():
+                model.objects.bulk_update(instances, list(fields))
+    except DatabaseError as e:
+        logger.warning("error writing %s buffered rows, saving them one at a time, %s", len(updates) + len(creates), e)
+        for instance in creates:
+            instance.pk = None
+            instance._state.adding = True
+        for instance, fields in [(instance, None) for instance in creates] + updates:
+            try:
+                instance.save(update_fields=fields)
+            except DatabaseError as e:
+                logger.warning("error saving %s %s, %s", type(instance).__name__, instance.pk, e)
+        return
+
+    for model, instances in create_groups.items():
+        saved_in_bulk(model, instances, created=True)
+    for (model, fields), instances in update_groups.items():
+        saved_in_bulk(model, instances)
+
+
+class HostLimiter:
+    '''
+    Politeness for a single host. At most 'max_requests' requests can be in flight to the host
+    and the start of each request is spaced at least 'delay' seconds from the one before it.
+
+    Use as an async context manager around a request:
+        async with limiter:
+            ...
+    '''
+
+    def __init__(self, max_requests, delay):
+        self.semaphore = asyncio.Semaphore(max_requests)
+        self.delay = delay
+        self.lock = asyncio.Lock()
+        self.time_next_request = 0
+        self.in_flight = 0
+
+    def is_idle(self):
+        '''
+        No request is in flight or waiting on the delay, so forgetting the host loses nothing
+        '''
+        return self.in_flight == 0 and time.monotonic() >= self.time_next_request
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        self.in_flight = self.in_flight + 1
+        try:
+            async with self.lock:
+                wait = self.time_next_request - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.time_next_request = time.monotonic() + self.delay
+        except BaseException:
+            self.in_flight = self.in_flight - 1
+            self.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.in_flight = self.in_flight - 1
+        self.semaphore.release()
+
+
+class RequestSlot:
+    '''
+    Holds one slot of the scheduler's global request limit and one slot of a host's limit
+    for the duration of a request
+    '''
+
+    def __init__(self, scheduler, host_limiter):
+        self.scheduler = scheduler
+        self.host_limiter = host_limiter
+
+    async def __aenter__(self):
+        await self.host_limiter.__aenter__()
+        try:
+            await self.scheduler.request_semaphore.acquire()
+        except BaseException:
+            await self.host_limiter.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.scheduler.request_semaphore.release()
+        await self.host_limiter.__aexit__(*exc_info)
+
+
+class CrawlScheduler:
+    '''
+    Crawls many domains concurrently.
+
+    Limits:
+        max_domains: How many domains are being read at the same time
+        max_requests: How many requests can be in flight across every host
+        max_requests_per_domain: How many requests can be in flight to a single host
+        request_delay: Minimum number of seconds between the start of two requests to the same host
+
+    The defaults come from the CRAWL_* values in 'thoth/settings.py'. 'connector_kwargs' are passed
+    on to the session's connector (see 'create_session()').
+
+    Use as an async context manager so every request made during the crawl shares one pooled session:
+        async with CrawlScheduler() as scheduler:
+            await scheduler.crawl(domains)
+
+    'stop()' can be called from any thread, or a signal handler, to end 'crawl_frontier()' after the
+    batch it is reading.
+    '''
+
+    def __init__(
+            self,
+            max_domains=CRAWL_MAX_CONCURRENT_DOMAINS,
+            max_requests=CRAWL_MAX_CONCURRENT_REQUESTS,
+            max_requests_per_domain=CRAWL_MAX_REQUESTS_PER_DOMAIN,
+            request_delay=CRAWL_REQUEST_DELAY,
+            pages_per_domain=CRAWL_PAGES_PER_DOMAIN,
+            connector_kwargs=None,
+            ):
+        self.max_requests = max_requests
+        self.max_requests_per_domain = max_requests_per_domain
+        self.request_delay = request_delay
+        self.pages_per_domain = pages_per_domain
+
+        self.domain_semaphore = asyncio.Semaphore(max_domains)
+        self.request_semaphore = asyncio.Semaphore(max_requests)
+        self.hosts = {}
+
+        self.session = None
+        self.connector_kwargs = connector_kwargs or {}
+
+        # Number of webpage reads by outcome, see 'count_read()'
+        self.stats = {"read": 0, "not modified": 0, "unchanged": 0, "failed": 0}
+
+        self.loop = None
+        self.stop_event = None
+        self.stopping = False
+
+        # Saves made while crawling, see 'save_later()', and the task writing them when they are due
+        self.writes = WriteBuffer()
+        self.writes_flusher = None
+
+    async def __aenter__(self):
+        self.session = create_session(limit=self.max_requests, limit_per_host=self.max_requests_per_domain, **self.connector_kwargs)
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        if self.stopping:
+            self.stop_event.set()
+        self.writes_flusher = asyncio.create_task(self.flush_writes_when_due())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        try:
+            self.writes_flusher.cancel()
+            await asyncio.gather(self.writes_flusher, return_exceptions=True)
+            await self.writes.flush()
+        finally:
+            await self.session.close()
+            self.session = None
+
+    async def flush_writes_when_due(self):
+        '''
+        Write the buffered saves once the first of them has waited CRAWL_WRITE_BUFFER_DELAY, so they
+        aren't held until the end of a batch that is slowed down by a throttled host. Runs until
+        the scheduler is closed.
+        '''
+        while True:
+            await asyncio.sleep(self.writes.seconds_until_due())
+            try:
+                # Shielded so closing the scheduler doesn't interrupt a write half way
+                await asyncio.shield(self.writes.flush_if_due())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("error writing buffered rows")
+
+    def stop(self):
+        '''
+        Ask 'crawl_frontier()' to stop once the batch it is reading is done. Wakes it if it is
+        waiting for entries to be due.
+        '''
+        self.stopping = True
+        if self.loop != None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def wait_for_stop(self, timeout):
+        '''
+        Sleep 'timeout' seconds, or less if 'stop()' is called
+        '''
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def prune_hosts(self):
+        '''
+        Forget the HostLimiters of hosts that are idle, so a long running crawl doesn't keep one
+        for every host it ever requested. Crawl delays are set again when robots.txt is checked.
+        '''
+        self.hosts = {host: limiter for host, limiter in self.hosts.items() if not limiter.is_idle()}
+
+    def host_limiter(self, url):
+        '''
+        Return the HostLimiter for the host of 'url', setting one up if this is the first
+        request to the host
+        '''
+        host = urlparse(url).hostname
+        if not host in self.hosts:
+            self.hosts[host] = HostLimiter(self.max_requests_per_domain, self.request_delay)
+        return self.hosts[host]
+
+    def set_crawl_delay(self, url, crawl_delay):
+        '''
+        Space out requests to the host of 'url' by its robots.txt 'Crawl-delay' if that's longer than
+        our own delay. Delays over ROBOTS_TXT_MAX_CRAWL_DELAY are capped so a host can't stall its crawl.
+        '''
+        delay = self.request_delay
+        if crawl_delay != None:
+            delay = max(delay, min(crawl_delay, ROBOTS_TXT_MAX_CRAWL_DELAY))
+        self.host_limiter(url).delay = delay
+
+    def count_read(self, outcome):
+        '''
+        Count a webpage read by its outcome:
+            read: The response was parsed
+            not modified: The server answered '304 Not Modified'
+            unchanged: The body was the same as last time so parsing was skipped
+            failed: An error or a 4xx/5xx response
+        '''
+        self.stats[outcome] = self.stats[outcome] + 1
+        READS.inc(outcome=outcome)
+
+    def skip_rate(self):
+        '''
+        Share of successful reads where parsing was skipped because the webpage hadn't changed
+        '''
+        skipped = self.stats["not modified"] + self.stats["unchanged"]
+        total = skipped + self.stats["read"]
+        if total == 0:
+            return 0
+        return skipped / total
+
+    def report(self):
+        stats = ", ".join(f"{outcome}: {count}" for outcome, count in self.stats.items())
+        return f"{stats}, skip rate: {self.skip_rate():.1%}"
+
+    def request(self, url):
+        '''
+        Async context manager that waits until a request to 'url' is allowed
+        '''
+        return RequestSlot(self, self.host_limiter(url))
+
+    async def crawl_domain(self, domain, entries=None):
+        '''
+        Read webpages from a single domain once a domain slot is free. Reads the leased frontier
+        'entries' if given, otherwise leases the domain's next due webpages.
+        '''
+        async with self.domain_semaphore:
+            try:
+                if entries == None:
+                    return await domain.read_webpages(count=self.pages_per_domain, scheduler=self)
+                return await domain.read_frontier(entries, scheduler=self)
+            except Exception:
+                logger.exception("error crawling %s", domain.url)
+                return []
+
+    async def crawl(self, domains):
+        '''
+        Read webpages from every domain in 'domains', crawling up to 'max_domains' at once
+        '''
+        tasks = [asyncio.create_task(self.crawl_domain(domain)) for domain in domains]
+        return await asyncio.gather(*tasks)
+
+    async def crawl_entries(self, entries):
+        '''
+        Read the webpages of leased frontier 'entries', grouped by domain and crawling up to
+        'max_domains' domains at once
+        '''
+        domains = {}
+        entries_by_domain = {}
+        for entry in entries:
+            if not entry.domain_id in domains:
+                domains[entry.domain_id] = entry.domain
+                entries_by_domain[entry.domain_id] = []
+            entries_by_domain[entry.domain_id].append(entry)
+
+        tasks = [asyncio.create_task(self.crawl_domain(domains[domain_id], entries_by_domain[domain_id])) for domain_id in domains]
+        return await asyncio.gather(*tasks)
+
+    async def crawl_frontier(self, worker_id=None, batch_size=CRAWL_FRONTIER_BATCH_SIZE, lease=CRAWL_LEASE_TIME, deadline=None, idle_sleep=None):
+        '''
+        Lease batches of due frontier entries and read them. No new batch is leased once 'deadline'
+        has passed or 'stop()' was called. When nothing is due we stop, or wait 'idle_sleep' seconds
+        and look again if it's given.
+
+        The frontier is the crawl's checkpoint: every read entry is rescheduled as its domain
+        finishes, and entries still leased by 'worker_id' when we stop are released so they are due
+        again straight away instead of once their lease expires.
+        '''
+        # Imported here since the models import this module
+        from webpage.models import Frontier
+
+        try:
+            while not self.stopping and (deadline == None or timezone.now() < deadline):
+                entries = await Frontier.objects.adequeue(limit=batch_size, per_domain=self.pages_per_domain, lease=lease, worker_id=worker_id)
+                if len(entries) == 0:
+                    if idle_sleep == None:
+                        break
+                    await self.wait_for_stop(idle_sleep)
+                    continue
+
+                await self.crawl_entries(entries)
+                await self.writes.flush()
+                self.prune_hosts()
+                prune_robots_cache()
+                logger.info("crawled %s frontier entries, %s", len(entries), self.report())
+        finally:
+            if worker_id != None:
+                released = await Frontier.objects.arelease(worker_id)
+                if released > 0:
+                    logger.info("released %s frontier entries leased by %s", released, worker_id)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from webpage.models import DomainLink
+
+class Command(BaseCommand):
+    help = "Count every referral into the links between domains (see 'DomainLink'), replacing the counts there are. Can be run again to correct counts after referrals were deleted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--domain", type=int, action="append", help="Id of a domain to count the links of, can be given more than once. Every domain by default")
+
+    def handle(self, *args, **options):
+        links = DomainLink.objects.rebuild(options["domain"])
+        self.stdout.write(f"counted {links} domain links")
@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+import time
+from asgiref.sync import async_to_sync
+from urllib.parse import urlparse
+
+from webpage.models import Domain, WebPage, DOMAIN_CACHE
+from webpage.crawl import CrawlScheduler, record_stage_timings
+from webpage.replay import load_corpus, ReplayServer
+
+class Command(BaseCommand):
+    help = "Crawl a recorded corpus (see 'webpage/replay.py' and the 'record_corpus' command) from a local replay server into a test database and report pages/sec, queries/page and the latency of each stage of reading a webpage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("corpus", help="Corpus file to replay")
+        parser.add_argument("--seed", action="append", default=[], help="Domain to start crawling from, can be given more than once. Defaults to every domain in the corpus")
+        parser.add_argument("--mode", choices=["frontier", "domains"], default="frontier", help="Crawl like 'read_all' (frontier) or like 'read_single_domain' for every domain (domains)")
+        parser.add_argument("--max-time", type=int, default=10 * 60, help="Seconds to crawl for at most")
+        parser.add_argument("--request-delay", type=float, default=0, help="Seconds between the start of two requests to the same host")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs")
+
+    def handle(self, *args, **options):
+        corpus = load_corpus(options["corpus"])
+        if len(corpus) == 0:
+            raise CommandError("The corpus is empty")
+
+        seeds = [seed.replace("https://", "http://") for seed in options["seed"]]
+        if len(seeds) == 0:
+            seeds = sorted(set(f"http://{urlparse(url).hostname}" for url in corpus))
+
+        self.stdout.write(f"{len(corpus)} recorded responses, {len(seeds)} domains")
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            for seed in seeds:
+                domain = Domain.objects.get_domain_from_url(seed)
+                Domain.objects.filter(id=domain.id).update(is_source=True)
+                DOMAIN_CACHE.invalidate(urlparse(domain.url).hostname)
+                WebPage.objects.filter(domain=domain, level=0).update(is_source=True)
+
+            timings = record_stage_timings()
+            queries = []
+
+            def count_queries(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count_queries):
+                start = time.perf_counter()
+                stats, server_requests = crawl(corpus, options)
+                seconds = time.perf_counter() - start
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+
+        pages = sum(stats.values())
+        if pages == 0:
+            raise CommandError("No webpages were read")
+
+        self.stdout.write(f"{pages} webpages read in {seconds:.1f}s ({server_requests} requests to the replay server)")
+        self.stdout.write(", ".join(f"{outcome}: {count}" for outcome, count in stats.items()))
+        self.stdout.write(f"pages/sec: {pages / seconds:.2f}")
+        self.stdout.write(f"queries/page: {len(queries) / pages:.1f} ({len(queries)} queries)")
+
+        self.stdout.write(f"{'stage':<12}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'total s':>10}")
+        for stage, durations in sorted(timings.items()):
+            durations = sorted(durations)
+            self.stdout.write(f"{stage:<12}{len(durations):>8}{percentile(durations, 50) * 1000:>10.1f}{percentile(durations, 99) * 1000:>10.1f}{sum(durations):>10.1f}")
+
+
+def percentile(durations, p):
+    '''
+    The 'p'th percentile of the sorted list 'durations'
+    '''
+    if len(durations) == 0:
+        return 0
+    return durations[min(len(durations) - 1, round(p / 100 * (len(durations) - 1)))]
+
+
+@async_to_sync
+async def crawl(corpus, options):
+    '''
+    Crawl from the replay server until nothing is due or '--max-time' has passed. Returns the
+    scheduler's read counts and the number of requests the replay server answered.
+    '''
+    deadline = timezone.now() + timezone.timedelta(seconds=options["max_time"])
+
+    async with ReplayServer(corpus) as server:
+        async with CrawlScheduler(request_delay=options["request_delay"], connector_kwargs={"resolver": server.resolver()}) as scheduler:
+            if options["mode"] == "frontier":
+                await scheduler.crawl_frontier(deadline=deadline)
+            else:
+                # Like 'read_single_domain' for every domain, until a round reads nothing
+                reads = -1
+                while reads != sum(scheduler.stats.values()) and timezone.now() < deadline:
+                    reads = sum(scheduler.stats.values())
+                    domains = [domain async for domain in Domain.objects.filter(is_source=True)]
+                    await scheduler.crawl(domains)
+
+        return scheduler.stats, server.requests
@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import os
+import time
+from asgiref.sync import async_to_sync
+
+from webpage.models import WebPage
+from webpage.crawl import create_session, read_limited
+from webpage.parsing import parse_html, parse_html_soup
+from thoth.settings import CRAWL_MAX_BODY_SIZE
+
+class Command(BaseCommand):
+    help = "Compare how many html pages per second 'parse_html' (lxml, single pass) and 'parse_html_soup' (BeautifulSoup) parse, and list the fields where their results differ"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help="Html files, or directories searched for .html and .htm files")
+        parser.add_argument("--fetch", type=int, default=0, help="Also download this many recently read html webpages from the database")
+        parser.add_argument("--repeat", type=int, default=3, help="Times every page is parsed by each parser")
+        parser.add_argument("--show", type=int, default=5, help="Differences printed for each field")
+
+    def handle(self, *args, **options):
+        pages = []
+        for path in options["paths"]:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    for file in sorted(files):
+                        if file.endswith(".html") or file.endswith(".htm"):
+                            pages.append((os.path.join(root, file), read_file(os.path.join(root, file))))
+            else:
+                pages.append((path, read_file(path)))
+
+        if options["fetch"] > 0:
+            pages = pages + fetch_pages(options["fetch"], self.stdout)
+
+        if len(pages) == 0:
+            raise CommandError("No pages to parse, give html files or use --fetch")
+
+        total_bytes = sum(len(body) for url, body in pages)
+        self.stdout.write(f"{len(pages)} pages, {total_bytes / 1024 / 1024:.1f} MiB")
+
+        results = {}
+        for name, parser in [("soup", parse_html_soup), ("lxml", parse_html)]:
+            start = time.perf_counter()
+            for i in range(options["repeat"]):
+                results[name] = [parser(body) for url, body in pages]
+            seconds = time.perf_counter() - start
+
+            pages_per_second = len(pages) * options["repeat"] / seconds
+            results[name + " speed"] = pages_per_second
+            self.stdout.write(f"{name}: {pages_per_second:.1f} pages/sec, {total_bytes * options['repeat'] / seconds / 1024 / 1024:.1f} MiB/sec")
+
+        self.stdout.write(f"speedup: {results['lxml speed'] / results['soup speed']:.2f}x")
+
+        mismatches = {}
+        for (url, body), soup_page, lxml_page in zip(pages, results["soup"], results["lxml"]):
+            for field in soup_page:
+                if soup_page[field] != lxml_page[field]:
+                    if not field in mismatches:
+                        mismatches[field] = []
+                    mismatches[field].append((url, soup_page[field], lxml_page[field]))
+
+        if len(mismatches) == 0:
+            self.stdout.write("no fields differ")
+
+        for field in mismatches:
+            self.stdout.write(f"{field}: differs on {len(mismatches[field])} of {len(pages)} pages")
+            for url, soup_value, lxml_value in mismatches[field][:options["show"]]:
+                if field == "anchors":
+                    # Only show the anchors that differ
+                    soup_value, lxml_value = [anchor for anchor in soup_value if not anchor in lxml_value], [anchor for anchor in lxml_value if not anchor in soup_value]
+                self.stdout.write(f" - {url}\n    soup: {str(soup_value)[:300]}\n    lxml: {str(lxml_value)[:300]}")
+
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+@async_to_sync
+async def fetch_pages(count, stdout):
+    '''
+    Download up to 'count' html webpages that were read most recently, reporting errors to 'stdout'
+    '''
+    urls = [url async for url in WebPage.objects.exclude(time_last_requested=None).exclude(page_type__in=["wordpress api", "wordpress api index"]).filter(is_redirect=False).order_by("-time_last_requested").values_list("url", flat=True)[:count]]
+
+    pages = []
+    async with create_session() as session:
+        for url in urls:
+            try:
+                async with session.get(url) as r:
+                    if r.status != 200 or not "text/html" in r.headers.get("content-type", ""):
+                        continue
+                    body, truncated = await read_limited(r, CRAWL_MAX_BODY_SIZE["html"])
+                    pages.append((url, body))
+            except Exception as e:
+                stdout.write(f"error fetching {url}, {e}")
+    return pages
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from webpage.models import Domain, WebPage, Frontier, Referral
+from webpage.canonical import url_hash
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot crawler and feed queries and check that each one uses the index made for it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--allow-seqscan", action="store_true", help="Let the planner choose sequential scans. By default they are turned off, since a small database is quicker to scan than to read through an index and the plan wouldn't show whether the index can be used")
+        parser.add_argument("--show-plans", action="store_true", help="Print every plan")
+
+    def handle(self, *args, **options):
+        domain = Domain.objects.filter(is_source=True).first() or Domain.objects.first()
+        webpage = WebPage.objects.first()
+        if domain == None or webpage == None:
+            raise CommandError("The database needs at least one domain and webpage to explain queries with")
+
+        missing = []
+        with transaction.atomic():
+            if not options["allow_seqscan"]:
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+
+            for name, queryset, index in hot_queries(domain, webpage):
+                plan = queryset.explain()
+                uses_index = any(index_name in plan for index_name in index_and_partitions(index))
+                if not uses_index:
+                    missing.append(name)
+
+                self.stdout.write(f"{'ok' if uses_index else 'MISSING':<8} {name} ({index})")
+                if options["show_plans"] or not uses_index:
+                    self.stdout.write(plan + "\n")
+
+        if len(missing) > 0:
+            raise CommandError(f"{len(missing)} queries don't use their index: {', '.join(missing)}")
+
+
+def index_and_partitions(index):
+    '''
+    Name of 'index' and of the indexes Postgres made for it on every partition of a partitioned
+    table, which the plans of queries on the partitions use
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            WITH RECURSIVE partitions AS (
+                SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s)
+                UNION ALL
+                SELECT pg_inherits.inhrelid FROM pg_inherits JOIN partitions ON pg_inherits.inhparent = partitions.inhrelid
+            )
+            SELECT relname FROM pg_class JOIN partitions ON pg_class.oid = partitions.inhrelid
+        ''', [index])
+        return [index] + [row[0] for row in cursor.fetchall()]
+
+
+def hot_queries(domain, webpage):
+    '''
+    (name, queryset, name of the index it should use) for each query, in the shape the code runs it.
+    On a partitioned table the index is the one declared on the table, see 'index_and_partitions()'.
+    '''
+    feed_ordering = [F("time_updated").desc(nulls_last=True), F("time_last_requested").desc(nulls_last=True)]
+    now = timezone.now()
+
+    return [
+        ("webpage feed", WebPage.objects.filter(is_redirect=False, domain__is_redirect=False).order_by(*feed_ordering)[:20], "webpage_feed_idx"),
+        ("domain feed", Domain.objects.filter(is_redirect=False).order_by(*feed_ordering)[:20], "domain_feed_idx"),
+        ("unrequested domain feed", Domain.objects.filter(is_redirect=False, time_last_requested=None).order_by(*feed_ordering)[:20], "domain_unrequested_feed_idx"),
+        ("latest webpages of a domain", WebPage.objects.filter(domain=domain, is_redirect=False).order_by(*feed_ordering)[:5], "webpage_domain_feed_idx"),
+        ("wordpress api index of a domain", WebPage.objects.filter(domain=domain, page_type="wordpress api index")[:1], "webpage_domain_wp_idx"),
+        ("webpage by url", WebPage.objects.filter(url_hash=url_hash(webpage.url)), "url_hash"),
+        ("domain by url", Domain.objects.filter(url_hash=url_hash(domain.url)), "url_hash"),
+        ("due frontier entries", Frontier.objects.filter(next_fetch_at__lte=now).order_by("next_fetch_at", "priority")[:200], "frontier_due_idx"),
+        ("due frontier entries of a domain", Frontier.objects.filter(domain=domain, next_fetch_at__lte=now).order_by("next_fetch_at", "priority")[:5], "frontier_domain_due_idx"),
+        ("frontier entries leased by a worker", Frontier.objects.filter(leased_by="worker", lease_expires_at__isnull=False), "frontier_leased_idx"),
+        ("referrals from a webpage", Referral.objects.filter(source_webpage=webpage), "referral_edge_idx"),
+    ]
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+import signal
+import socket
+from contextlib import nullcontext
+from asgiref.sync import async_to_sync
+
+from thoth.settings import CRAWL_FRONTIER_BATCH_SIZE, CRAWL_LEASE_TIME, CRAWL_WORKER_IDLE_SLEEP, CRAWL_METRICS_PORT
+from webpage.models import Frontier, crawl_lock
+from webpage.crawl import CrawlScheduler, shutdown_parser_pool
+from webpage.metrics import start_metrics_server, observe_query
+
+class Command(BaseCommand):
+    help = "Crawl the frontier from a resident process instead of cron. The models, connection pool, parser processes and robots.txt cache stay loaded between batches. Holds the crawl lock so 'read_all' can't run at the same time, stops after the current batch on SIGTERM or SIGINT and releases its leases, so the next start carries on where it stopped"
+
+    # Whether to take the crawl lock, so only one of these runs at a time
+    exclusive = True
+
+    def default_worker_id(self):
+        # The same id every start, so a restart releases the entries a killed run still had leased
+        return f"crawl-{socket.gethostname()}"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--worker-id", default=self.default_worker_id(), help="Saved on the frontier entries this worker leases")
+        parser.add_argument("--batch-size", type=int, default=CRAWL_FRONTIER_BATCH_SIZE, help="Frontier entries leased at once")
+        parser.add_argument("--lease", type=int, default=CRAWL_LEASE_TIME, help="Seconds before an entry leased by a worker that died is due again")
+        parser.add_argument("--once", action="store_true", help="Stop once nothing in the frontier is due")
+        parser.add_argument("--metrics-port", type=int, default=CRAWL_METRICS_PORT, help="Port to serve the crawl metrics on at '/metrics', 0 to not serve them")
+
+    def handle(self, *args, **options):
+        idle_sleep = CRAWL_WORKER_IDLE_SLEEP
+        if options["once"]:
+            idle_sleep = None
+
+        worker_id = options["worker_id"]
+        scheduler = CrawlScheduler()
+
+        @async_to_sync
+        async def crawl():
+            metrics_server = None
+            if options["metrics_port"]:
+                metrics_server = await start_metrics_server(options["metrics_port"])
+
+            try:
+                async with scheduler:
+                    await scheduler.crawl_frontier(
+                        worker_id=worker_id,
+                        batch_size=options["batch_size"],
+                        lease=options["lease"],
+                        idle_sleep=idle_sleep,
+                        )
+            finally:
+                if metrics_server != None:
+                    await metrics_server.cleanup()
+
+        previous_handlers = {}
+
+        def stop(signum, frame):
+            self.stdout.write(f"{signal.Signals(signum).name} received, stopping after the current batch")
+            # A second signal stops us straight away
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            scheduler.stop()
+
+        # Both the lock and the queries belong to this thread's connection, the ORM runs our
+        # queries on it
+        with crawl_lock() if self.exclusive else nullcontext(True) as acquired:
+            if not acquired:
+                raise CommandError("Another crawl is running")
+
+            released = Frontier.objects.release(worker_id)
+            self.stdout.write(f"crawl worker {worker_id} started, released {released} entries from its last run")
+
+            for signum in [signal.SIGTERM, signal.SIGINT]:
+                previous_handlers[signum] = signal.signal(signum, stop)
+
+            try:
+                with connection.execute_wrapper(observe_query):
+                    crawl()
+            finally:
+                for signum, handler in previous_handlers.items():
+                    signal.signal(signum, handler)
+                shutdown_parser_pool()
+
+        self.stdout.write(f"crawl worker {worker_id} stopped, {scheduler.report()}")
@@ -0,0 +1,12 @@
+import os
+import socket
+
+from webpage.management.commands.crawl import Command as CrawlCommand
+
+class Command(CrawlCommand):
+    help = "Lease due webpages from the crawl frontier and read them. Any number of workers, on any number of machines, can run against the same database without reading the same webpage twice. Like 'crawl', but without the crawl lock"
+
+    exclusive = False
+
+    def default_worker_id(self):
+        return f"{socket.gethostname()}-{os.getpid()}"
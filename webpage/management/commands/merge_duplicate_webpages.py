@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from urllib.parse import urlparse
+
+from webpage.models import Domain, WebPage, Referral, DomainLink, Embeddings, Frontier, DOMAIN_CACHE
+from webpage.canonical import url_hash
+from organize_webpages.models import ThothTaggedItem
+
+class Command(BaseCommand):
+    help = "Merge every domain and webpage whose url is another way of writing the url of an existing one (rows left without a 'url_hash', see 'webpage/canonical.py') into the existing row"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only count the duplicates")
+
+    def handle(self, *args, **options):
+        total_merged = 0
+        # Domains first, so the webpages of a duplicate domain are moved before webpages are merged
+        for model, merge in [(Domain, merge_domain), (WebPage, merge_webpage)]:
+            merged = 0
+            rehashed = 0
+            for duplicate in model.objects.filter(url_hash=None).order_by("id").iterator():
+                original = model.objects.filter(url_hash=url_hash(duplicate.url)).first()
+                if options["dry_run"]:
+                    merged = merged + (original != None)
+                    continue
+
+                with transaction.atomic():
+                    if original == None:
+                        # The row it duplicated is gone, so this one takes the hash
+                        model.objects.filter(id=duplicate.id).update(url_hash=url_hash(duplicate.url))
+                        rehashed = rehashed + 1
+                    else:
+                        merge(duplicate, original)
+                        merged = merged + 1
+
+            self.stdout.write(f"{model.__name__}: merged {merged} duplicates, rehashed {rehashed}")
+            total_merged = total_merged + merged
+
+        if total_merged > 0 and not options["dry_run"]:
+            # Referrals were moved and deleted around 'Referral.objects.add_edges()'
+            links = DomainLink.objects.rebuild()
+            self.stdout.write(f"rebuilt {links} domain links")
+
+
+def move_tags(model, duplicate, original):
+    '''
+    Give 'original' the tags of 'duplicate' that it doesn't have yet
+    '''
+    content_type = ContentType.objects.get_for_model(model)
+    original_tags = ThothTaggedItem.objects.filter(content_type=content_type, object_id=original.id).values("tag_id")
+    tagged_items = ThothTaggedItem.objects.filter(content_type=content_type, object_id=duplicate.id)
+    tagged_items.filter(tag_id__in=original_tags).delete()
+    tagged_items.update(object_id=original.id)
+
+
+def merge_domain(duplicate, original):
+    '''
+    Move everything that belongs to 'duplicate' to 'original', then delete it
+    '''
+    WebPage.objects.filter(domain=duplicate).update(domain=original)
+    Frontier.objects.filter(domain=duplicate).update(domain=original)
+    Embeddings.objects.filter(domain=duplicate).update(domain=original)
+    Referral.objects.filter(source_domain=duplicate).update(source_domain=original)
+    Referral.objects.filter(destination_domain=duplicate).update(destination_domain=original)
+    move_tags(Domain, duplicate, original)
+
+    if duplicate.is_source and not original.is_source:
+        Domain.objects.filter(id=original.id).update(is_source=True)
+        DOMAIN_CACHE.invalidate(urlparse(original.url).hostname)
+
+    duplicate.delete()
+    # The webpages were moved with '.update()'
+    Domain.objects.repair_aggregates([original.id])
+
+
+def merge_webpage(duplicate, original):
+    '''
+    Point the referrals and embeddings of 'duplicate' at 'original', skipping what 'original'
+    already has, then delete it
+    '''
+    outgoing = Referral.objects.filter(source_webpage=original).values("destination_webpage_id")
+    Referral.objects.filter(source_webpage=duplicate, destination_webpage_id__in=outgoing).delete()
+    Referral.objects.filter(source_webpage=duplicate).update(source_webpage=original, source_domain_id=original.domain_id)
+
+    incoming = Referral.objects.filter(destination_webpage=original).values("source_webpage_id")
+    Referral.objects.filter(destination_webpage=duplicate, source_webpage_id__in=incoming).delete()
+    Referral.objects.filter(destination_webpage=duplicate).update(destination_webpage=original, destination_domain_id=original.domain_id)
+
+    attributes = Embeddings.objects.filter(webpage=original).values("source_attribute")
+    Embeddings.objects.filter(webpage=duplicate).exclude(source_attribute__in=attributes).update(webpage=original, domain_id=original.domain_id)
+
+    move_tags(WebPage, duplicate, original)
+
+    if duplicate.is_source and not original.is_source:
+        WebPage.objects.filter(id=original.id).update(is_source=True)
+
+    # Its frontier entry and remaining embeddings go with it
+    duplicate.delete()
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+from asgiref.sync import async_to_sync
+from urllib.parse import urljoin
+
+from webpage.models import Domain, WebPage
+from webpage.crawl import CrawlScheduler, read_limited
+from webpage.replay import make_record
+from thoth.settings import CRAWL_MAX_BODY_SIZE
+
+class Command(BaseCommand):
+    help = "Record the responses for webpages in the database to a corpus file that 'benchmark_crawl' can replay (see 'webpage/replay.py')"
+
+    def add_arguments(self, parser):
+        parser.add_argument("corpus", help="Corpus file to write")
+        parser.add_argument("--domain", action="append", default=[], help="Url of a domain to record, can be given more than once")
+        parser.add_argument("--url", action="append", default=[], help="Extra url to record, can be given more than once")
+        parser.add_argument("--max-pages", type=int, default=200, help="Webpages recorded from each domain at most")
+
+    def handle(self, *args, **options):
+        urls = list(options["url"])
+        for domain_url in options["domain"]:
+            domain = Domain.objects.get_domain_from_url(domain_url, create_if_not_existing=False)
+            if domain == None:
+                raise CommandError(f"No domain for {domain_url}")
+
+            urls.append(domain.url + "/robots.txt")
+            urls.append(domain.url + "/sitemap.xml")
+            # Homepage and WordPress api pages first, since crawling the domain starts from them
+            webpages = WebPage.objects.filter(domain=domain).order_by("level", "-time_last_requested")
+            urls = urls + list(webpages.values_list("url", flat=True)[:options["max_pages"]])
+
+        if len(urls) == 0:
+            raise CommandError("Nothing to record, use --domain or --url")
+
+        records = record(urls, self.stdout)
+
+        with open(options["corpus"], "w") as file:
+            for r in records:
+                file.write(json.dumps(r) + "\n")
+
+        self.stdout.write(f"recorded {len(records)} responses to {options['corpus']}")
+
+
+@async_to_sync
+async def record(urls, stdout):
+    '''
+    Request every url without following redirects and return their corpus records. Redirect
+    targets are recorded too. Progress is written to 'stdout'.
+    '''
+    records = []
+    recorded = set()
+    max_size = max(CRAWL_MAX_BODY_SIZE.values())
+
+    async with CrawlScheduler() as scheduler:
+        while len(urls) > 0:
+            url = urls.pop(0)
+            if url in recorded:
+                continue
+            recorded.add(url)
+
+            try:
+                async with scheduler.request(url):
+                    async with scheduler.session.get(url, allow_redirects=False) as r:
+                        body, truncated = await read_limited(r, max_size)
+                        records.append(make_record(url, r.status, dict(r.headers), body))
+
+                        if r.status in [301, 302, 303, 307, 308] and "Location" in r.headers:
+                            urls.append(urljoin(url, r.headers["Location"]))
+                stdout.write(f" - recorded {r.status} {url}")
+            except Exception as e:
+                stdout.write(f"error recording {url}, {e}")
+
+    return records
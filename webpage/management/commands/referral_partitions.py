@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from thoth.settings import REFERRAL_PARTITIONS_AHEAD, REFERRAL_RETENTION_MONTHS
+from webpage.models import Referral
+
+class Command(BaseCommand):
+    help = "Create the referral partitions of the coming months and archive the partitions of referrals that haven't been seen for the retention period (see 'Referral')"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=REFERRAL_PARTITIONS_AHEAD, help="Months of partitions to create ahead of this one")
+        parser.add_argument("--retention", type=int, default=REFERRAL_RETENTION_MONTHS, help="Months a referral is kept after it was last seen")
+        parser.add_argument("--drop", action="store_true", help="Drop archived partitions instead of keeping them as tables of their own")
+
+    def handle(self, *args, **options):
+        for name in Referral.objects.create_partitions(options["ahead"]):
+            self.stdout.write(f"created {name}")
+        for name in Referral.objects.archive_partitions(options["retention"], drop=options["drop"]):
+            self.stdout.write(f"{'dropped' if options['drop'] else 'archived'} {name}")
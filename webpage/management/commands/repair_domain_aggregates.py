@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from webpage.models import Domain
+
+class Command(BaseCommand):
+    help = "Recompute the times and redirect counters domains aggregate from their webpages, for when they were changed without going through the crawler (see 'Domain.objects.repair_aggregates()')"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--domain", type=int, action="append", help="Id of a domain to repair, can be given more than once. Every domain by default")
+
+    def handle(self, *args, **options):
+        repaired = Domain.objects.repair_aggregates(options["domain"])
+        self.stdout.write(f"repaired {repaired} domains")
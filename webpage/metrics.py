@@ -0,0 +1,178 @@
+'''
+Counters and histograms about the crawl, exposed in the Prometheus text exposition format.
+
+Metrics live in the process that records them: a crawl worker serves its own with
+'start_metrics_server()' on a port of its own, so they aren't exposed by the public web app.
+'''
+
+import math
+import time
+import threading
+from aiohttp import web
+from urllib.parse import urlparse
+
+# Every metric, in the order they are rendered
+REGISTRY = []
+
+# Seconds, from a fast local request to a request timing out
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra != None:
+        pairs.append(f'{extra[0]}="{escape_label(extra[1])}"')
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    '''
+    A metric with a value for every combination of its 'labelnames'. Updates can come from any
+    thread, the ORM runs our synchronous code in threads.
+    '''
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for values in sorted(self.values):
+                lines = lines + self.render_samples(values, self.values[values])
+        return lines
+
+
+class Counter(Metric):
+    '''
+    A count that only goes up:
+        LINKS_DISCOVERED.inc(3, domain="www.ubc.ca", page_type="html")
+    '''
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        values = self.label_values(labels)
+        with self.lock:
+            self.values[values] = self.values.get(values, 0) + amount
+
+    def render_samples(self, values, value):
+        return [f"{self.name}{format_labels(self.labelnames, values)} {format_value(value)}"]
+
+
+class Histogram(Metric):
+    '''
+    Observations counted into cumulative buckets, with their sum and count:
+        FETCH_SECONDS.observe(0.2, domain="www.ubc.ca", page_type="html")
+    '''
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets) + [math.inf]
+
+    def observe(self, amount, **labels):
+        values = self.label_values(labels)
+        with self.lock:
+            if not values in self.values:
+                self.values[values] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            observations = self.values[values]
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    observations["buckets"][i] = observations["buckets"][i] + 1
+            observations["sum"] = observations["sum"] + amount
+            observations["count"] = observations["count"] + 1
+
+    def render_samples(self, values, observations):
+        lines = []
+        for bound, count in zip(self.buckets, observations["buckets"]):
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, values, ('le', format_value(bound)))} {count}")
+        lines.append(f"{self.name}_sum{format_labels(self.labelnames, values)} {format_value(observations['sum'])}")
+        lines.append(f"{self.name}_count{format_labels(self.labelnames, values)} {observations['count']}")
+        return lines
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render():
+    '''
+    Every metric in the text exposition format
+    '''
+    lines = []
+    for metric in REGISTRY:
+        lines = lines + metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def domain_label(url):
+    '''
+    The 'domain' label of a url: its hostname
+    '''
+    return urlparse(url).hostname or ""
+
+
+FETCH_SECONDS = Histogram("thoth_fetch_seconds", "Seconds from sending a request until its response headers arrive", ["domain", "page_type"])
+RESPONSES = Counter("thoth_responses_total", "Responses received, by status code", ["domain", "page_type", "status"])
+FETCH_ERRORS = Counter("thoth_fetch_errors_total", "Webpage reads that failed with an error", ["domain", "page_type"])
+RESPONSE_BYTES = Counter("thoth_response_bytes_total", "Bytes of response bodies read", ["domain", "page_type"])
+PARSE_SECONDS = Histogram("thoth_parse_seconds", "Seconds spent parsing a response body", ["domain", "page_type"])
+DB_SECONDS = Histogram("thoth_db_seconds", "Seconds spent on database queries while reading a webpage's hyperlinks", ["domain", "page_type"])
+QUERY_SECONDS = Histogram("thoth_query_seconds", "Seconds a database query took, by statement", ["statement"])
+EMBEDDINGS = Counter("thoth_embeddings_encoded_total", "Embeddings encoded", ["domain", "source_attribute"])
+LINKS_FOUND = Counter("thoth_links_found_total", "Crawl worthy hyperlinks found on webpages", ["domain", "page_type"])
+LINKS_DISCOVERED = Counter("thoth_links_discovered_total", "Webpages created from hyperlinks and sitemaps", ["domain", "page_type"])
+READS = Counter("thoth_reads_total", "Webpage reads by outcome (see 'CrawlScheduler.count_read()')", ["outcome"])
+STAGE_SECONDS = Histogram("thoth_stage_seconds", "Seconds spent in each stage of reading a webpage", ["stage"])
+
+
+def observe_query(execute, sql, params, many, context):
+    '''
+    Database execute wrapper timing every query into QUERY_SECONDS:
+        with connection.execute_wrapper(observe_query):
+            ...
+    '''
+    statement = sql.lstrip().split(" ", 1)[0].upper() if sql else ""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        QUERY_SECONDS.observe(time.perf_counter() - start, statement=statement)
+
+
+async def metrics_handler(request):
+    return web.Response(body=render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(port, host="0.0.0.0"):
+    '''
+    Serve '/metrics' on 'port' from the running event loop. Returns the runner to clean up with
+    'await runner.cleanup()'.
+    '''
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0014_domain_time_published_webpage_time_published'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webpage',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='webpage',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
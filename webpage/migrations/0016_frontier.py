@@ -0,0 +1,29 @@
+# Generated by Django 4.2.21 on 2026-10-18 17:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0015_webpage_etag_webpage_last_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Frontier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=510)),
+                ('priority', models.IntegerField(default=0)),
+                ('next_fetch_at', models.DateTimeField()),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='frontier', to='webpage.domain')),
+                ('webpage', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='frontier', to='webpage.webpage')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_fetch_at', 'priority'], name='frontier_due_idx'), models.Index(fields=['domain', 'next_fetch_at', 'priority'], name='frontier_domain_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:05
+
+import datetime
+
+from django.db import migrations
+from django.db.models import Q
+from django.utils import timezone
+
+# Copies of the values in 'webpage/models.py' at the time of this migration
+HIT_TIMEOUT = datetime.timedelta(hours=3)
+WP_API_PAGE_TYPES = ["wordpress api", "wordpress api index"]
+BATCH_SIZE = 1000
+
+
+def seed_frontier(apps, schema_editor):
+    '''
+    Add a frontier entry for every webpage that the old 'Domain.read_webpages()' queries would
+    have picked up: webpages that were never requested and source webpages of source domains.
+    Domains that were never crawled get their homepage first.
+    '''
+    Domain = apps.get_model("webpage", "Domain")
+    WebPage = apps.get_model("webpage", "WebPage")
+    Frontier = apps.get_model("webpage", "Frontier")
+
+    now = timezone.now()
+
+    for domain in Domain.objects.filter(webpages=None).iterator(chunk_size=BATCH_SIZE):
+        WebPage.objects.create(
+            url=domain.url,
+            title=domain.title,
+            description=domain.description,
+            time_updated=domain.time_updated,
+            time_discovered=domain.time_discovered,
+            is_source=domain.is_source,
+            domain=domain,
+            level=0,
+            )
+
+    webpages = WebPage.objects.filter(Q(time_last_requested=None) | Q(is_source=True, domain__is_source=True))
+
+    entries = []
+    for webpage in webpages.iterator(chunk_size=BATCH_SIZE):
+        next_fetch_at = now
+        if webpage.time_last_requested != None:
+            next_fetch_at = webpage.time_last_requested + HIT_TIMEOUT
+
+        priority = webpage.level + 1
+        if webpage.page_type in WP_API_PAGE_TYPES:
+            priority = 0
+
+        entries.append(Frontier(
+            webpage_id=webpage.id,
+            url=webpage.url,
+            domain_id=webpage.domain_id,
+            priority=priority,
+            next_fetch_at=next_fetch_at,
+            ))
+
+        if len(entries) >= BATCH_SIZE:
+            Frontier.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+
+    Frontier.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0016_frontier'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_frontier, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.21 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0017_seed_frontier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='consecutive_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='last_status_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='time_circuit_open_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webpage',
+            name='consecutive_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='webpage',
+            name='last_status_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0018_circuit_breaker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webpage',
+            name='is_truncated',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0019_webpage_is_truncated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frontier',
+            name='leased_by',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
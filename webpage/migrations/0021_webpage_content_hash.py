@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0020_frontier_leased_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webpage',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='webpage',
+            name='text_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
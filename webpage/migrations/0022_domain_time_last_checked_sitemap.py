@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0021_webpage_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='time_last_checked_sitemap',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0022_domain_time_last_checked_sitemap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='change_history',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='webpage',
+            name='change_history',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
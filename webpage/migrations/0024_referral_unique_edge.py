@@ -0,0 +1,27 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+# Concurrent workers could save the same hyperlink twice before the constraint existed. Keep the
+# first referral of every source-destination pair.
+DELETE_DUPLICATE_REFERRALS = '''
+DELETE FROM webpage_referral AS duplicate
+USING webpage_referral AS original
+WHERE duplicate.source_webpage_id = original.source_webpage_id
+AND duplicate.destination_webpage_id = original.destination_webpage_id
+AND duplicate.id > original.id
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0023_change_history'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATE_REFERRALS, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='referral',
+            constraint=models.UniqueConstraint(fields=('source_webpage', 'destination_webpage'), name='referral_unique_edge'),
+        ),
+    ]
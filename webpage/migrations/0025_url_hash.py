@@ -0,0 +1,24 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:21
+
+from django.db import migrations
+import webpage.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0024_referral_unique_edge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='url_hash',
+            field=webpage.models.UrlHashField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='webpage',
+            name='url_hash',
+            field=webpage.models.UrlHashField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
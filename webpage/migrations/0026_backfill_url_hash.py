@@ -0,0 +1,95 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:22
+
+from django.db import migrations
+
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+BATCH_SIZE = 1000
+
+# A copy of 'webpage/canonical.py' as it was when this migration was written, so later changes to
+# canonicalization don't change the hashes this migration writes
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAMS = ["gclid", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "_hsenc", "_hsmi"]
+TRACKING_PREFIXES = ["utm_"]
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or any(name.startswith(prefix) for prefix in TRACKING_PREFIXES)
+
+
+def canonicalize_url(url):
+    url = url.strip()
+    try:
+        split = urlsplit(url)
+        port = split.port
+    except ValueError:
+        return url
+
+    scheme = split.scheme.lower()
+    if not scheme in DEFAULT_PORTS or not split.hostname:
+        return url
+
+    host = split.hostname.rstrip(".")
+    if ":" in host:
+        host = "[" + host + "]"
+    if port != None and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    path = split.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    params = [(name, value) for name, value in parse_qsl(split.query, keep_blank_values=True) if not is_tracking_param(name)]
+    query = urlencode(sorted(params))
+
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def url_hash(url):
+    canonical = canonicalize_url(url)
+    if "://" in canonical:
+        canonical = "//" + canonical.split("://", 1)[1]
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# Every row but the first of each url_hash is a duplicate, its hash is cleared so the unique
+# index can be built. The 'merge_duplicate_webpages' command merges them into the first row.
+CLEAR_DUPLICATE_HASHES = '''
+UPDATE {table} AS duplicate SET url_hash = NULL
+FROM {table} AS original
+WHERE duplicate.url_hash = original.url_hash
+AND duplicate.id > original.id
+'''
+
+
+def backfill_url_hash(apps, schema_editor):
+    '''
+    Set the 'url_hash' (see 'webpage/canonical.py') of every webpage and domain
+    '''
+    for model_name in ["Domain", "WebPage"]:
+        model = apps.get_model("webpage", model_name)
+
+        rows = []
+        for row in model.objects.only("id", "url").iterator(chunk_size=BATCH_SIZE):
+            row.url_hash = url_hash(row.url)
+            rows.append(row)
+
+            if len(rows) >= BATCH_SIZE:
+                model.objects.bulk_update(rows, ["url_hash"])
+                rows = []
+
+        model.objects.bulk_update(rows, ["url_hash"])
+
+        schema_editor.execute(CLEAR_DUPLICATE_HASHES.format(table=model._meta.db_table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0025_url_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_url_hash, migrations.RunPython.noop),
+    ]
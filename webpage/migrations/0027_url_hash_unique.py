@@ -0,0 +1,24 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:22
+
+from django.db import migrations
+import webpage.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0026_backfill_url_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='domain',
+            name='url_hash',
+            field=webpage.models.UrlHashField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='webpage',
+            name='url_hash',
+            field=webpage.models.UrlHashField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
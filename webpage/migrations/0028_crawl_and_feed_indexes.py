@@ -0,0 +1,40 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:23
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without blocking the crawler's writes
+    atomic = False
+
+    dependencies = [
+        ('webpage', '0027_url_hash_unique'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='domain',
+            index=models.Index(models.OrderBy(models.F('time_updated'), descending=True, nulls_last=True), models.OrderBy(models.F('time_last_requested'), descending=True, nulls_last=True), condition=models.Q(('is_redirect', False)), name='domain_feed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='domain',
+            index=models.Index(models.OrderBy(models.F('time_updated'), descending=True, nulls_last=True), models.OrderBy(models.F('time_last_requested'), descending=True, nulls_last=True), condition=models.Q(('is_redirect', False), ('time_last_requested', None)), name='domain_unrequested_feed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='frontier',
+            index=models.Index(condition=models.Q(('lease_expires_at__isnull', False)), fields=['leased_by'], name='frontier_leased_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='webpage',
+            index=models.Index(models.OrderBy(models.F('time_updated'), descending=True, nulls_last=True), models.OrderBy(models.F('time_last_requested'), descending=True, nulls_last=True), condition=models.Q(('is_redirect', False)), name='webpage_feed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='webpage',
+            index=models.Index(models.F('domain'), models.OrderBy(models.F('time_updated'), descending=True, nulls_last=True), models.OrderBy(models.F('time_last_requested'), descending=True, nulls_last=True), name='webpage_domain_feed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='webpage',
+            index=models.Index(condition=models.Q(('page_type__in', ['wordpress api', 'wordpress api index'])), fields=['domain', 'page_type'], name='webpage_domain_wp_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+# Count what the counters would have counted so far. The domains' times are already aggregated.
+COUNT_WEBPAGES = '''
+UPDATE webpage_domain AS domain SET
+    redirect_webpages = counts.redirect_webpages,
+    requested_webpages = counts.requested_webpages
+FROM (
+    SELECT
+        domain_id,
+        COUNT(*) FILTER (WHERE is_redirect) AS redirect_webpages,
+        COUNT(*) FILTER (WHERE NOT is_redirect AND time_last_requested IS NOT NULL) AS requested_webpages
+    FROM webpage_webpage
+    GROUP BY domain_id
+) AS counts
+WHERE domain.id = counts.domain_id
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0028_crawl_and_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='redirect_webpages',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='requested_webpages',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(COUNT_WEBPAGES, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.21 on 2026-10-18 18:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0029_domain_aggregate_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField()),
+                ('destination_domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links_from', to='webpage.domain')),
+                ('source_domain', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links_to', to='webpage.domain')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='domainlink',
+            constraint=models.UniqueConstraint(fields=('source_domain', 'destination_domain'), name='domain_link_unique_edge'),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 4.2.21 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+# The referral table is rebuilt partitioned by whether its source webpage is read again
+# ('is_recrawled', a source webpage of a source domain, see 'FrontierManager.reschedule()'), and the
+# referrals of those webpages are partitioned again by the month of 'last_seen'. Only they can be
+# seen again, so only their partitions are archived: referrals from every other webpage stay in
+# one unpartitioned table. Postgres needs the partition keys in the primary key and can't have a
+# unique constraint across partitions, so the primary key becomes (id, is_recrawled, last_seen)
+# and the source-destination pair is only indexed (see 'ReferralManager.add_edges()' for how it is
+# kept unique). Existing referrals are taken as last seen when their source webpage was last read.
+PARTITION_REFERRALS = '''
+ALTER TABLE webpage_referral RENAME TO webpage_referral_unpartitioned;
+ALTER INDEX webpage_referral_pkey RENAME TO webpage_referral_unpartitioned_pkey;
+
+CREATE SEQUENCE webpage_referral_partitioned_id_seq AS bigint;
+SELECT setval('webpage_referral_partitioned_id_seq', COALESCE((SELECT MAX(id) FROM webpage_referral_unpartitioned), 0) + 1, false);
+
+CREATE TABLE webpage_referral (
+    id bigint NOT NULL DEFAULT nextval('webpage_referral_partitioned_id_seq'),
+    time_discovered timestamp with time zone NOT NULL,
+    last_seen timestamp with time zone NOT NULL,
+    is_recrawled boolean NOT NULL DEFAULT false,
+    source_webpage_id bigint NOT NULL REFERENCES webpage_webpage (id) DEFERRABLE INITIALLY DEFERRED,
+    destination_webpage_id bigint NOT NULL REFERENCES webpage_webpage (id) DEFERRABLE INITIALLY DEFERRED,
+    source_domain_id bigint NOT NULL REFERENCES webpage_domain (id) DEFERRABLE INITIALLY DEFERRED,
+    destination_domain_id bigint NOT NULL REFERENCES webpage_domain (id) DEFERRABLE INITIALLY DEFERRED,
+    PRIMARY KEY (id, is_recrawled, last_seen)
+) PARTITION BY LIST (is_recrawled);
+
+CREATE INDEX referral_edge_idx ON webpage_referral (source_webpage_id, destination_webpage_id);
+CREATE INDEX webpage_referral_destination_webpage_id ON webpage_referral (destination_webpage_id);
+CREATE INDEX webpage_referral_source_domain_id ON webpage_referral (source_domain_id);
+CREATE INDEX webpage_referral_destination_domain_id ON webpage_referral (destination_domain_id);
+
+CREATE TABLE webpage_referral_kept PARTITION OF webpage_referral FOR VALUES IN (false);
+CREATE TABLE webpage_referral_recrawled PARTITION OF webpage_referral FOR VALUES IN (true) PARTITION BY RANGE (last_seen);
+
+-- Referrals of months without a partition yet, see 'ReferralManager.create_partitions()'
+CREATE TABLE webpage_referral_default PARTITION OF webpage_referral_recrawled DEFAULT;
+
+CREATE TEMPORARY TABLE referral_backfill ON COMMIT DROP AS
+SELECT
+    referral.id,
+    referral.time_discovered,
+    GREATEST(referral.time_discovered, source.time_last_requested) AS last_seen,
+    source.is_source AND source_domain.is_source AS is_recrawled,
+    referral.source_webpage_id,
+    referral.destination_webpage_id,
+    referral.source_domain_id,
+    referral.destination_domain_id
+FROM webpage_referral_unpartitioned AS referral
+JOIN webpage_webpage AS source ON source.id = referral.source_webpage_id
+JOIN webpage_domain AS source_domain ON source_domain.id = referral.source_domain_id;
+
+-- Monthly partitions from the oldest referral of a re-read webpage until a few months ahead
+DO $$
+DECLARE
+    this_month timestamptz := date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    month timestamptz := LEAST(
+        this_month,
+        (SELECT date_trunc('month', MIN(last_seen) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' FROM referral_backfill WHERE is_recrawled)
+    );
+BEGIN
+    WHILE month < (this_month AT TIME ZONE 'UTC' + interval '4 months') AT TIME ZONE 'UTC' LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF webpage_referral_recrawled FOR VALUES FROM (%L) TO (%L)',
+            'webpage_referral_p' || to_char(month AT TIME ZONE 'UTC', 'YYYYMM'),
+            month,
+            (month AT TIME ZONE 'UTC' + interval '1 month') AT TIME ZONE 'UTC'
+        );
+        month := (month AT TIME ZONE 'UTC' + interval '1 month') AT TIME ZONE 'UTC';
+    END LOOP;
+END
+$$;
+
+INSERT INTO webpage_referral (id, time_discovered, last_seen, is_recrawled, source_webpage_id, destination_webpage_id, source_domain_id, destination_domain_id)
+SELECT id, time_discovered, last_seen, is_recrawled, source_webpage_id, destination_webpage_id, source_domain_id, destination_domain_id
+FROM referral_backfill;
+
+DROP TABLE webpage_referral_unpartitioned;
+
+ALTER SEQUENCE webpage_referral_partitioned_id_seq OWNED BY webpage_referral.id;
+ALTER SEQUENCE webpage_referral_partitioned_id_seq RENAME TO webpage_referral_id_seq;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0030_domain_link'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='referral',
+                    name='referral_unique_edge',
+                ),
+                migrations.AddField(
+                    model_name='referral',
+                    name='last_seen',
+                    field=models.DateTimeField(),
+                    preserve_default=False,
+                ),
+                migrations.AddField(
+                    model_name='referral',
+                    name='is_recrawled',
+                    field=models.BooleanField(default=False),
+                ),
+                migrations.AddIndex(
+                    model_name='referral',
+                    index=models.Index(fields=['source_webpage', 'destination_webpage'], name='referral_edge_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(PARTITION_REFERRALS),
+            ],
+        ),
+    ]
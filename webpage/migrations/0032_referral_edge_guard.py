@@ -0,0 +1,44 @@
+# Generated by Django 4.2.21 on 2026-10-18 21:40
+
+from django.db import migrations
+
+# The partitioned referral table can't have a unique constraint on the source-destination pair, so
+# a trigger skips the rows that would repeat a pair, whichever way they are written (a referral
+# moved by 'merge_duplicate_webpages' included). It takes the same advisory lock as
+# 'ReferralManager.add_edges()' ('advisory_lock()' of 'referral:<source webpage id>'), so a pair
+# being added by another transaction is seen once that transaction commits. Skipped rows aren't
+# returned by the INSERT, so 'add_edges()' doesn't count them into the DomainLinks.
+GUARD_REFERRAL_EDGES = '''
+CREATE FUNCTION webpage_referral_skip_existing_edge() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('referral:' || NEW.source_webpage_id));
+    IF EXISTS (
+        SELECT FROM webpage_referral
+        WHERE source_webpage_id = NEW.source_webpage_id AND destination_webpage_id = NEW.destination_webpage_id AND id <> NEW.id
+    ) THEN
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER referral_edge_guard
+BEFORE INSERT OR UPDATE OF source_webpage_id, destination_webpage_id ON webpage_referral
+FOR EACH ROW EXECUTE FUNCTION webpage_referral_skip_existing_edge();
+'''
+
+UNGUARD_REFERRAL_EDGES = '''
+DROP TRIGGER referral_edge_guard ON webpage_referral;
+DROP FUNCTION webpage_referral_skip_existing_edge();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webpage', '0031_partition_referrals'),
+    ]
+
+    operations = [
+        migrations.RunSQL(GUARD_REFERRAL_EDGES, UNGUARD_REFERRAL_EDGES),
+    ]
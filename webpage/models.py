@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction, connection
 from django.utils import timezone
-from django.db.models import Q, F, Max, Min
+from django.db.models import Q, F, Value, Case, When
+from django.db.models.functions import Greatest, Least
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 from pgvector.django import VectorField
 from sentence_transformers import SentenceTransformer
@@ -10,18 +13,68 @@ import asyncio
 import aiohttp
 from asgiref.sync import async_to_sync, sync_to_async
 
-from io import BytesIO
-from pypdf import PdfReader
-from bs4 import BeautifulSoup
 import json 
+import logging
+import hashlib
+import time
 import math
-
-from thoth.settings import SIMILARITY_MODEL
+import threading
+from collections import OrderedDict
+from io import StringIO
+from contextlib import contextmanager
+from datetime import timezone as datetime_timezone
+
+from thoth.settings import (
+    SIMILARITY_MODEL,
+    CRAWL_LEASE_TIME,
+    CRAWL_CIRCUIT_BREAKER_THRESHOLD,
+    CRAWL_CIRCUIT_BREAKER_BACKOFF,
+    CRAWL_MAX_PAGE_FAILURES,
+    CRAWL_MAX_BODY_SIZE,
+    CRAWL_HTML_BODY_PREFIX,
+    ROBOTS_TXT_TTL,
+    ROBOTS_TXT_MAX_SIZE,
+    CRAWL_TEXT_HASH,
+    SITEMAP_TTL,
+    SITEMAP_MAX_FILES,
+    SITEMAP_BATCH_SIZE,
+    CRAWL_LOCK_KEY,
+    CHANGE_HISTORY_SIZE,
+    DOMAIN_CHANGE_HISTORY_SIZE,
+    REFERRAL_COPY_MIN_BATCH,
+    REFERRAL_LAST_SEEN_RESOLUTION,
+    REFERRAL_PARTITIONS_AHEAD,
+    REFERRAL_RETENTION_MONTHS,
+    DOMAIN_CACHE_SIZE,
+    DOMAIN_CACHE_TTL,
+)
 from organize_webpages.models import AbstractTaggableObject
+from webpage.crawl import request_session, save_later, read_limited, backoff, is_host_failure, run_parser, timed, record_stage, recrawl_interval
+from webpage.parsing import parse_html, parse_pdf, parse_wordpress_item, normalized_text_hash
+from webpage.robots import cache_robots_rules, cached_robots_rules
+from webpage.sitemaps import read_sitemap
+from webpage.canonical import url_hash
+from webpage.metrics import (
+    domain_label,
+    FETCH_SECONDS,
+    RESPONSES,
+    FETCH_ERRORS,
+    RESPONSE_BYTES,
+    PARSE_SECONDS,
+    DB_SECONDS,
+    EMBEDDINGS,
+    LINKS_FOUND,
+    LINKS_DISCOVERED,
+)
+
+logger = logging.getLogger(__name__)
 
-HEADER = {'user-agent': 'The Society of Thoth'}
 WP_API_FIRST_PAGE_SIZE = 20
 WP_API_MAX_PAGE_SIZE = 100
+WP_API_PAGE_TYPES = ["wordpress api", "wordpress api index"]
+
+# How long until a source webpage is read again
+HIT_TIMEOUT = timezone.timedelta(hours = 3)
 
 def crawl_worthy(url):
     '''
@@ -44,6 +97,15 @@ def count_path_segments(link):
 
     return level
 
+def domain_root(url):
+    '''
+    The 'scheme://hostname' part of a url that its Domain is saved under, or None if it isn't http(s)
+    '''
+    link_parse = urlparse(url)
+    if not "http" in link_parse.scheme or link_parse.hostname == None:
+        return None
+    return link_parse.scheme + "://" + link_parse.hostname
+
 def get_absolute_url(url, root_url):
     '''
     Transform 'url' into absolute url if a relative url
@@ -66,6 +128,81 @@ def get_absolute_url(url, root_url):
     url = urljoin(url, urlparse(url).path)
     return url
 
+def frontier_priority(webpage):
+    '''
+    Frontier entries that are due at the same time are read in order of priority, lowest first.
+    Wordpress api pages come first since one request can update many webpages, followed by
+    webpages closest to the root of their domain.
+    '''
+    if webpage.page_type in WP_API_PAGE_TYPES:
+        return 0
+    return webpage.level + 1
+
+def robots_allowed(url):
+    '''
+    Check 'url' against the robots.txt of its host. The rules are compiled once per host and kept
+    in memory, so only the first url of a host costs a query. Hosts whose robots.txt we haven't
+    fetched yet allow everything.
+    '''
+    hostname = urlparse(url).hostname
+    if hostname == None:
+        return False
+
+    rules = cached_robots_rules(hostname)
+    if rules == None:
+        robots_txt = Domain.objects.filter(url_hash=url_hash("https://" + hostname)).values_list("robots_txt", flat=True).first()
+        rules = cache_robots_rules(hostname, robots_txt)
+
+    return rules.allowed(url)
+
+def prime_robots_rules(urls):
+    '''
+    Compile the rules of every host in 'urls' that isn't in memory yet, reading their robots.txt
+    with a single query, so checking a page of hyperlinks with 'robots_allowed()' doesn't cost a
+    query per host
+    '''
+    hostnames = [hostname for hostname in set(urlparse(url).hostname for url in urls) - {None} if cached_robots_rules(hostname) == None]
+    if len(hostnames) == 0:
+        return
+
+    robots_txts = {}
+    for url, robots_txt in Domain.objects.filter(url_hash__in=[url_hash("https://" + hostname) for hostname in hostnames]).values_list("url", "robots_txt"):
+        robots_txts[urlparse(url).hostname] = robots_txt
+
+    for hostname in hostnames:
+        cache_robots_rules(hostname, robots_txts.get(hostname))
+
+def advisory_lock(keys):
+    '''
+    Take a Postgres transaction level advisory lock for every string in 'keys' so crawl workers
+    running at the same time can't both insert the same row. Locks are taken in a fixed order so
+    two workers can't deadlock, and are released when the transaction ends, so this must be called
+    inside 'transaction.atomic()'.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(lock_key) FROM (SELECT DISTINCT hashtext(key) AS lock_key FROM unnest(%s::text[]) AS key ORDER BY lock_key) AS lock_keys",
+            [list(keys)],
+            )
+
+@contextmanager
+def crawl_lock(key=CRAWL_LOCK_KEY):
+    '''
+    Try to take the Postgres session level advisory lock 'key' and yield whether we got it. Held
+    by 'read_all' and the 'crawl' command so a cron run can't start while another crawl is still
+    going. The lock belongs to this thread's connection and is released when we leave the block,
+    or by Postgres if the connection is lost.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [key])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [key])
+
 def read_last_modified_header(r):        
     '''
     Return the 'Last-Modified' header from a http response as a datetime object with timezone set to server timezone
@@ -80,8 +217,24 @@ def read_last_modified_header(r):
 
 # Create your models here.
 
+class UrlHashField(models.CharField):
+    '''
+    The 'url_hash()' of the model's 'url', set whenever the model is saved or bulk created.
+    Rows left without a hash because their url is a duplicate (see the 'merge_duplicate_webpages'
+    command) keep it empty until they are merged.
+    '''
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if add or value != None:
+            value = url_hash(model_instance.url)
+            setattr(model_instance, self.attname, value)
+        return value
+
 class AbstractWebObject(AbstractTaggableObject):
     url = models.URLField(max_length=510)
+    # Urls are looked up by this key, see 'webpage/canonical.py'
+    url_hash = UrlHashField(max_length=64, unique=True, blank=True, null=True, editable=False)
     title = models.CharField(max_length=255, blank=True)
     description = models.TextField(blank=True, null=True)
     image = models.URLField(max_length=510, blank=True, null=True)
@@ -95,117 +248,499 @@ class AbstractWebObject(AbstractTaggableObject):
     is_source = models.BooleanField(default=False)
     is_redirect = models.BooleanField(default=False)
 
+    last_status_code = models.IntegerField(blank=True, null=True)
+    consecutive_failures = models.IntegerField(default=0)
+
+    # Whether the content changed between requests, see 'WebPage.observe_change()'
+    change_history = models.JSONField(default=list, blank=True)
+
     def __str__(self):
         return self.url
 
     class Meta():
         abstract = True
 
+class DomainCache:
+    '''
+    Bounded LRU cache from a hostname to the Domain its urls belong to, or to None for hostnames
+    without a Domain, so resolving the domain of a hyperlink rarely needs a query. Only the
+    DOMAIN_CACHE_FIELDS of a Domain are kept.
+
+    This process keeps it up to date through the Domain signals at the end of this file and
+    'DomainManager.obtain_domains()'. Code that changes domains without signals (queryset
+    '.update()') calls '.invalidate()'. Entries expire after 'ttl' seconds so changes made by
+    other processes are picked up.
+    '''
+
+    def __init__(self, max_size, ttl):
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def lookup(self, hostnames):
+        '''
+        Dictionary of the cached values (a tuple of DOMAIN_CACHE_FIELDS or None) of every hostname
+        in 'hostnames' that is in the cache
+        '''
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for hostname in hostnames:
+                if not hostname in self.entries:
+                    continue
+                values, expires = self.entries[hostname]
+                if expires <= now:
+                    del self.entries[hostname]
+                    continue
+                self.entries.move_to_end(hostname)
+                found[hostname] = values
+        return found
+
+    def set(self, hostname, values):
+        with self.lock:
+            self.entries[hostname] = (values, time.monotonic() + self.ttl)
+            self.entries.move_to_end(hostname)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def set_domain(self, domain):
+        self.set(urlparse(domain.url).hostname, tuple(getattr(domain, field) for field in DOMAIN_CACHE_FIELDS))
+
+    def invalidate(self, hostname):
+        with self.lock:
+            self.entries.pop(hostname, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+DOMAIN_CACHE_FIELDS = ("id", "url", "is_source")
+DOMAIN_CACHE = DomainCache(DOMAIN_CACHE_SIZE, DOMAIN_CACHE_TTL)
+
+# The fields of a WebPage its domain's aggregates come from, see 'WebPage.aggregate_state()'
+AGGREGATED_WEBPAGE_FIELDS = {"time_published", "time_last_requested", "time_updated", "is_redirect"}
+
 class DomainManager(models.Manager):
     def get_domain_from_url(self, link, create_if_not_existing=True):
         '''
         Obtain a domain model from a url. If the domain does not exist in the database, create it.
         '''
-        link_parse = urlparse(link)
+        return self.obtain_domains([link], create_if_not_existing).get(domain_root(link))
 
-        if not "http" in link_parse.scheme or link_parse.hostname == None:
-            return None
+    def obtain_domains(self, urls, create_if_not_existing=True):
+        '''
+        Return a dictionary from the 'scheme://hostname' (see 'domain_root()') of every url in 'urls'
+        to its Domain. Both schemes of a host share a Domain. Urls that aren't http(s) are left out.
 
-        link_domain_str = link_parse.scheme + "://" + link_parse.hostname
-        safe_domain = link_domain_str.replace("http://", "https://")
-
-        if Domain.objects.filter(url=safe_domain).exists():
-            return Domain.objects.filter(url=safe_domain).first()
-        if Domain.objects.filter(url=link_domain_str).exists():
-            return Domain.objects.filter(url=link_domain_str).first()
-        elif create_if_not_existing: 
-            return Domain.objects.create(
-                url=link_domain_str,
-                title=link_domain_str,
-                time_discovered=timezone.now(),
-                is_source=crawl_worthy(link_domain_str)
-                )
+        Domains come from DOMAIN_CACHE with only DOMAIN_CACHE_FIELDS loaded. The hostnames that
+        aren't cached are looked up by 'url_hash' with a single query.
 
-        return None
+        If 'create_if_not_existing', missing domains are created in bulk along with their homepages.
+        '''
+        roots = set(domain_root(url) for url in urls) - {None}
+        hostnames = {root: urlparse(root).hostname for root in roots}
+
+        def find_domains(use_cache=True):
+            values = {}
+            if use_cache:
+                values = DOMAIN_CACHE.lookup(set(hostnames.values()))
+
+            to_query = set(hostnames.values()) - set(values.keys())
+            if len(to_query) > 0:
+                by_hostname = {}
+                for domain in self.filter(url_hash__in=[url_hash("https://" + hostname) for hostname in to_query]).values_list(*DOMAIN_CACHE_FIELDS):
+                    by_hostname[urlparse(domain[1]).hostname] = domain
+                for hostname in to_query:
+                    values[hostname] = by_hostname.get(hostname)
+                    DOMAIN_CACHE.set(hostname, values[hostname])
+
+            found = {}
+            for root, hostname in hostnames.items():
+                if values[hostname] != None:
+                    found[root] = Domain.from_db(self.db, DOMAIN_CACHE_FIELDS, values[hostname])
+            return found
+
+        domains = find_domains()
+        if len(domains) == len(roots) or not create_if_not_existing:
+            return domains
+
+        with transaction.atomic():
+            # Another worker may have created some of the domains while we waited for the lock
+            advisory_lock(["domain:" + hostnames[root] for root in roots if not root in domains])
+            domains = find_domains(use_cache=False)
+
+            # The http and https roots of a host get a single Domain
+            to_create = {}
+            for root in sorted(roots):
+                if not root in domains and not hostnames[root] in to_create:
+                    to_create[hostnames[root]] = Domain(
+                        url=root,
+                        title=root,
+                        time_discovered=timezone.now(),
+                        is_source=crawl_worthy(root)
+                        )
+
+            if len(to_create) > 0:
+                self.bulk_create(to_create.values())
+                homepages = [domain.new_homepage() for domain in to_create.values()]
+                WebPage.objects.bulk_create(homepages)
+                Frontier.objects.enqueue(homepages)
+                # 'bulk_create()' doesn't send 'post_save'
+                for domain in to_create.values():
+                    DOMAIN_CACHE.set_domain(domain)
+                WebPage.objects.update_domain_aggregates(homepages, created=True)
+
+            for root in roots:
+                if not root in domains:
+                    domains[root] = to_create[hostnames[root]]
+
+        return domains
+
+    def repair_aggregates(self, domain_ids=None):
+        '''
+        Recompute the aggregates of the domains with 'domain_ids' (every domain if None) from all of
+        their webpages, in a single statement. The crawl keeps them up to date incrementally (see
+        'WebPageManager.update_domain_aggregates()'), this is for changes made around it with
+        queryset '.update()' or SQL. Returns the number of domains updated.
+        '''
+        where = ""
+        params = []
+        if domain_ids != None:
+            where = "WHERE domain.id = ANY(%s)"
+            params = [list(domain_ids)]
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE {Domain._meta.db_table} AS domain SET
+                    time_published = aggregates.time_published,
+                    time_last_requested = aggregates.time_last_requested,
+                    time_updated = aggregates.time_updated,
+                    redirect_webpages = aggregates.redirect_webpages,
+                    requested_webpages = aggregates.requested_webpages,
+                    is_redirect = aggregates.redirect_webpages > 0 AND aggregates.requested_webpages = 0
+                FROM (
+                    SELECT
+                        domain.id AS domain_id,
+                        MIN(webpage.time_published) AS time_published,
+                        MAX(webpage.time_last_requested) AS time_last_requested,
+                        MAX(webpage.time_updated) AS time_updated,
+                        COUNT(webpage.id) FILTER (WHERE webpage.is_redirect) AS redirect_webpages,
+                        COUNT(webpage.id) FILTER (WHERE NOT webpage.is_redirect AND webpage.time_last_requested IS NOT NULL) AS requested_webpages
+                    FROM {Domain._meta.db_table} AS domain
+                    LEFT JOIN {WebPage._meta.db_table} AS webpage ON webpage.domain_id = domain.id
+                    {where}
+                    GROUP BY domain.id
+                ) AS aggregates
+                WHERE domain.id = aggregates.domain_id
+            ''', params)
+            return cursor.rowcount
 
 class Domain(AbstractWebObject):
     robots_txt = models.TextField(blank=True, null=True)
     time_last_checked_robots_txt = models.DateTimeField(blank=True, null=True)
+    time_last_checked_sitemap = models.DateTimeField(blank=True, null=True)
+
+    # The circuit breaker is open, and the domain isn't crawled, until this time
+    time_circuit_open_until = models.DateTimeField(blank=True, null=True)
+
+    # Its webpages that are redirects, and those that aren't and were requested. With its times
+    # these are kept up to date as webpages are saved, see 'WebPageManager.update_domain_aggregates()'
+    redirect_webpages = models.IntegerField(default=0)
+    requested_webpages = models.IntegerField(default=0)
 
     objects = DomainManager()
 
-    def check_robots_txt(self):
-        pass
+    class Meta():
+        indexes = [
+            # Feed of domains in 'DomainViewSet'
+            models.Index(F("time_updated").desc(nulls_last=True), F("time_last_requested").desc(nulls_last=True), name="domain_feed_idx", condition=Q(is_redirect=False)),
+            # Its 'was_requested=false' filter
+            models.Index(F("time_updated").desc(nulls_last=True), F("time_last_requested").desc(nulls_last=True), name="domain_unrequested_feed_idx", condition=Q(is_redirect=False, time_last_requested=None)),
+        ]
+
+    def circuit_open(self):
+        return self.time_circuit_open_until != None and self.time_circuit_open_until > timezone.now()
 
-    async def update_aggregate_data(self):
+    def record_request(self, status_code, failed):
         '''
-        Update the Domain information that comes from data aggregated from the domain's webapges
+        Update the circuit breaker with the outcome of a request to this domain. After
+        CRAWL_CIRCUIT_BREAKER_THRESHOLD consecutive failures of the host itself (see 'is_host_failure()')
+        the circuit opens and the domain is skipped for CRAWL_CIRCUIT_BREAKER_BACKOFF, doubling with
+        every further failure. Any other response closes it again.
+        '''
+        self.last_status_code = status_code
+
+        if failed and is_host_failure(status_code):
+            self.consecutive_failures = self.consecutive_failures + 1
+            if self.consecutive_failures >= CRAWL_CIRCUIT_BREAKER_THRESHOLD:
+                wait = backoff(self.consecutive_failures - CRAWL_CIRCUIT_BREAKER_THRESHOLD + 1, CRAWL_CIRCUIT_BREAKER_BACKOFF)
+                self.time_circuit_open_until = timezone.now() + timezone.timedelta(seconds=wait)
+        elif status_code != None:
+            self.consecutive_failures = 0
+            self.time_circuit_open_until = None
+
+    async def check_robots_txt(self, scheduler=None):
+        '''
+        Fetch this domain's robots.txt if it hasn't been checked for ROBOTS_TXT_TTL and return
+        its compiled rules (see 'webpage.robots.RobotsRules'). If a 'scheduler' is given, the
+        robots.txt 'Crawl-delay' is used to space out requests to this domain.
+
+        A missing robots.txt (4xx) allows everything. If the request fails or the server has an
+        error we keep the robots.txt we already had.
         '''
-        self.time_published = (await sync_to_async(self.webpages.aggregate)(Min('time_published')))["time_published__min"]
-        self.time_last_requested = (await sync_to_async(self.webpages.aggregate)(Max('time_last_requested')))["time_last_requested__max"]
-        self.time_updated = (await sync_to_async(self.webpages.aggregate)(Max('time_updated')))["time_updated__max"]
+        hostname = urlparse(self.url).hostname
+        now = timezone.now()
+
+        if self.time_last_checked_robots_txt == None or self.time_last_checked_robots_txt < now - timezone.timedelta(seconds=ROBOTS_TXT_TTL):
+            try:
+                async with request_session(scheduler, self.url) as session:
+                    async with session.get(self.url + "/robots.txt") as r:
+                        status_code_type = math.floor(r.status/100)
+                        if status_code_type == 2:
+                            body, truncated = await read_limited(r, ROBOTS_TXT_MAX_SIZE)
+                            self.robots_txt = body.decode(r.charset or "utf-8", errors="replace")
+                        elif status_code_type == 4:
+                            self.robots_txt = None
+            except Exception as e:
+                logger.warning("error requesting %s/robots.txt, %s", self.url, e)
+
+            self.time_last_checked_robots_txt = now
+            await self.asave(update_fields=["robots_txt", "time_last_checked_robots_txt"])
+
+            rules = cache_robots_rules(hostname, self.robots_txt)
+        else:
+            rules = cached_robots_rules(hostname)
+            if rules == None:
+                rules = cache_robots_rules(hostname, self.robots_txt)
 
-        self.is_redirect = await self.webpages.filter(is_redirect=True).aexists() and not await self.webpages.filter(is_redirect=False).exclude(time_last_requested=None).aexists()
+        if scheduler != None:
+            scheduler.set_crawl_delay(self.url, rules.crawl_delay)
 
-        print(f'{self.url}\n    - pub: {self.time_published}\n    - req: {self.time_last_requested}\n    - upd: {self.time_updated}\n    - red: {self.is_redirect}')
+        return rules
 
-        await self.asave()
-        
-    async def read_webpages(self, count=5):
+    async def check_sitemaps(self, rules, scheduler=None):
         '''
-        Read webpages 
+        Read this domain's sitemaps if they haven't been read for SITEMAP_TTL and save the webpages
+        they list (see '.save_sitemap_urls()'). Returns the number of new webpages.
+
+        Sitemaps are found in the robots.txt 'rules', or at '/sitemap.xml' if it doesn't list any.
+        Sitemap indexes are followed to the sitemaps they list, up to SITEMAP_MAX_FILES files. Only
+        urls on this domain's host that the robots.txt allows are saved.
         '''
-        #print("domain: " + self.url)
-        HIT_TIMEOUT = timezone.timedelta(hours = 3)
-        
-        time_cutoff = timezone.now() - HIT_TIMEOUT
+        now = timezone.now()
+        if self.time_last_checked_sitemap != None and self.time_last_checked_sitemap > now - timezone.timedelta(seconds=SITEMAP_TTL):
+            return 0
+
+        hostname = urlparse(self.url).hostname
+        to_read = list(rules.sitemaps)
+        if len(to_read) == 0:
+            to_read = [self.url + "/sitemap.xml"]
+
+        read = set()
+        pages = {}
+        created = 0
+        while len(to_read) > 0 and len(read) < SITEMAP_MAX_FILES:
+            sitemap_url = to_read.pop(0)
+            if sitemap_url in read:
+                continue
+            read.add(sitemap_url)
 
-        self.time_last_requested = timezone.now()
+            try:
+                async with request_session(scheduler, sitemap_url) as session:
+                    async for entries in read_sitemap(session, sitemap_url):
+                        for kind, loc, lastmod in entries:
+                            if kind == "sitemap":
+                                to_read.append(loc)
+                                continue
 
-        await self.asave()
+                            url = get_absolute_url(loc, self.url)
+                            if url != False and len(url) <= 510 and urlparse(url).hostname == hostname and rules.allowed(url):
+                                pages[url] = lastmod
+
+                        if len(pages) >= SITEMAP_BATCH_SIZE:
+                            created = created + await sync_to_async(self.save_sitemap_urls)(pages)
+                            pages = {}
+            except Exception as e:
+                logger.warning("error reading sitemap %s, %s", sitemap_url, e)
+
+        if len(pages) > 0:
+            created = created + await sync_to_async(self.save_sitemap_urls)(pages)
+
+        logger.info("read %s sitemaps of %s, %s new webpages", len(read), self.url, created)
+
+        self.time_last_checked_sitemap = now
+        await self.asave(update_fields=["time_last_checked_sitemap"])
+
+        return created
+
+    def save_sitemap_urls(self, pages):
+        '''
+        Save the webpages from this domain's sitemaps. 'pages' maps urls to their '<lastmod>' (or
+        None). Returns the number of new webpages.
+
+        New webpages are created in bulk with 'time_updated' set to their lastmod and added to the
+        frontier. Webpages we already have are brought forward in the frontier if their lastmod is
+        after we last requested them, and pushed back to the next sitemap check if it isn't, since
+        there is nothing new to read.
+        '''
+        now = timezone.now()
+
+        if "https://" in self.url:
+            pages = {url.replace("http://", "https://"): lastmod for url, lastmod in pages.items()}
+
+        hashes = {url: url_hash(url) for url in pages}
+
+        with transaction.atomic():
+            # Other workers can't create webpages for these urls until we're done
+            advisory_lock(hashes.values())
+
+            existing = {}
+            for webpage in WebPage.objects.filter(url_hash__in=hashes.values()).only("id", "url", "url_hash", "domain_id", "level", "page_type", "time_last_requested"):
+                existing[webpage.url_hash] = webpage
+
+            to_create = []
+            updated = []
+            not_updated = []
+            for url, lastmod in pages.items():
+                webpage = existing.get(hashes[url])
+                if webpage == None:
+                    to_create.append(WebPage(
+                        domain=self,
+                        url=url,
+                        title=url,
+                        time_updated=lastmod,
+                        time_discovered=now,
+                        level=count_path_segments(url),
+                        ))
+                    # Another way of writing this url gets the same webpage
+                    existing[hashes[url]] = to_create[-1]
+                elif lastmod != None and webpage.time_last_requested != None:
+                    if lastmod > webpage.time_last_requested:
+                        updated.append(webpage)
+                    else:
+                        not_updated.append(webpage)
+
+            not_leased = Q(lease_expires_at=None) | Q(lease_expires_at__lt=now)
+
+            if len(to_create) > 0:
+                WebPage.objects.bulk_create(to_create)
+                WebPage.objects.update_domain_aggregates(to_create, created=True)
+                Frontier.objects.enqueue(to_create)
+                LINKS_DISCOVERED.inc(len(to_create), domain=domain_label(self.url), page_type="sitemap")
+
+            if len(updated) > 0:
+                Frontier.objects.enqueue(updated)
+                Frontier.objects.filter(not_leased, webpage__in=updated).update(next_fetch_at=now)
+
+            if len(not_updated) > 0:
+                next_check = now + timezone.timedelta(seconds=SITEMAP_TTL)
+                Frontier.objects.filter(not_leased, webpage__in=not_updated, next_fetch_at__lt=next_check).update(next_fetch_at=next_check)
+
+        return len(to_create)
+
+    def new_homepage(self):
+        '''
+        Unsaved WebPage for this domain's root url, which is where crawling the domain starts
+        '''
+        return WebPage(
+            url=self.url,
+            title=self.title,
+            description=self.description,
+            time_updated=self.time_updated,
+            time_discovered=self.time_discovered,
+            is_source=self.is_source,
+
+            domain=self,
+            level=0
+            )
+
+    def create_homepage(self):
+        '''
+        Save the homepage (see '.new_homepage()') and add it to the frontier
+        '''
+        homepage = self.new_homepage()
+        homepage.save()
+        Frontier.objects.enqueue([homepage])
+        return homepage
+
+    async def acreate_homepage(self):
+        return await sync_to_async(self.create_homepage)()
+
+    async def read_webpages(self, count=5, scheduler=None):
+        '''
+        Read up to 'count' of this domain's webpages that are due in the crawl frontier
+
+        If a 'scheduler' (see 'webpage.crawl.CrawlScheduler') is given, it limits how many requests
+        are made to this domain at once and how they are spaced out.
+        '''
+        #print("domain: " + self.url)
 
         if not await WebPage.objects.filter(domain=self).aexists():
-            await WebPage.objects.acreate(
-                url=self.url,
-                title=self.title,
-                description=self.description,
-                time_updated=self.time_updated,
-                time_discovered=self.time_discovered,
-                is_source=self.is_source,
-
-                domain=self,
-                level=0
-                )
+            await self.acreate_homepage()
 
             #print(f"create homepage {self.url}")
 
-        crawlpage_query = WebPage.objects.filter(Q(domain=self), Q(page_type="wordpress api") | Q(page_type="wordpress api index"), Q(is_source=True, time_last_requested__lte=time_cutoff) | Q(time_last_requested=None))
-        hit_query = WebPage.objects.filter(Q(domain=self), Q(is_source=True, time_last_requested__lte=time_cutoff) | Q(time_last_requested=None))
-        
-        non_source_query = WebPage.objects.filter(Q(domain=self), Q(time_last_requested=None))
+        entries = await Frontier.objects.adequeue(limit=count, domain=self)
 
-        tasks = []
+        return await self.read_frontier(entries, scheduler=scheduler)
 
+    async def read_frontier(self, entries, scheduler=None):
         '''
-        if await crawlpage_query.aexists():
-            tasks = tasks + [asyncio.create_task(wp.read()) async for wp in crawlpage_query.order_by('level', 'time_last_requested', '-time_updated')]
+        Concurrently read the webpages of leased frontier 'entries' that belong to this domain,
+        then put the entries back in the frontier for their next read
 
-        if await hit_query.aexists():
-            tasks = tasks + [asyncio.create_task(wp.read()) async for wp in hit_query.order_by('level', 'time_last_requested', '-time_updated')[:count]]
+        Webpages disallowed by the domain's robots.txt are not read and are removed from the
+        database. The homepage is kept without a frontier entry so it isn't created again.
         '''
+        if self.circuit_open():
+            logger.info("circuit open %s until %s", self.url, self.time_circuit_open_until)
+            await Frontier.objects.apostpone(self, self.time_circuit_open_until, entries)
+            return []
+
+        self.time_last_requested = timezone.now()
+
+        await self.asave(update_fields=["time_last_requested"])
+
+        rules = await self.check_robots_txt(scheduler=scheduler)
 
         if self.is_source:
-            if await crawlpage_query.aexists():
-                tasks = tasks + [await wp.read() async for wp in crawlpage_query.order_by('level', 'time_last_requested', '-time_updated')]
+            await self.check_sitemaps(rules, scheduler=scheduler)
 
-            if await hit_query.aexists():
-                tasks = tasks + [await wp.read() async for wp in hit_query.order_by('level', 'time_last_requested', '-time_updated')[:count]]
+        disallowed = [entry for entry in entries if not rules.allowed(entry.webpage.url)]
+        entries = [entry for entry in entries if rules.allowed(entry.webpage.url)]
 
-        else:
-            if await non_source_query.aexists():
-                tasks = tasks + [await wp.read() async for wp in non_source_query.order_by('-time_discovered')[:count]]
+        @sync_to_async
+        def remove_disallowed():
+            WebPage.objects.filter(id__in=[entry.webpage_id for entry in disallowed if entry.webpage.level != 0]).delete()
+            Frontier.objects.filter(id__in=[entry.id for entry in disallowed]).delete()
+
+        if len(disallowed) > 0:
+            logger.info("%s webpages of %s disallowed by robots.txt", len(disallowed), self.url)
+            await remove_disallowed()
 
-        tasks = tasks + [await self.update_aggregate_data()]
+        async def read(webpage):
+            with timed("read"):
+                return await webpage.read(scheduler=scheduler)
+
+        tasks = await asyncio.gather(*[read(entry.webpage) for entry in entries])
+
+        for entry in entries:
+            webpage = entry.webpage
+            self.record_request(webpage.last_status_code, failed=webpage.consecutive_failures > 0)
+            if getattr(webpage, "change_observation", None) != None:
+                self.change_history = (self.change_history + [webpage.change_observation])[-DOMAIN_CHANGE_HISTORY_SIZE:]
+            # Reschedule against this domain's change history, which is saved below
+            entry.domain = self
+
+        await Frontier.objects.areschedule(entries)
+
+        if self.circuit_open():
+            logger.warning("opened circuit %s until %s", self.url, self.time_circuit_open_until)
+            await Frontier.objects.apostpone(self, self.time_circuit_open_until)
+
+        # The aggregates of its webpages are written as they are saved, so only save what we changed
+        await self.asave(update_fields=["last_status_code", "consecutive_failures", "time_circuit_open_until", "change_history"])
 
         return tasks
 
@@ -222,7 +757,9 @@ class WebPageManager(models.Manager):
         if "https://" in obj_data['domain'].url and not "https://" in obj_data['url']:
             obj_data['url'] = obj_data['url'].replace("http://", "https://")
         
-        return super().create(**obj_data)
+        webpage = super().create(**obj_data)
+        Frontier.objects.enqueue([webpage])
+        return webpage
 
     def obtain_webpage(self, url, title, time_discovered=None):
         '''
@@ -231,35 +768,138 @@ class WebPageManager(models.Manager):
 
         if time_discovered == None:
             time_discovered = timezone.now()
-        
-        destination = None
 
-        if not WebPage.objects.filter(url=url).exists():
-            if WebPage.objects.filter(url=url.replace("http://", "https://")).exists():
-                url = url.replace("http://", "https://")
-                #print(f' secure {url}')
-            else:
+        webpage = WebPage.objects.filter(url_hash=url_hash(url)).first()
+        if webpage != None:
+            return webpage
+
+        domain = Domain.objects.get_domain_from_url(url)
+
+        if domain == None:
+            return None
+
+        if "https://" in domain.url and not "https://" in url:
+            url = url.replace("http://", "https://")
 
-                domain = Domain.objects.get_domain_from_url(url)
+        return WebPage(
+            domain=domain,
+            url=url,
+            title=title,
+            time_discovered=time_discovered,
+            level=count_path_segments(url),
+            )
+
+    async def aobtain_webpage(self, url, title, time_discovered=timezone.now()):
+        return await sync_to_async(self.obtain_webpage)(url, title, time_discovered)
+
+    def obtain_webpages(self, urls, titles, time_discovered=None):
+        '''
+        Set based '.obtain_webpage()': returns a WebPage for every url in 'urls' whose domain we can
+        have, without duplicates. Saved webpages are looked up by 'url_hash' with a single query
+        and only have their 'id', 'url' and 'domain' loaded. Missing webpages are returned
+        unsaved, titled from the 'titles' dictionary, to be created in bulk by the caller.
 
+        Missing domains are created with 'Domain.objects.obtain_domains()' first, so a hyperlink to
+        a new domain's root finds the homepage made with it.
+        '''
+        if time_discovered == None:
+            time_discovered = timezone.now()
+
+        domains = Domain.objects.obtain_domains(urls)
+
+        hashes = {url: url_hash(url) for url in urls}
+        existing = {}
+        for webpage in self.filter(url_hash__in=set(hashes.values())).only("id", "url", "url_hash", "domain_id"):
+            existing[webpage.url_hash] = webpage
+
+        webpages = {}
+        for url in urls:
+            webpage = existing.get(hashes[url])
+            if webpage == None:
+                domain = domains.get(domain_root(url))
                 if domain == None:
-                    return None
+                    continue
 
+                webpage_url = url
                 if "https://" in domain.url and not "https://" in url:
-                    url = url.replace("http://", "https://")
+                    webpage_url = url.replace("http://", "https://")
 
-                return WebPage(
+                webpage = WebPage(
                     domain=domain,
-                    url=url,
-                    title=title,
+                    url=webpage_url,
+                    title=titles.get(url, url),
                     time_discovered=time_discovered,
-                    level=count_path_segments(url),
+                    level=count_path_segments(webpage_url),
                     )
-        
-        return WebPage.objects.filter(url=url).first()
+                # Other ways of writing this url get the same webpage
+                existing[hashes[url]] = webpage
 
-    async def aobtain_webpage(self, url, title, time_discovered=timezone.now()):
-        return await sync_to_async(self.obtain_webpage)(url, title, time_discovered)
+            webpages[hashes[url]] = webpage
+
+        return list(webpages.values())
+
+    def update_domain_aggregates(self, webpages, created=False, deleted=False):
+        '''
+        Bring the aggregates domains keep of their webpages up to date with the state of the saved
+        'webpages', without reading the domains' other webpages:
+            - 'time_published' only moves back, 'time_last_requested' and 'time_updated' only move
+              forward (Postgres' LEAST and GREATEST skip nulls)
+            - 'redirect_webpages' and 'requested_webpages' move by how much each webpage's count
+              changed since it was last counted (see 'WebPage.aggregate_state()') and 'is_redirect'
+              follows from them
+
+        'created' webpages weren't counted yet and 'deleted' webpages are taken out of the counters.
+        Makes one UPDATE per domain with changes. 'Domain.objects.repair_aggregates()' recomputes
+        them from scratch.
+        '''
+        changes = {}
+        for webpage in webpages:
+            # Webpages saved without loading these fields didn't change them
+            if len(webpage.get_deferred_fields() & AGGREGATED_WEBPAGE_FIELDS) > 0:
+                continue
+
+            state = webpage.aggregate_state()
+            counted = webpage.counted_state
+            if created:
+                counted = (None, None, None, False, False)
+            elif counted == None:
+                # We don't know what was counted of it, so only its times are added
+                counted = (None, None, None) + state[3:]
+            if deleted:
+                state = counted[:3] + (False, False)
+            webpage.counted_state = state
+
+            published, requested, updated, is_redirect, is_requested = state
+            change = changes.setdefault(webpage.domain_id, {"time_published": None, "time_last_requested": None, "time_updated": None, "redirect_webpages": 0, "requested_webpages": 0})
+            if published != None and published != counted[0]:
+                change["time_published"] = min(published, change["time_published"] or published)
+            if requested != None and requested != counted[1]:
+                change["time_last_requested"] = max(requested, change["time_last_requested"] or requested)
+            if updated != None and updated != counted[2]:
+                change["time_updated"] = max(updated, change["time_updated"] or updated)
+            change["redirect_webpages"] = change["redirect_webpages"] + int(is_redirect) - int(counted[3])
+            change["requested_webpages"] = change["requested_webpages"] + int(is_requested) - int(counted[4])
+
+        for domain_id, change in changes.items():
+            updates = {}
+            if change["time_published"] != None:
+                updates["time_published"] = Least("time_published", Value(change["time_published"]))
+            if change["time_last_requested"] != None:
+                updates["time_last_requested"] = Greatest("time_last_requested", Value(change["time_last_requested"]))
+            if change["time_updated"] != None:
+                updates["time_updated"] = Greatest("time_updated", Value(change["time_updated"]))
+
+            redirects = change["redirect_webpages"]
+            requested = change["requested_webpages"]
+            if redirects != 0 or requested != 0:
+                updates["redirect_webpages"] = F("redirect_webpages") + redirects
+                updates["requested_webpages"] = F("requested_webpages") + requested
+                # A redirect if its webpages redirect elsewhere and none of them were read. The
+                # conditions see the counters from before this update
+                updates["is_redirect"] = Case(When(redirect_webpages__gt=-redirects, requested_webpages=-requested, then=Value(True)), default=Value(False))
+
+            if len(updates) > 0:
+                Domain.objects.filter(id=domain_id).update(**updates)
 
 
 class WebPage(AbstractWebObject):
@@ -267,32 +907,80 @@ class WebPage(AbstractWebObject):
     level = models.IntegerField(default=0)
     page_type = models.CharField(max_length=50, default="html")
 
+    # Validators from the last response, sent back so the server can answer '304 Not Modified'
+    etag = models.CharField(max_length=255, blank=True, null=True)
+    last_modified = models.CharField(max_length=64, blank=True, null=True)
+
+    # The last response was longer than we read, see 'WebPage.read_body()'
+    is_truncated = models.BooleanField(default=False)
+
+    # Fingerprints of the last response body, see 'WebPage.is_unchanged()'
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
+    text_hash = models.CharField(max_length=64, blank=True, null=True)
+
+    # What its domain's aggregates count of this webpage, see 'WebPageManager.update_domain_aggregates()'
+    counted_state = None
+
     objects = WebPageManager()
 
-    async def update(self, **kwargs):
+    class Meta():
+        indexes = [
+            # Feed of webpages in 'WebPageViewSet'
+            models.Index(F("time_updated").desc(nulls_last=True), F("time_last_requested").desc(nulls_last=True), name="webpage_feed_idx", condition=Q(is_redirect=False)),
+            # Latest webpages of a domain, in 'DomainWithWebpagesSerializer' and the tag views
+            models.Index("domain", F("time_updated").desc(nulls_last=True), F("time_last_requested").desc(nulls_last=True), name="webpage_domain_feed_idx"),
+            # The few WordPress api webpages of a domain
+            models.Index(fields=["domain", "page_type"], name="webpage_domain_wp_idx", condition=Q(page_type__in=WP_API_PAGE_TYPES)),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        webpage = super().from_db(db, field_names, values)
+        if len(webpage.get_deferred_fields() & AGGREGATED_WEBPAGE_FIELDS) == 0:
+            webpage.counted_state = webpage.aggregate_state()
+        return webpage
+
+    def aggregate_state(self):
+        '''
+        What this webpage adds to its domain's aggregates: its times, whether it is a redirect and
+        whether it is a webpage that was requested without redirecting
+        '''
+        return (self.time_published, self.time_last_requested, self.time_updated, self.is_redirect, not self.is_redirect and self.time_last_requested != None)
+
+    async def update(self, scheduler=None, **kwargs):
         '''
         Update webpage if attributes are changed or model is unsaved.
         Save new embedding if title is updated.
+
+        Changes to a saved webpage, and the new embedding, go through the write buffer of
+        'scheduler' if it is given (see 'webpage.crawl.save_later()').
         '''
 
-        changes = False
+        changes = []
+        encode_title = False
         # Update Webpage if attributes have changed
         for attribute in vars(self).keys():
             if attribute in kwargs:
 
                 if attribute == "title":
-                    if not await self.embeddings.filter(source_attribute="title").aexists() or self.title != kwargs["title"]:
-                        await Embeddings.objects.aencode(string=kwargs["title"], webpage=self, source_attribute="title")
+                    if self._state.adding or not await self.embeddings.filter(source_attribute="title").aexists() or self.title != kwargs["title"]:
+                        encode_title = True
 
                 if getattr(self, attribute) != kwargs[attribute]:
                     setattr(self, attribute, kwargs[attribute])
-                    changes = True
+                    changes.append(attribute)
                 
 
-        if changes or self._state.adding == True:
+        if self._state.adding == True:
+            # The embedding and the hyperlinks of a new webpage need its id right away
             await self.asave()
+        elif len(changes) > 0:
+            await save_later(scheduler, self, changes)
+
+        if encode_title:
+            await save_later(scheduler, await Embeddings.objects.aencode(string=self.title, webpage=self, source_attribute="title", save=False))
 
-        print(f'      - updated {self.url}')
+        logger.debug("updated %s", self.url)
         return self
 
     async def judge_destination_crawl_worthy(self, destinations):
@@ -319,41 +1007,41 @@ class WebPage(AbstractWebObject):
 
         domain = await Domain.objects.aget(id=self.domain_id)
 
-        async def judge_destination(destination):
+        for destination in destinations:
             if len(destination) > 510:
-                print(f'too long {destination}')
+                logger.debug("too long %s", destination)
+        destinations = [destination for destination in destinations if len(destination) <= 510]
+
+        if crawl_worthy(self.url) or domain.is_source:
+            return destinations
+
+        # The domains of every destination that needs one, in a single query
+        to_look_up = [destination for destination in destinations if not crawl_worthy(destination) and not domain.url in destination]
+        destination_domains = {}
+        if len(to_look_up) > 0:
+            destination_domains = await sync_to_async(Domain.objects.obtain_domains)(to_look_up, create_if_not_existing=False)
+
+        def judge_destination(destination):
+            if crawl_worthy(destination):
+                return True
+            if domain.url in destination:
                 return False
+            destination_domain = destination_domains.get(domain_root(destination))
+            return destination_domain != None and destination_domain.is_source
 
-            is_crawl_worthy = crawl_worthy(destination) or crawl_worthy(self.url)
-
-            if not is_crawl_worthy:
-                is_crawl_worthy = domain.is_source
-                
-                if not is_crawl_worthy and not domain.url in destination: 
-                    destination_domain = await sync_to_async(Domain.objects.get_domain_from_url)(destination, create_if_not_existing=False)
-                    if destination_domain:
-                        is_crawl_worthy = destination_domain.is_source
-            
-            return is_crawl_worthy
-
-        worthy = []
-        for d in destinations:
-            if await judge_destination(d):
-                worthy.append(d)
+        return [destination for destination in destinations if judge_destination(destination)]
 
-        return worthy
-
-    async def read(self):
+    async def read(self, scheduler=None):
         '''
         Makes a request to the webpage's 'url' and then parse the response to update it in the database 
 
         Redirects: If there is a redirect, then mark this webapge 'redirect=True' and then use the response to
             update the resolved url's webpage in the database
 
-        Status codes: Right now we just mark the webpage as requested by setting 'time_last_requested' but don't
-            parse the response or update anything else about the webpage. This is not ideal as some pages might
-            only be temporarily broken and we don't want their information to be missing in our databse forever.
-            In the future we should have some 'last_status_code' field in the WebPage model
+        Status codes: The status code is saved in 'last_status_code'. On a 4xx or 5xx we just mark the webpage
+            as requested by setting 'time_last_requested' but don't parse the response or update anything
+            else about the webpage. Errors and failed requests count up 'consecutive_failures', which the
+            frontier uses to back off from the webpage (see 'FrontierManager.reschedule()')
 
         Types of files: We need different methods to parse each file type
             1. HTML: We call '.read_html()'
@@ -361,29 +1049,70 @@ class WebPage(AbstractWebObject):
             3. JSON: 
                 - We call  '.wp_page_api_index()' for wordpress api index pages
                 - We call '.wp_page_api(); for wordpress rest api endpoints
+
+        Conditional requests: The 'ETag' and 'Last-Modified' validators of the last response are sent
+            back as 'If-None-Match' and 'If-Modified-Since'. If the server answers '304 Not Modified' we
+            only update 'time_last_requested' and skip parsing the page entirely
+
+        Unchanged bodies: If the body is the same as last time (see '.is_unchanged()') we also only
+            update 'time_last_requested'
+
+        Scheduler: If a 'webpage.crawl.CrawlScheduler' is given, the request waits for a free slot
+            for this webpage's host before it is made and uses the scheduler's pooled session.
+            Otherwise a session is opened just for this request
         '''
 
-        print(" - hit: " + self.url)
+        logger.debug("hit %s", self.url)
         hit_time = timezone.now()
         if not "http" in self.url:
             await self.adelete()
             return
 
+        # Stays None if we never get a response
+        self.last_status_code = None
+        self.prepare_change_observation()
+
+        def count_read(outcome):
+            if scheduler != None:
+                scheduler.count_read(outcome)
+
         try:
-            async with aiohttp.ClientSession(headers=HEADER, max_line_size=8190 * 2, max_field_size=8190 * 2) as session:
-                async with session.get(self.url) as r:
+            async with request_session(scheduler, self.url) as session:
+                fetch_start = time.perf_counter()
+                async with session.get(self.url, headers=self.conditional_headers()) as r:
                     #print(f' - HITTED ({timezone.now() - hit_time})\n    - {self.url}')
+                    record_stage("fetch", time.perf_counter() - fetch_start)
+                    FETCH_SECONDS.observe(time.perf_counter() - fetch_start, **self.metric_labels())
+                    RESPONSES.inc(status=r.status, **self.metric_labels())
+
+                    self.last_status_code = r.status
+
+                    if r.status == 304:
+                        logger.debug("not modified %s", self.url)
+                        self.consecutive_failures = 0
+                        self.observe_change(False)
+                        self.time_last_requested = timezone.now()
+                        await save_later(scheduler, self)
+                        count_read("not modified")
+                        return self
                     
                     status_code_type = math.floor(r.status/100)
                     if status_code_type == 4 or status_code_type == 5:
+                        self.consecutive_failures = self.consecutive_failures + 1
                         self.time_last_requested = timezone.now()
-                        await self.asave()
+                        await save_later(scheduler, self)
+                        count_read("failed")
                         return
 
+                    self.consecutive_failures = 0
+
                     requested_page = None
                     url = str(r.url)
 
-                    if url == self.url:
+                    if url_hash(url) == url_hash(self.url):
+                        # The same webpage, maybe redirected to its https url or without a trailing
+                        # slash. Keep the url we were sent to so we don't go through the redirect again
+                        self.url = url
                         requested_page = self
                     else:
                         self.is_redirect = True
@@ -396,31 +1125,155 @@ class WebPage(AbstractWebObject):
                                 requested_page = redirect_webpage
 
                     if requested_page != None:
+                        requested_page.etag = r.headers.get("ETag")
+                        requested_page.last_modified = r.headers.get("Last-Modified")
+                        requested_page.body_unchanged = False
+                        if requested_page != self:
+                            requested_page.prepare_change_observation()
+
                         if requested_page.page_type == "wordpress api":
-                            await requested_page.wp_page_api(r)
+                            await requested_page.wp_page_api(r, scheduler=scheduler)
                         elif requested_page.page_type == "wordpress api index":
-                            await requested_page.wp_page_api_index(r)
+                            await requested_page.wp_page_api_index(r, session)
                         else:
                             if "pdf" in r.content_type:
-                                await self.read_pdf(r)
+                                await self.read_pdf(r, scheduler=scheduler)
                             elif "html" in r.content_type:
-                                await requested_page.read_html(r)
+                                await requested_page.read_html(r, scheduler=scheduler)
                             else:
-                                print(f" - WEIRD CONTENT TYPE {r.content_type} oops {self.url} ")
+                                logger.info("unknown content type %s %s", r.content_type, self.url)
                                 requested_page.time_last_requested = timezone.now()
-                                await requested_page.asave()
+                                await save_later(scheduler, requested_page)
 
-                    print(f" - hitted: {self.url}")
+                        if requested_page.body_unchanged:
+                            count_read("unchanged")
+                        else:
+                            count_read("read")
+
+                    logger.debug("hitted %s", self.url)
                     return requested_page
                         
         except Exception as e: 
-            print(f"error: {self.url}, {e}")
+            logger.warning("error reading %s, %s", self.url, e)
+            FETCH_ERRORS.inc(**self.metric_labels())
+            count_read("failed")
+            # Only save the failure, the rest of this webpage may have been left half updated
+            self.consecutive_failures = self.consecutive_failures + 1
+            await WebPage.objects.filter(id=self.id).aupdate(last_status_code=self.last_status_code, consecutive_failures=self.consecutive_failures)
             return None
 
+    async def read_body(self, r, content_type):
+        '''
+        Stream the body of response 'r', stopping at the CRAWL_MAX_BODY_SIZE of 'content_type'
+        ("html", "pdf" or "json") so one huge file can't use up the worker's memory. Html also stops
+        CRAWL_HTML_BODY_PREFIX bytes after the end of its head, which leaves the metadata and most
+        of the hyperlinks. Whether the body was cut short is saved in 'is_truncated'.
+        '''
+        with timed("download"):
+            if content_type == "html":
+                body, truncated = await read_limited(r, CRAWL_MAX_BODY_SIZE["html"], marker=b"</head", after_marker=CRAWL_HTML_BODY_PREFIX)
+            else:
+                body, truncated = await read_limited(r, CRAWL_MAX_BODY_SIZE[content_type])
+
+        RESPONSE_BYTES.inc(len(body), **self.metric_labels())
+
+        self.is_truncated = truncated
+        if truncated:
+            logger.info("truncated %s %s", content_type, self.url)
+
+        return body
+
+    async def is_unchanged(self, body, encoding=None, normalize=False):
+        '''
+        Fingerprint a response 'body' as the sha256 in 'content_hash' and, if 'normalize' and
+        CRAWL_TEXT_HASH are set, as the hash of its text without nonces and other volatile markup in 'text_hash'
+        (see 'webpage.parsing.normalized_text_hash()'). Returns whether either fingerprint matches the
+        last response, in which case nothing about the webpage can have changed and reading the body
+        again can be skipped.
+        '''
+        content_hash = hashlib.sha256(body).hexdigest()
+        unchanged = self.content_hash == content_hash
+        self.content_hash = content_hash
+
+        if normalize and CRAWL_TEXT_HASH and not unchanged:
+            text_hash = await run_parser(normalized_text_hash, body, encoding)
+            unchanged = self.text_hash == text_hash
+            self.text_hash = text_hash
+
+        return unchanged
+
+    async def skip_unchanged(self, scheduler=None):
+        '''
+        Only mark this webpage as requested, for a response whose body hasn't changed
+        '''
+        logger.debug("unchanged %s", self.url)
+        self.body_unchanged = True
+        self.observe_change(False)
+        self.time_last_requested = timezone.now()
+        await save_later(scheduler, self)
+
+    async def read_text(self, r, content_type):
+        '''
+        '.read_body()' decoded as text
+        '''
+        body = await self.read_body(r, content_type)
+        return body.decode(r.charset or "utf-8", errors="replace")
+
+    def prepare_change_observation(self):
+        '''
+        Remember when this webpage was last requested and updated, before a read changes them
+        '''
+        self.previous_request = self.time_last_requested
+        self.previous_time_updated = self.time_updated
+        self.change_observation = None
+
+    def observe_change(self, changed=True):
+        '''
+        Add whether this webpage changed since its last request to 'change_history' as [seconds
+        since that request, 1 if it changed else 0], keeping the last CHANGE_HISTORY_SIZE. The
+        frontier reads webpages again sooner the more often they change (see
+        'webpage.crawl.recrawl_interval()').
+
+        A body that differs from the last one ('changed') only counts as a change if the webpage
+        doesn't tell us it was last updated at the same time as before, so markup that changes on
+        every request doesn't make a webpage look busy. Nothing is observed on the first request.
+        '''
+        if getattr(self, "previous_request", None) == None:
+            return
+
+        if changed and self.time_updated != None and self.time_updated == self.previous_time_updated:
+            changed = False
+
+        seconds = round((timezone.now() - self.previous_request).total_seconds())
+        self.change_observation = [seconds, int(changed)]
+        self.change_history = (self.change_history + [self.change_observation])[-CHANGE_HISTORY_SIZE:]
+
+    def metric_labels(self):
+        '''
+        Labels for the crawl metrics about this webpage (see 'webpage/metrics.py')
+        '''
+        return {"domain": domain_label(self.url), "page_type": self.page_type}
+
+    def conditional_headers(self):
+        '''
+        Return the request headers that ask the server to only send the page if it changed since
+        our last request. Redirects are requested unconditionally since the validators we saved
+        belong to the page they redirected to.
+        '''
+        headers = {}
+        if self.is_redirect:
+            return headers
+
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
     def read_anchors(self, anchors):
         '''
-        Recieved anchor tags (anchors) found by scraping this page with beautifulSoup
-        'soup.find_all("a")' and returns urls and a dictionary that maps urls to guessed
+        Recieved anchors found by scraping this page (dictionaries made by
+        'webpage.parsing.read_anchor()') and returns urls and a dictionary that maps urls to guessed
         at webpage titles.
 
         Urls: The href attributes of the anchor elements are transformed to absolute urls using
@@ -436,17 +1289,17 @@ class WebPage(AbstractWebObject):
         urls = []
         titles = {}
         for anchor in anchors:
-            url = anchor.get("href")
+            url = anchor["href"]
             if url == None or url == "":
                 continue
             url = get_absolute_url(url, referrer_domain_str)
             if url != False:
-                if anchor.string != "" and anchor.string != None:
-                    title = anchor.string
-                elif anchor.has_attr("aria-label"):
-                    title = anchor.get("aria-label")
-                elif anchor.has_attr("title"):
-                    title = anchor.get("title")
+                if anchor["string"] != "" and anchor["string"] != None:
+                    title = anchor["string"]
+                elif anchor["aria-label"] != None:
+                    title = anchor["aria-label"]
+                elif anchor["title"] != None:
+                    title = anchor["title"]
                 else:
                     title = url
 
@@ -496,19 +1349,27 @@ class WebPage(AbstractWebObject):
                 if not url in titles:
                     titles[url] = url 
             
+            prime_robots_rules(urls)
+            urls = [url for url in urls if robots_allowed(url)]
             urls = async_to_sync(self.judge_destination_crawl_worthy)(urls)
-            print(f'            - judge crawlworthy {self.url}')
-            webpages_from_hyperlinks = [WebPage.objects.obtain_webpage(url, titles[url], time_discovered=now) for url in urls]
-            print(f'            - obtain {self.url}')
-            webpages_from_hyperlinks = list(filter(lambda wp: wp!= None, webpages_from_hyperlinks))
-            webpages_to_create = list(filter(lambda wp: wp._state.adding == True, webpages_from_hyperlinks))
-            #print(f'            - filter by adding {self.url}')
-
-            if len(webpages_to_create) > 0:
-                print(f'            - bulk create {self.url}')
-                new_links = True
-                WebPage.objects.bulk_create(webpages_to_create)
-                print(f'            - bulk created {self.url}')
+
+            with transaction.atomic():
+                # Other workers can't create webpages for these urls until we're done
+                advisory_lock([url_hash(url) for url in urls])
+
+                webpages_from_hyperlinks = WebPage.objects.obtain_webpages(urls, titles, time_discovered=now)
+                webpages_to_create = list(filter(lambda wp: wp._state.adding == True, webpages_from_hyperlinks))
+                #print(f'            - filter by adding {self.url}')
+
+                LINKS_FOUND.inc(len(webpages_from_hyperlinks), **self.metric_labels())
+
+                if len(webpages_to_create) > 0:
+                    LINKS_DISCOVERED.inc(len(webpages_to_create), **self.metric_labels())
+                    new_links = True
+                    WebPage.objects.bulk_create(webpages_to_create)
+                    WebPage.objects.update_domain_aggregates(webpages_to_create, created=True)
+                    Frontier.objects.enqueue(webpages_to_create)
+                    logger.debug("created %s webpages from %s", len(webpages_to_create), self.url)
 
             return webpages_from_hyperlinks
 
@@ -520,31 +1381,28 @@ class WebPage(AbstractWebObject):
 
             start = timezone.now()
             referals = []
-            print(f'                        - start create refers {self.url} {len(webpages)}')
             for webpage in webpages:
-                if not await Referral.objects.filter(source_webpage=self, destination_webpage=webpage).aexists():
-                    print(f'                        - setup refers {self.url} {webpage.url}')
-                    referals.append(Referral(
-                        source_webpage = self,
-                        source_domain_id = self.domain_id,
+                referals.append(Referral(
+                    source_webpage = self,
+                    source_domain_id = self.domain_id,
 
-                        destination_webpage = webpage,
-                        destination_domain_id = webpage.domain_id,
+                    destination_webpage = webpage,
+                    destination_domain_id = webpage.domain_id,
 
-                        time_discovered = now
-                        ))
+                    time_discovered = now,
+                    last_seen = now
+                    ))
 
-            print(f'            - create refers start {self.url}')
-            await Referral.objects.abulk_create(referals)
-            print(f'            - create refers finish {self.url}')
+            await Referral.objects.aadd_edges(referals)
+            logger.debug("saved %s referrals from %s", len(referals), self.url)
 
-        print(f'      - create pages {self.url}  {len(links)}')
+        db_start = time.perf_counter()
         webpages = await get_or_create_pages(links, link_labels)
-        print(f'      - create refers {self.url} {len(webpages)}')
         await create_new_referrs(webpages)
+        DB_SECONDS.observe(time.perf_counter() - db_start, **self.metric_labels())
         return subpages, new_links
 
-    async def wp_page_api_test(self, wp_api_a, wp_api_b):
+    async def wp_page_api_test(self, wp_api_a, wp_api_b, session):
         '''
         Wordpress api can be messed up sometimes. This method allows us to test that
         the parameters we are using are all fine in combination. We do this by
@@ -560,15 +1418,16 @@ class WebPage(AbstractWebObject):
         are out of possibilities. 
 
         Make sure you use this method for saving any wordpress api requests.
+
+        Both requests are made with 'session' so they can reuse its connections.
         '''
 
         async def async_web_request(url):
             '''
             Request to the api endpoint and return the response as json
             '''
-            async with aiohttp.ClientSession(headers=HEADER, max_line_size=8190 * 2, max_field_size=8190 * 2) as session:
-                async with session.get(url) as r:
-                    return json.loads(await r.text())
+            async with session.get(url) as r:
+                return json.loads(await r.text())
 
         a, b = await asyncio.gather(async_web_request(wp_api_a), async_web_request(wp_api_b))
 
@@ -576,34 +1435,34 @@ class WebPage(AbstractWebObject):
             if a[0] != b[0]:
                 return 0
             else:
-                print("not paging correctly")
+                logger.info("wordpress api not paging correctly %s", wp_api_a)
                 return 1
         else:
             if type(a) == type(b):
-                print("error with api")
-                print(a)
-                print(b)
+                logger.info("error with wordpress api %s: %s %s", wp_api_a, a, b)
                 return 2
 
             elif type(a) != list:
-                print("error on first page")
-                print(a)
+                logger.info("error on first page of wordpress api %s: %s", wp_api_a, a)
 
                 return 3
 
             else:
-                print("error on second page")
-                print(b)
+                logger.info("error on second page of wordpress api %s: %s", wp_api_b, b)
                 return 4
 
-    async def wp_page_api_index(self, r):
+    async def wp_page_api_index(self, r, session):
         '''
         Read through the wordpess api index page located at '/wp-json/wp/v2/', identify endpoints
         we want to read, use '.wp_page_api_test()' to test them, and then add those endpoints as
-        WebPages to the database
+        WebPages to the database. 'session' is used for the test requests.
         '''
 
-        text = await r.text()
+        text = await self.read_text(r, "json")
+        if self.is_truncated:
+            self.time_last_requested = timezone.now()
+            await self.asave()
+            return
 
         API_ROUTES = ["pages", "posts", "media", "tribe_events"]
 
@@ -634,8 +1493,8 @@ class WebPage(AbstractWebObject):
             '''
             if f"/wp/v2/{api}" in info["routes"]:
                 api_page = possible_api_routes[pa](api, 1, WP_API_FIRST_PAGE_SIZE)
-                if not WebPage.objects.filter(domain_id=self.domain_id, url=api_page).exists():
-                    print(f" - {self.url} wp api found {api}")
+                if not WebPage.objects.filter(url_hash=url_hash(api_page)).exists():
+                    logger.info("found wordpress api %s on %s", api, self.url)
                     WebPage.objects.create(
                         title="Wordpress api",
                         url=api_page,
@@ -648,7 +1507,7 @@ class WebPage(AbstractWebObject):
         pa = 0
         for api in API_ROUTES:
             if f"/wp/v2/{api}" in info["routes"]:
-                print(f'testing with {api}')
+                logger.debug("testing wordpress api %s on %s", api, self.url)
 
                 a = 1
                 b = 2
@@ -656,14 +1515,14 @@ class WebPage(AbstractWebObject):
                 while True:
                     if pa > len(possible_api_routes):
                         pa = 0
-                        print(f'exhuasted possibilities')
+                        logger.info("exhausted wordpress api parameters for %s on %s", api, self.url)
                         break
 
                     #try:
-                    test_result = await self.wp_page_api_test(possible_api_routes[pa](api, a, 1), possible_api_routes[pa](api, b, 1))
+                    test_result = await self.wp_page_api_test(possible_api_routes[pa](api, a, 1), possible_api_routes[pa](api, b, 1), session)
 
                     if test_result == 0:
-                        print(f"suceeded with {possible_api_routes[pa](api, a, 1)} {possible_api_routes[pa](api, b, 1)}")
+                        logger.debug("suceeded with %s %s", possible_api_routes[pa](api, a, 1), possible_api_routes[pa](api, b, 1))
                         break
                     elif test_result == 1:
                         pa = pa + 1
@@ -685,7 +1544,7 @@ class WebPage(AbstractWebObject):
             await add_wp_api_page(api, pa)
 
 
-    async def wp_page_api(self, r):
+    async def wp_page_api(self, r, scheduler=None):
         '''
         Use 'wp_page_api_read_item' to save each item in a wordpress REST api response as a Webpage
         in the database. Then, as the api is paginated, add the endpoint's next page to the database
@@ -696,14 +1555,25 @@ class WebPage(AbstractWebObject):
                 we have read all pages in this endpoint
             2. We decrease the 'per_page' parameter if we recieve 
                 {'code': 'rest_invalid_param', 'message': 'Invalid parameter(s): per_page'}
+
+        The items are saved through the write buffer of 'scheduler' if it is given (see
+        'webpage.crawl.WriteBuffer'), so a page of items is written in a few statements.
         '''
 
-        text = await r.text()
+        body = await self.read_body(r, "json")
 
         self.time_last_requested = timezone.now()
 
+        if self.is_truncated:
+            await save_later(scheduler, self)
+            return
+
+        if await self.is_unchanged(body):
+            await self.skip_unchanged(scheduler)
+            return
+
         #print(f' - read: {self.url}')       
-        info = json.loads(text)
+        info = json.loads(body.decode(r.charset or "utf-8", errors="replace"))
 
         if type(info) == dict:
             if "code" in info:
@@ -717,14 +1587,20 @@ class WebPage(AbstractWebObject):
                         orderby = int(captured_value["orderby"][0])
                         order = int(captured_value["order"][0])
 
-                        print(f"page size too high {self.url}")
-                        self.url = self.url.split("?")[0] + f'?page={page}&per_page={per_page}&orderby={orderby}&order={order}'
+                        logger.info("page size too high %s", self.url)
+                        smaller_url = self.url.split("?")[0] + f'?page={page}&per_page={per_page}&orderby={orderby}&order={order}'
 
-                        await self.asave()
-                        print(f"new page size {self.url}")
+                        if await WebPage.objects.filter(url_hash=url_hash(smaller_url)).exclude(id=self.id).aexists():
+                            # The smaller page is already a webpage of its own, its url_hash is taken
+                            logger.info("%s already exists, delete %s", smaller_url, self.url)
+                            await self.adelete()
+                        else:
+                            self.url = smaller_url
+                            await self.asave()
+                            logger.info("new page size %s", self.url)
 
                 elif info["code"] == "rest_post_invalid_page_number":
-                    print(f"delete {self.url}")
+                    logger.info("read every page of wordpress api, delete %s", self.url)
                     await self.adelete()
 
                 return
@@ -732,15 +1608,13 @@ class WebPage(AbstractWebObject):
         pages = info
         #print(f"pages ({len(pages)}) {self.url}")
         tasks = []
-        print(F"TO GATHER {self.url}")
         for page in pages:
             #tasks.append(asyncio.create_task(self.wp_page_api_read_item(page)))
-            await self.wp_page_api_read_item(page)
+            await self.wp_page_api_read_item(page, scheduler=scheduler)
         
         add_wp_articles_time = timezone.now()
         #await asyncio.gather(*tasks)
-        print(F"GATHERED {self.url}")
-        print(f' - WP PAGES ({len(pages)}) ({timezone.now() - add_wp_articles_time})\n    - {self.url}')
+        logger.debug("read %s wordpress api items (%s) %s", len(pages), timezone.now() - add_wp_articles_time, self.url)
 
         parsed = urlparse(self.url)
         captured_value = parse_qs(parsed.query)
@@ -763,7 +1637,7 @@ class WebPage(AbstractWebObject):
             
             if increment_url != None:
                 #print(f"increment? {increment_url}")
-                if not await WebPage.objects.filter(domain_id=self.domain_id, url=increment_url).aexists():
+                if not await WebPage.objects.filter(url_hash=url_hash(increment_url)).aexists():
                     await WebPage.objects.acreate(
                         title=f"Wordpress api {increment}",
                         url=increment_url,
@@ -773,9 +1647,10 @@ class WebPage(AbstractWebObject):
                         time_discovered=self.time_last_requested
                         )
 
-        await self.asave()
+        self.observe_change()
+        await save_later(scheduler, self)
 
-    async def wp_page_api_read_item(self, page):
+    async def wp_page_api_read_item(self, page, scheduler=None):
         '''
         Read an item from a wordpress REST api and save or update WebPage in the database.
             - Example endpoint: https://arts.ubc.ca/wp-json/wp/v2/pages 
@@ -785,17 +1660,9 @@ class WebPage(AbstractWebObject):
             if not page["media_type"] in ["file", "application", "video", "audio"]:
                 return
 
-        description = ""
-
-        if "excerpt" in page:
-            soup = BeautifulSoup(page["excerpt"]["rendered"], "html.parser")
-            description = soup.get_text()
-        elif "caption" in page:
-            description = BeautifulSoup(page["caption"]["rendered"], "html.parser").get_text()
-
-        title = BeautifulSoup(page["title"]["rendered"], "html.parser").get_text()
-        if title == None:
-            title = page["guid"]["rendered"]
+        item = await run_parser(parse_wordpress_item, page)
+        title = item["title"]
+        description = item["description"]
 
         image = None
         if "yoast_head_json" in page:
@@ -806,13 +1673,15 @@ class WebPage(AbstractWebObject):
         time_updated = timezone.make_aware(timezone.datetime.fromisoformat(page["modified"]))
         time_published = timezone.make_aware(timezone.datetime.fromisoformat(page["date"]))
 
+        if not await sync_to_async(robots_allowed)(page["link"]):
+            return
+
         listed_page = await WebPage.objects.aobtain_webpage(page["link"], title)
 
 
         if listed_page == None:
             return
 
-        print(f'      - to update item {listed_page.url}')
 
         await listed_page.update(
             title=title, 
@@ -821,95 +1690,78 @@ class WebPage(AbstractWebObject):
             time_updated=time_updated,
             time_published=time_published,
             time_last_requested=self.time_last_requested,
+            scheduler=scheduler,
             )
 
         if listed_page:
                 
             if "content" in page:
-                anchors = BeautifulSoup(page["content"]["rendered"], "html.parser").find_all('a')
-                links, link_labels = listed_page.read_anchors(anchors)
-                print(f'      - read anchors {listed_page.url}')
+                links, link_labels = listed_page.read_anchors(item["anchors"])
                 await listed_page.deal_with_hyperlinks(links, link_labels)
-                print(f'      - deal with hyperlinks {listed_page.url}')
         
-        print(f'      - read item {listed_page.url}')
+        logger.debug("read wordpress api item %s", listed_page.url)
 
-    async def read_html(self, r):
+    async def read_html(self, r, scheduler=None):
         '''
-        Use BeautifulSoup to scrape a html page for information to update this WebPage
+        Scrape a html page for information to update this WebPage. The html is parsed by
+        'webpage.parsing.parse_html()' on the parser process pool. The webpage, its domain and its
+        new embedding are saved through the write buffer of 'scheduler' if it is given.
         '''
         
-        text = await r.text()
+        body = await self.read_body(r, "html")
+
+        if await self.is_unchanged(body, r.charset, normalize=True):
+            await self.skip_unchanged(scheduler)
+            return
 
         start_read_time = timezone.now()
 
         start_time = timezone.now()
-        soup = BeautifulSoup(text, 'html.parser')
-        print(f'      - soup ({timezone.now() - start_time})\n    - {self.url}')
+        with timed("parse"):
+            page = await run_parser(parse_html, body, r.charset)
+        PARSE_SECONDS.observe((timezone.now() - start_time).total_seconds(), **self.metric_labels())
+        logger.debug("parsed (%s) %s", timezone.now() - start_time, self.url)
         
         # read INFORMATION FROM WEBPAGE
 
         ### read 'time_updated' and 'time_published' from yoast schema graph if existing
         time_updated = None
-        yoast_graph = soup.find("script", attrs={"type" : "application/ld+json", "class": "yoast-schema-graph"})
-        if yoast_graph != None:
-            yoast_graph = json.loads(yoast_graph.decode_contents())
-            if "@graph" in yoast_graph:
-                for scheme in yoast_graph["@graph"]:
-                    if "@type" in scheme:
-                        if scheme["@type"] == "WebPage":
-                            if "dateModified" in scheme:
-                                time_updated = timezone.datetime.fromisoformat(scheme["dateModified"])
-
-                            if "datePublished" in scheme:
-                                self.time_published = timezone.datetime.fromisoformat(scheme["datePublished"])
-                            break
+        if page["yoast_date_modified"] != None:
+            time_updated = timezone.datetime.fromisoformat(page["yoast_date_modified"])
+        if page["yoast_date_published"] != None:
+            self.time_published = timezone.datetime.fromisoformat(page["yoast_date_published"])
 
         ### read title of webpage
-        title = soup.find("meta", attrs={"property" : "og:title"})
-        if title != None:
-            title = title.get("content")
-        else:
-            title = soup.title
-            if title != None:
-                title = soup.title.string
+        title = page["title"]
 
         if title != None:
             if not await self.embeddings.filter(source_attribute="title").aexists() or self.title != title:
-                await Embeddings.objects.aencode(string=title, webpage=self, source_attribute="title")
+                await save_later(scheduler, await Embeddings.objects.aencode(string=title, webpage=self, source_attribute="title", save=False))
             self.title = title
 
         ### read description of webpage
-        meta_description = soup.find("meta", attrs={"name" : "description"})
-        if meta_description == None:
-            meta_description = soup.find("meta", attrs={"property" : "og:description"})
-        if meta_description != None:
-            self.description = meta_description.get("content")
+        if page["description"] != None:
+            self.description = page["description"]
 
         ### read image of webpage
-        meta_image = soup.find("meta", attrs={"property" : "og:image"})
-        if meta_image == None:
-            meta_image = soup.find("meta", attrs={"name" : "twitter:image"})
-        if meta_image != None:
-            self.image = meta_image.get("content")
+        if page["image"] != None:
+            self.image = page["image"]
 
         ### read article modified time of webpage
-        meta_article_publish_time = soup.find("meta", attrs={"property" : "article:published_time"})
+        meta_article_publish_time = page["article_published_time"]
         if meta_article_publish_time != None:
-            meta_article_publish_time = meta_article_publish_time.get("content")
             try:
                 self.time_published = timezone.datetime.fromisoformat(meta_article_publish_time)
             except:
-                print("not iso: " + meta_article_publish_time)
+                logger.debug("not iso: %s", meta_article_publish_time)
 
         ### read article modified time of webpage
-        meta_article_modified_time = soup.find("meta", attrs={"property" : "article:modified_time"})
+        meta_article_modified_time = page["article_modified_time"]
         if meta_article_modified_time != None:
-            meta_article_modified_time = meta_article_modified_time.get("content")
             try:
                 time_updated = timezone.datetime.fromisoformat(meta_article_modified_time)
             except:
-                print("not iso: " + meta_article_modified_time)
+                logger.debug("not iso: %s", meta_article_modified_time)
 
         if self.time_published == None:
             last_modified_header = read_last_modified_header(r)
@@ -917,18 +1769,16 @@ class WebPage(AbstractWebObject):
                 if last_modified_header < self.time_discovered:
                     self.time_published = last_modified_header
                         
-        print(f'      - saved meta {self.url}')
         #text = soup.get_text().lower().replace("\n", " ")
         #while "  " in text:
         #    text = text.replace("  ", " ")
         #words = set(text.split(" "))
 
         # COLLECT AND PROCESS HYPERLINKS
-        anchors = soup.find_all('a')
-        links, link_labels = self.read_anchors(anchors)
-        subpages, new_links = await self.deal_with_hyperlinks(links, link_labels)
+        links, link_labels = self.read_anchors(page["anchors"])
+        with timed("hyperlinks"):
+            subpages, new_links = await self.deal_with_hyperlinks(links, link_labels)
 
-        print(f'      - dealt with hyperlinks {self.url}')
         
         # Decide if webpage has updated
         update_from_last_request = False
@@ -953,6 +1803,8 @@ class WebPage(AbstractWebObject):
         if self.time_published and self.time_updated == None:
             self.time_updated = self.time_published
 
+        self.observe_change()
+
         if self.level == 0:
             '''
             If this WebPage represents a root url, then use the collected information to
@@ -966,53 +1818,21 @@ class WebPage(AbstractWebObject):
             for homepage_name in homepage_names:
                 webpage_domain.title = webpage_domain.title.replace(homepage_name, "")
 
-            og_site_name = soup.find("meta", attrs={"property" : "og:site_name"})
+            if page["site_name"] != None:
+                webpage_domain.title = page["site_name"]
 
-            if og_site_name != None:
-                webpage_domain.title = og_site_name.get("content")
-
-            def get_icon_size(icon):
-                if icon.get("sizes") != None:
-                    return int(icon.get("sizes").split("x")[0])
-                else:
-                    return 0
-
-            web_domain_image = None
-            apple_icons = soup.find_all("link", attrs={"rel" : "apple-touch-icon"})
-            if len(apple_icons) > 0:
-                web_domain_image = sorted(apple_icons, key=get_icon_size, reverse=True)[0]
-
-            if web_domain_image == None:
-                apple_icons = soup.find_all("link", attrs={"rel" : "apple-touch-icon-precomposed"})
-                if len(apple_icons) > 0:
-                    web_domain_image = sorted(apple_icons, key=get_icon_size, reverse=True)[0]
-
-            if web_domain_image == None:
-                web_domain_image = soup.find("link", attrs={"rel" : "shortcut icon"})
-                if web_domain_image != None:
-                    web_domain_image = web_domain_image
-
-            if web_domain_image == None:
-                icons = soup.find_all("link", attrs={"rel" : "icon"})
-                if len(icons) > 0:
-                    web_domain_image = sorted(icons, key=get_icon_size, reverse=True)[0]
-
-            if web_domain_image != None:
-                web_domain_image_url = web_domain_image.get("href")
-                if web_domain_image_url != None or web_domain_image_url != "":                  
-
-                    web_domain_image = get_absolute_url(web_domain_image_url, webpage_domain.url)
-
-                    webpage_domain.image = web_domain_image
+            web_domain_image_url = page["icon"]
+            if web_domain_image_url != None and web_domain_image_url != "":
+                webpage_domain.image = get_absolute_url(web_domain_image_url, webpage_domain.url)
 
             @sync_to_async
             def add_wp_index_page():
                 '''
                 Add the Wordpress api index page if there are clues that this site uses Wordpress
                 '''
-                if "/wp-json/" in text or "/wp-content/" in text:
+                if page["is_wordpress"]:
                     if not WebPage.objects.filter(domain=webpage_domain, page_type="wordpress api index").exists():
-                        print(f" - {self.url} created index page {webpage_domain.url + '/wp-json/wp/v2/'}")
+                        logger.info("%s created wordpress api index page %s", self.url, webpage_domain.url + "/wp-json/wp/v2/")
                         WebPage.objects.create(
                             title="Wordpress api index page",
                             url=webpage_domain.url + "/wp-json/wp/v2/",
@@ -1025,85 +1845,449 @@ class WebPage(AbstractWebObject):
             if webpage_domain.is_source:
                 await add_wp_index_page()
     
-            await asyncio.gather(webpage_domain.asave(), self.asave())
-        
-        else:
-            await self.asave()
+            await save_later(scheduler, webpage_domain, ["title", "description", "image"])
 
-        print(f"save read {self.url}")
+        await save_later(scheduler, self)
+
+        logger.debug("read %s", self.url)
 
         #print(f' - read ({timezone.now() - start_read_time})\n    - {self.url}')
 
-    async def read_pdf(self, r):
+    async def read_pdf(self, r, scheduler=None):
         '''
-        Scrape information from a PDF file for information to update this WebPage
+        Scrape information from a PDF file for information to update this WebPage. The file is
+        read by 'webpage.parsing.parse_pdf()' on the parser process pool. Saves go through the
+        write buffer of 'scheduler' if it is given.
         '''
 
-        print(f' - IGNORE PDF {r.url} for now')
-        reader = PdfReader(BytesIO(await r.read()))
+        body = await self.read_body(r, "pdf")
 
         self.time_last_requested = timezone.now()
 
+        # A PDF that is cut short can't be read
+        if self.is_truncated:
+            await save_later(scheduler, self)
+            return
+
+        if await self.is_unchanged(body):
+            await self.skip_unchanged(scheduler)
+            return
+
+        start_time = timezone.now()
+        with timed("parse"):
+            pdf = await run_parser(parse_pdf, body)
+        PARSE_SECONDS.observe((timezone.now() - start_time).total_seconds(), **self.metric_labels())
+
         # USE METADATA FOR TITLE
-        meta = reader.metadata
-        if meta.title:
-            if not await self.embeddings.filter(source_attribute="title").aexists() or self.title != meta.title:
-                await Embeddings.objects.aencode(string=meta.title, webpage=self, source_attribute="title")
-            self.title = meta.title
+        if pdf["title"]:
+            if not await self.embeddings.filter(source_attribute="title").aexists() or self.title != pdf["title"]:
+                await save_later(scheduler, await Embeddings.objects.aencode(string=pdf["title"], webpage=self, source_attribute="title", save=False))
+            self.title = pdf["title"]
 
 
         # USE METADATA FOR DESCRIPTION FIELD
-        meta_info = [
-            (f"{meta.keywords}", meta.keywords),
-            (f"Subject: {meta.subject}", meta.subject),
-            (f"Author: {meta.author}", meta.author),
-            (f"Creator: {meta.creator}", meta.creator),
-            (f"Producer: {meta.producer}", meta.producer),
-            (f"Created: {meta.creation_date}", meta.creation_date),
-            (f"Modified: {meta.modification_date}", meta.modification_date),
-        ]
-        self.description = "\n".join(map(lambda info: info[0], (filter(lambda info: info[1], meta_info))))
+        self.description = pdf["description"]
 
 
         last_modified_header = read_last_modified_header(r)
         self.time_updated = last_modified_header
-        if self.time_discovered > last_modified_header:
+        if last_modified_header and self.time_discovered > last_modified_header:
             self.time_published = last_modified_header
 
 
         # COLLECT AND PROCESS HYPERLINKS
-        hyperlinks = []
-        for i in range(reader.get_num_pages()):
-            page = reader.pages[i]
-            if "/Annots" in page:
-                for annotation in page["/Annots"]:
-                    if "/A" in annotation.get_object():
-                        if annotation.get_object()["/A"]["/S"] == "/URI":
-                            hyperlinks.append(annotation.get_object()["/A"]["/URI"])
+        if len(pdf["hyperlinks"]) > 0:
+            await self.deal_with_hyperlinks(pdf["hyperlinks"], {})
+
+        self.observe_change()
+        await save_later(scheduler, self)
 
-        if len(hyperlinks) > 0:
-            await self.deal_with_hyperlinks(hyperlinks, {})
 
-        # READ TEXT
-        #text = "\n".join([page.extract_text() for page in reader.pages])
-        #print(text)
+class FrontierManager(models.Manager):
+    def enqueue(self, webpages, next_fetch_at=None):
+        '''
+        Add saved 'webpages' to the frontier so they are read once 'next_fetch_at' (default now)
+        has passed. Webpages already in the frontier keep their existing entry.
+        '''
+        if next_fetch_at == None:
+            next_fetch_at = timezone.now()
+
+        entries = [Frontier(
+            webpage_id=webpage.id,
+            url=webpage.url,
+            domain_id=webpage.domain_id,
+            priority=frontier_priority(webpage),
+            next_fetch_at=next_fetch_at,
+            ) for webpage in webpages]
 
-        await self.asave()
+        return self.bulk_create(entries, ignore_conflicts=True)
 
+    def dequeue(self, limit, domain=None, per_domain=None, lease=CRAWL_LEASE_TIME, worker_id=None):
+        '''
+        Lease up to 'limit' entries that are due, earliest first. Only entries of 'domain' are
+        leased if it is given and no more than 'per_domain' entries are leased from a single
+        domain if that is given.
+
+        Leasing pushes 'next_fetch_at' forward by 'lease' seconds, so an entry that is never
+        rescheduled (because its crawl crashed) becomes due again once the lease expires.
+
+        Rows are claimed with 'SELECT ... FOR UPDATE SKIP LOCKED', so any number of workers
+        ('worker_id' is saved in 'leased_by') can dequeue at the same time without getting the
+        same entries.
+        '''
+        now = timezone.now()
+        lease_expires_at = now + timezone.timedelta(seconds=lease)
+
+        query = self.filter(next_fetch_at__lte=now)
+        if domain != None:
+            query = query.filter(domain=domain)
+        query = query.select_related("webpage", "domain").select_for_update(skip_locked=True, of=("self",)).order_by("next_fetch_at", "priority")
+
+        with transaction.atomic():
+            if per_domain == None:
+                entries = list(query[:limit])
+            else:
+                entries = []
+                domain_counts = {}
+                for entry in query[:limit * per_domain]:
+                    if domain_counts.get(entry.domain_id, 0) >= per_domain:
+                        continue
+                    domain_counts[entry.domain_id] = domain_counts.get(entry.domain_id, 0) + 1
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        break
+
+            self.filter(id__in=[entry.id for entry in entries]).update(next_fetch_at=lease_expires_at, lease_expires_at=lease_expires_at, leased_by=worker_id)
+
+        for entry in entries:
+            entry.next_fetch_at = lease_expires_at
+            entry.lease_expires_at = lease_expires_at
+            entry.leased_by = worker_id
+
+        return entries
+
+    async def adequeue(self, limit, domain=None, per_domain=None, lease=CRAWL_LEASE_TIME, worker_id=None):
+        return await sync_to_async(self.dequeue)(limit, domain=domain, per_domain=per_domain, lease=lease, worker_id=worker_id)
+
+    def reschedule(self, entries):
+        '''
+        Release leased 'entries' after their webpages were read. Source webpages of source domains
+        are read again after the interval their change history calls for, with the change history
+        of their domain as the prior (see 'webpage.crawl.recrawl_interval()'). Webpages that still
+        haven't been requested successfully are read again after HIT_TIMEOUT. Every other entry is
+        removed from the frontier.
+
+        Webpages whose last read failed back off exponentially from HIT_TIMEOUT. After
+        CRAWL_MAX_PAGE_FAILURES failures in a row only source webpages are kept in the frontier.
+        '''
+        now = timezone.now()
+        to_update = []
+        to_delete = []
+        for entry in entries:
+            webpage = entry.webpage
+            is_source = webpage.is_source and entry.domain.is_source
+            if webpage.consecutive_failures > 0 and (is_source or webpage.consecutive_failures <= CRAWL_MAX_PAGE_FAILURES):
+                wait = backoff(webpage.consecutive_failures, HIT_TIMEOUT.total_seconds())
+                entry.next_fetch_at = now + timezone.timedelta(seconds=wait)
+                entry.lease_expires_at = None
+                entry.leased_by = None
+                to_update.append(entry)
+            elif webpage.consecutive_failures == 0 and (webpage.time_last_requested == None or is_source):
+                wait = HIT_TIMEOUT.total_seconds()
+                if is_source:
+                    wait = recrawl_interval(webpage.change_history, entry.domain.change_history)
+                entry.next_fetch_at = now + timezone.timedelta(seconds=wait)
+                entry.lease_expires_at = None
+                entry.leased_by = None
+                entry.priority = frontier_priority(webpage)
+                to_update.append(entry)
+            else:
+                to_delete.append(entry.id)
+
+        if len(to_delete) > 0:
+            self.filter(id__in=to_delete).delete()
+        if len(to_update) > 0:
+            self.bulk_update(to_update, ["next_fetch_at", "lease_expires_at", "leased_by", "priority"])
+
+    async def areschedule(self, entries):
+        return await sync_to_async(self.reschedule)(entries)
+
+    def postpone(self, domain, until, entries=[]):
+        '''
+        Push every entry of 'domain' that is due before 'until' back to 'until', along with the
+        leased 'entries'. Used while the domain's circuit breaker is open.
+        '''
+        query = Q(domain=domain, next_fetch_at__lt=until) | Q(id__in=[entry.id for entry in entries])
+        return self.filter(query).update(next_fetch_at=until, lease_expires_at=None, leased_by=None)
+
+    async def apostpone(self, domain, until, entries=[]):
+        return await sync_to_async(self.postpone)(domain, until, entries)
+
+    def release(self, worker_id):
+        '''
+        Make every entry still leased by 'worker_id' due now. Used when a worker stops, and when it
+        starts again under the same id after being killed, so its entries don't wait out their lease.
+        '''
+        return self.filter(leased_by=worker_id, lease_expires_at__isnull=False).update(next_fetch_at=timezone.now(), lease_expires_at=None, leased_by=None)
+
+    async def arelease(self, worker_id):
+        return await sync_to_async(self.release)(worker_id)
+
+class Frontier(models.Model):
+    '''
+    Webpages waiting to be read. Each webpage has at most one entry, which is due once
+    'next_fetch_at' has passed. See 'FrontierManager' for how entries are leased and rescheduled.
+    '''
+    webpage = models.OneToOneField(WebPage, related_name="frontier", on_delete=models.CASCADE)
+    url = models.URLField(max_length=510)
+    domain = models.ForeignKey(Domain, related_name="frontier", on_delete=models.CASCADE)
+
+    priority = models.IntegerField(default=0)
+    next_fetch_at = models.DateTimeField()
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    leased_by = models.CharField(max_length=255, blank=True, null=True)
+
+    objects = FrontierManager()
+
+    def __str__(self):
+        return self.url
+
+    class Meta():
+        indexes = [
+            models.Index(fields=["next_fetch_at", "priority"], name="frontier_due_idx"),
+            models.Index(fields=["domain", "next_fetch_at", "priority"], name="frontier_domain_due_idx"),
+            # Entries a worker still holds, see 'FrontierManager.release()'
+            models.Index(fields=["leased_by"], name="frontier_leased_idx", condition=Q(lease_expires_at__isnull=False)),
+        ]
+
+
+def month_start(moment, months=0):
+    '''
+    Start (in UTC) of the month 'months' after the month of 'moment'
+    '''
+    month = moment.year * 12 + moment.month - 1 + months
+    return timezone.datetime(month // 12, month % 12 + 1, 1, tzinfo=datetime_timezone.utc)
 
 class ReferralManager(models.Manager):
     def create(self, **obj_data):
+        '''
+        Save the referral with 'add_edges()' and return the referral of its source-destination
+        pair, the one that was already saved if there is one
+        '''
         if not 'source_domain' in obj_data:
             obj_data['source_domain'] = obj_data['source_webpage'].domain
         if not 'destination_domain' in obj_data:
             obj_data['destination_domain'] = obj_data['destination_webpage'].domain
         if not 'time_discovered' in obj_data:
             obj_data['time_discovered'] = timezone.now()
-        return super().create(**obj_data)
+        if not 'last_seen' in obj_data:
+            obj_data['last_seen'] = obj_data['time_discovered']
+        referral = self.model(**obj_data)
+        self.add_edges([referral])
+        return self.get(source_webpage_id=referral.source_webpage_id, destination_webpage_id=referral.destination_webpage_id)
     async def acreate(self, **obj_data):
         return await sync_to_async(self.create)(**obj_data)
 
+    def bulk_create(self, objs, **kwargs):
+        '''
+        Referrals are only saved with 'add_edges()', so the pair stays unique and the DomainLinks
+        are counted. The referrals aren't given their ids.
+        '''
+        objs = list(objs)
+        self.add_edges(objs)
+        return objs
+
+    def add_edges(self, referrals):
+        '''
+        Save the unsaved 'referrals'. A source-destination pair that already exists isn't saved
+        again, its 'last_seen' is moved forward instead, once it is more than
+        REFERRAL_LAST_SEEN_RESOLUTION old so reading a webpage again doesn't rewrite every one of
+        its referrals. The same statement counts the referrals that were new into the DomainLinks
+        between their domains.
+
+        'is_recrawled' is set from the source webpage and its domain as they are in the database,
+        so the referrals of a webpage that became a source move to the partitions of re-read
+        webpages the next time it is read.
+
+        The partitioned referral table can't have a unique constraint on the pair (see 'Referral'),
+        so referrals are added under an advisory lock for their source webpage and workers saving
+        the same hyperlinks at once can't both insert them. A trigger takes the same lock and skips
+        rows repeating a pair that are written any other way (see migration 0032).
+
+        Batches of REFERRAL_COPY_MIN_BATCH or more are COPYed into a temporary staging table and
+        inserted from there, which is faster than a multi-row INSERT for large batches.
+        '''
+        if len(referrals) == 0:
+            return
+
+        columns = "source_webpage_id, destination_webpage_id, source_domain_id, destination_domain_id, time_discovered, last_seen"
+        table = self.model._meta.db_table
+
+        with transaction.atomic():
+            advisory_lock([f"referral:{r.source_webpage_id}" for r in referrals])
+
+            with connection.cursor() as cursor:
+                if len(referrals) < REFERRAL_COPY_MIN_BATCH:
+                    edges = "VALUES " + ", ".join(["(%s::bigint, %s::bigint, %s::bigint, %s::bigint, %s::timestamptz, %s::timestamptz)"] * len(referrals))
+                    params = [value for r in referrals for value in (r.source_webpage_id, r.destination_webpage_id, r.source_domain_id, r.destination_domain_id, r.time_discovered, r.last_seen or r.time_discovered)]
+                else:
+                    copied = StringIO("".join(
+                        f"{r.source_webpage_id}\t{r.destination_webpage_id}\t{r.source_domain_id}\t{r.destination_domain_id}\t{r.time_discovered.isoformat()}\t{(r.last_seen or r.time_discovered).isoformat()}\n"
+                        for r in referrals
+                        ))
+                    cursor.execute("CREATE TEMPORARY TABLE referral_staging (source_webpage_id bigint, destination_webpage_id bigint, source_domain_id bigint, destination_domain_id bigint, time_discovered timestamptz, last_seen timestamptz) ON COMMIT DROP")
+                    cursor.copy_expert(f"COPY referral_staging ({columns}) FROM STDIN", copied)
+                    edges = f"SELECT {columns} FROM referral_staging"
+                    params = []
+
+                cursor.execute(f'''
+                    WITH given_edges ({columns}) AS ({edges}),
+                    edges AS (
+                        SELECT given_edges.*, COALESCE(source.is_source AND source_domain.is_source, false) AS is_recrawled
+                        FROM given_edges
+                        LEFT JOIN {WebPage._meta.db_table} AS source ON source.id = given_edges.source_webpage_id
+                        LEFT JOIN {Domain._meta.db_table} AS source_domain ON source_domain.id = given_edges.source_domain_id
+                    ),
+                    existing AS (
+                        SELECT referral.id, referral.last_seen, referral.is_recrawled, source_webpage_id, destination_webpage_id, edges.last_seen AS seen, edges.is_recrawled AS recrawled
+                        FROM {table} AS referral
+                        JOIN edges USING (source_webpage_id, destination_webpage_id)
+                    ),
+                    refreshed AS (
+                        UPDATE {table} AS referral SET last_seen = GREATEST(existing.seen, existing.last_seen), is_recrawled = existing.recrawled
+                        FROM existing
+                        WHERE referral.id = existing.id AND referral.is_recrawled = existing.is_recrawled AND referral.last_seen = existing.last_seen
+                        AND (existing.seen > existing.last_seen + %s * interval '1 second' OR existing.is_recrawled <> existing.recrawled)
+                    ),
+                    inserted AS (
+                        INSERT INTO {table} ({columns}, is_recrawled)
+                        SELECT DISTINCT ON (source_webpage_id, destination_webpage_id) {columns}, is_recrawled FROM edges
+                        WHERE NOT EXISTS (
+                            SELECT FROM existing
+                            WHERE existing.source_webpage_id = edges.source_webpage_id AND existing.destination_webpage_id = edges.destination_webpage_id
+                        )
+                        RETURNING source_domain_id, destination_domain_id, time_discovered
+                    )
+                    {DomainLink.objects.count_sql("inserted")}
+                ''', params + [REFERRAL_LAST_SEEN_RESOLUTION])
+
+    async def aadd_edges(self, referrals):
+        return await sync_to_async(self.add_edges)(referrals)
+
+    def recrawled_table(self):
+        '''
+        The partition of the referrals from re-read webpages, itself partitioned by month
+        '''
+        return f"{self.model._meta.db_table}_recrawled"
+
+    def partition_name(self, month):
+        return f"{self.model._meta.db_table}_p{month:%Y%m}"
+
+    def partitions(self):
+        '''
+        (start of the month, table name) of every monthly partition of the referrals from re-read
+        webpages, oldest first. The default partition isn't included.
+        '''
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent WHERE parent.relname = %s",
+                [self.recrawled_table()],
+                )
+            names = [row[0] for row in cursor.fetchall()]
+
+        partitions = []
+        for name in names:
+            suffix = name[len(table) + 2:]
+            if name.startswith(table + "_p") and len(suffix) == 6 and suffix.isdigit():
+                partitions.append((timezone.datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=datetime_timezone.utc), name))
+        return sorted(partitions)
+
+    def create_partitions(self, months_ahead=REFERRAL_PARTITIONS_AHEAD):
+        '''
+        Create the partitions from this month until 'months_ahead' months from now that don't exist
+        yet. Referrals that went to the default partition because their month had no partition are
+        moved into it. Returns the names of the new partitions.
+        '''
+        table = self.model._meta.db_table
+        recrawled = self.recrawled_table()
+        now = timezone.now()
+        existing = [month for month, name in self.partitions()]
+
+        created = []
+        for i in range(months_ahead + 1):
+            start = month_start(now, i)
+            if start in existing:
+                continue
+            end = month_start(now, i + 1)
+            name = self.partition_name(start)
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"CREATE TABLE {name} (LIKE {recrawled} INCLUDING DEFAULTS)")
+                # Workers can't add referrals of the month to the default partition after they were
+                # moved, attaching the partition would fail on them
+                cursor.execute(f"LOCK TABLE {table}_default IN SHARE ROW EXCLUSIVE MODE")
+                cursor.execute(f"WITH moved AS (DELETE FROM {table}_default WHERE last_seen >= %s AND last_seen < %s RETURNING *) INSERT INTO {name} SELECT * FROM moved", [start, end])
+                cursor.execute(f"ALTER TABLE {recrawled} ATTACH PARTITION {name} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+            created.append(name)
+
+        return created
+
+    def archive_partitions(self, retention=REFERRAL_RETENTION_MONTHS, drop=False):
+        '''
+        Detach the partitions of referrals last seen more than 'retention' whole months ago and
+        uncount them from the DomainLinks. Detached partitions are kept as tables of their own,
+        without their foreign keys so they don't hold on to webpages, unless 'drop' is set. Returns
+        the names of the partitions.
+
+        Only the referrals of re-read webpages are partitioned by month, referrals from every other
+        webpage can't be seen again and are never archived. The few referrals in the partition
+        whose source webpage or domain stopped being a source, so won't be read again, are moved
+        to those first, with their 'last_seen' as it is.
+        '''
+        table = self.model._meta.db_table
+        cutoff = month_start(timezone.now(), -retention)
+
+        archived = []
+        for month, name in self.partitions():
+            if month_start(month, 1) > cutoff:
+                continue
+
+            with connection.cursor() as cursor:
+                # Through the referral table, a partition can't move its rows to another
+                cursor.execute(f'''
+                    UPDATE {table} AS referral SET is_recrawled = false
+                    FROM {WebPage._meta.db_table} AS source, {Domain._meta.db_table} AS source_domain
+                    WHERE referral.is_recrawled AND referral.last_seen >= %s AND referral.last_seen < %s
+                    AND source.id = referral.source_webpage_id AND source_domain.id = referral.source_domain_id
+                    AND NOT (source.is_source AND source_domain.is_source)
+                ''', [month, month_start(month, 1)])
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Detaching waits for workers adding referrals, which lock the referral tables
+                # before the links, so the links are locked in the same order
+                cursor.execute(f"ALTER TABLE {self.recrawled_table()} DETACH PARTITION {name}")
+                DomainLink.objects.uncount(name)
+
+                if drop:
+                    cursor.execute(f"DROP TABLE {name}")
+                else:
+                    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'", [name])
+                    for (constraint,) in cursor.fetchall():
+                        cursor.execute(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"')
+            archived.append(name)
+
+        return archived
+
 class Referral(models.Model):
+    '''
+    A hyperlink from one webpage to another. The table is partitioned by 'is_recrawled', and
+    referrals from re-read webpages are partitioned again by the month of 'last_seen' (see
+    'ReferralManager.create_partitions()'), so those that haven't been seen for
+    REFERRAL_RETENTION_MONTHS are archived a whole partition at a time
+    ('ReferralManager.archive_partitions()') and the partitions in use stay small. Referrals from
+    every other webpage are kept in a partition of their own and never archived.
+    '''
     source_webpage = models.ForeignKey(WebPage, related_name="referrs_to", on_delete=models.CASCADE)
     destination_webpage = models.ForeignKey(WebPage, related_name="referrs_from", on_delete=models.CASCADE)
 
@@ -1111,38 +2295,138 @@ class Referral(models.Model):
     destination_domain = models.ForeignKey(Domain, related_name="referrs_from", on_delete=models.CASCADE)
 
     time_discovered = models.DateTimeField()
+    # The last time a webpage was read with this hyperlink, see 'ReferralManager.add_edges()'
+    last_seen = models.DateTimeField()
+    # Whether the source webpage is read again (a source webpage of a source domain), so 'last_seen' moves
+    is_recrawled = models.BooleanField(default=False)
 
     objects = ReferralManager()
 
+    class Meta():
+        indexes = [
+            # Postgres can't keep the pair unique across partitions, 'ReferralManager.add_edges()' and the referral_edge_guard trigger do
+            models.Index(fields=["source_webpage", "destination_webpage"], name="referral_edge_idx"),
+        ]
+
+
+
+class DomainLinkManager(models.Manager):
+    def count_sql(self, referrals):
+        '''
+        SQL that counts the rows of 'referrals', a table or subquery with 'source_domain_id',
+        'destination_domain_id' and 'time_discovered' columns, into the DomainLinks between their
+        domains, creating the links that don't exist yet
+        '''
+        return f'''
+            INSERT INTO {self.model._meta.db_table} AS link (source_domain_id, destination_domain_id, count, first_seen, last_seen)
+            SELECT source_domain_id, destination_domain_id, COUNT(*), MIN(time_discovered), MAX(time_discovered)
+            FROM {referrals}
+            GROUP BY source_domain_id, destination_domain_id
+            ORDER BY source_domain_id, destination_domain_id
+            ON CONFLICT (source_domain_id, destination_domain_id) DO UPDATE SET
+                count = link.count + EXCLUDED.count,
+                first_seen = LEAST(link.first_seen, EXCLUDED.first_seen),
+                last_seen = GREATEST(link.last_seen, EXCLUDED.last_seen)
+        '''
+
+    def uncount(self, referrals):
+        '''
+        Take the rows of the table 'referrals' out of the counts of the DomainLinks between their
+        domains, deleting the links with nothing left. Must be called inside 'transaction.atomic()'.
+        '''
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute(f'''
+                UPDATE {table} AS link SET count = link.count - archived.count
+                FROM (
+                    SELECT source_domain_id, destination_domain_id, COUNT(*) AS count
+                    FROM {referrals}
+                    GROUP BY source_domain_id, destination_domain_id
+                ) AS archived
+                WHERE link.source_domain_id = archived.source_domain_id AND link.destination_domain_id = archived.destination_domain_id
+            ''')
+            cursor.execute(f"DELETE FROM {table} WHERE count <= 0")
+
+    def rebuild(self, domain_ids=None):
+        '''
+        Count the links from or to the domains with 'domain_ids' (every domain if None) again from
+        their referrals, for when referrals were changed without 'ReferralManager.add_edges()'.
+        Crawl workers adding referrals meanwhile wait for the rebuild to finish, so they don't count
+        their referrals twice. Returns the number of links.
+        '''
+        links = self.all()
+        where = ""
+        params = []
+        if domain_ids != None:
+            domain_ids = list(domain_ids)
+            links = self.filter(Q(source_domain_id__in=domain_ids) | Q(destination_domain_id__in=domain_ids))
+            where = "WHERE source_domain_id = ANY(%s) OR destination_domain_id = ANY(%s)"
+            params = [domain_ids, domain_ids]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {self.model._meta.db_table} IN SHARE ROW EXCLUSIVE MODE")
+            links.delete()
+            cursor.execute(self.count_sql(f"(SELECT * FROM {Referral._meta.db_table} {where}) AS referrals"), params)
+            return cursor.rowcount
+
+class DomainLink(models.Model):
+    '''
+    How many referrals there are from the webpages of one domain to the webpages of another, so the
+    domain graph can be read without going through every referral. Counted as referrals are added
+    (see 'ReferralManager.add_edges()'), deleting referrals doesn't uncount them until the links are
+    rebuilt (see 'DomainLinkManager.rebuild()').
+    '''
+    source_domain = models.ForeignKey(Domain, related_name="links_to", on_delete=models.CASCADE)
+    destination_domain = models.ForeignKey(Domain, related_name="links_from", on_delete=models.CASCADE)
+
+    count = models.IntegerField(default=0)
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+
+    objects = DomainLinkManager()
+
+    def __str__(self):
+        return f"{self.source_domain_id} -> {self.destination_domain_id} ({self.count})"
+
+    class Meta():
+        constraints = [
+            models.UniqueConstraint(fields=["source_domain", "destination_domain"], name="domain_link_unique_edge"),
+        ]
 
 
 class EmbeddingsManager(models.Manager):
 
-    def encode(self, string, webpage, source_attribute):
+    def encode(self, string, webpage, source_attribute, save=True):
         '''
-        Save an Embedding from 'string' attached to 'webpage' and labeled with 'source_attribute'
+        Save an Embedding from 'string' attached to 'webpage' and labeled with 'source_attribute'.
+        It is returned unsaved if not 'save'.
         '''
 
         start_time = timezone.now()
         
-        embedding = SIMILARITY_MODEL.encode(string)
+        with timed("embedding"):
+            embedding = SIMILARITY_MODEL.encode(string)
+        EMBEDDINGS.inc(domain=domain_label(webpage.url), source_attribute=source_attribute)
         
         #print(f' - EMBEDDING ({source_attribute}) ({timezone.now() - start_time})\n    - {webpage.url}')
 
         obj_data = {
             "embedding": embedding,
             "webpage": webpage,
-            "domain": webpage.domain,
+            "domain_id": webpage.domain_id,
             "source_attribute": source_attribute
         }
 
+        if not save:
+            return self.model(**obj_data)
         return super().create(**obj_data)
     
-    async def aencode(self, string, webpage, source_attribute):
+    async def aencode(self, string, webpage, source_attribute, save=True):
         '''
         Aysnchronouse version of '.encode()'
         '''
-        return await sync_to_async(self.encode)(string, webpage, source_attribute)
+        return await sync_to_async(self.encode)(string, webpage, source_attribute, save)
 
 
 class Embeddings(models.Model):
@@ -1153,3 +2437,41 @@ class Embeddings(models.Model):
     webpage = models.ForeignKey(WebPage, related_name="embeddings", on_delete=models.CASCADE)
     domain = models.ForeignKey(Domain, related_name="embeddings", on_delete=models.CASCADE)
     source_attribute = models.CharField()
+
+
+def saved_in_bulk(model, instances, created=False):
+    '''
+    Do what the receivers below do on 'post_save' for 'instances' of 'model' that were saved with
+    'bulk_create()' or 'bulk_update()', which don't send it
+    '''
+    if model == WebPage:
+        WebPage.objects.update_domain_aggregates(instances, created=created)
+    elif model == Domain:
+        for domain in instances:
+            DOMAIN_CACHE.invalidate(urlparse(domain.url).hostname)
+
+@receiver(post_save, sender=Domain)
+def update_domain_cache(sender, instance, **kwargs):
+    '''
+    Keep DOMAIN_CACHE up to date with a saved domain. If the cache has another Domain for the same
+    hostname (the other scheme) the entry is dropped, so the next lookup decides between them.
+    '''
+    hostname = urlparse(instance.url).hostname
+    cached = DOMAIN_CACHE.lookup([hostname])
+    if hostname in cached and (cached[hostname] == None or cached[hostname][0] == instance.id):
+        DOMAIN_CACHE.set_domain(instance)
+    else:
+        DOMAIN_CACHE.invalidate(hostname)
+
+@receiver(post_delete, sender=Domain)
+def remove_from_domain_cache(sender, instance, **kwargs):
+    DOMAIN_CACHE.invalidate(urlparse(instance.url).hostname)
+
+@receiver(post_save, sender=WebPage)
+def add_to_domain_aggregates(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        WebPage.objects.update_domain_aggregates([instance], created=created)
+
+@receiver(post_delete, sender=WebPage)
+def remove_from_domain_aggregates(sender, instance, **kwargs):
+    WebPage.objects.update_domain_aggregates([instance], deleted=True)
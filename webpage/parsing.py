@@ -0,0 +1,476 @@
+'''
+Pure functions that turn response bodies into the information we save about a webpage.
+
+They run in the parser process pool (see 'webpage.crawl.run_parser()'), so they take and return
+plain picklable values and must not import Django, the models or 'thoth.settings'.
+'''
+
+from io import BytesIO
+from pypdf import PdfReader
+from bs4 import BeautifulSoup
+from lxml import etree
+import hashlib
+import json
+import re
+
+
+def read_anchor(anchor):
+    '''
+    The parts of an anchor element that 'WebPage.read_anchors()' uses to guess at a title
+    '''
+    string = anchor.string
+    if string != None:
+        string = str(string)
+
+    return {
+        "href": anchor.get("href"),
+        "string": string,
+        "aria-label": anchor.get("aria-label"),
+        "title": anchor.get("title"),
+    }
+
+
+def get_icon_size(icon):
+    if icon.get("sizes") != None:
+        try:
+            return int(icon.get("sizes").split("x")[0])
+        except ValueError:
+            return 0
+    else:
+        return 0
+
+
+def find_best_icon(soup):
+    '''
+    Return the href of the largest icon, preferring apple touch icons over shortcut icons
+    over plain icons
+    '''
+    web_domain_image = None
+    apple_icons = soup.find_all("link", attrs={"rel" : "apple-touch-icon"})
+    if len(apple_icons) > 0:
+        web_domain_image = sorted(apple_icons, key=get_icon_size, reverse=True)[0]
+
+    if web_domain_image == None:
+        apple_icons = soup.find_all("link", attrs={"rel" : "apple-touch-icon-precomposed"})
+        if len(apple_icons) > 0:
+            web_domain_image = sorted(apple_icons, key=get_icon_size, reverse=True)[0]
+
+    if web_domain_image == None:
+        web_domain_image = soup.find("link", attrs={"rel" : "shortcut icon"})
+
+    if web_domain_image == None:
+        icons = soup.find_all("link", attrs={"rel" : "icon"})
+        if len(icons) > 0:
+            web_domain_image = sorted(icons, key=get_icon_size, reverse=True)[0]
+
+    if web_domain_image != None:
+        return web_domain_image.get("href")
+    return None
+
+
+def get_meta_content(soup, attrs):
+    meta = soup.find("meta", attrs=attrs)
+    if meta != None:
+        return meta.get("content")
+    return None
+
+
+def parse_html_soup(body, encoding=None):
+    '''
+    Scrape the bytes of a html page, decoded with 'encoding' (utf-8 if not known), with BeautifulSoup.
+    This is the reference for 'parse_html()', which should give the same result much faster.
+    Returns a dictionary of:
+        title: og:title, or the <title> if there is none
+        description: meta description, or og:description if there is none
+        image: og:image, or twitter:image if there is none
+        yoast_date_modified, yoast_date_published: dates from the yoast schema graph's WebPage
+        article_modified_time, article_published_time: article:*_time meta tags
+        site_name: og:site_name
+        icon: href of the best icon for the site (see 'find_best_icon()')
+        anchors: every anchor element (see 'read_anchor()')
+        is_wordpress: whether there are clues the site uses Wordpress
+
+    Dates are returned as the strings found in the page.
+    '''
+    text = body.decode(encoding or "utf-8", errors="replace")
+    soup = BeautifulSoup(text, "html.parser")
+    page = {}
+
+    ### read dates from yoast schema graph if existing
+    page["yoast_date_modified"] = None
+    page["yoast_date_published"] = None
+    yoast_graph = soup.find("script", attrs={"type" : "application/ld+json", "class": "yoast-schema-graph"})
+    if yoast_graph != None:
+        try:
+            yoast_graph = json.loads(yoast_graph.decode_contents())
+        except ValueError:
+            yoast_graph = {}
+        if "@graph" in yoast_graph:
+            for scheme in yoast_graph["@graph"]:
+                if "@type" in scheme:
+                    if scheme["@type"] == "WebPage":
+                        page["yoast_date_modified"] = scheme.get("dateModified")
+                        page["yoast_date_published"] = scheme.get("datePublished")
+                        break
+
+    ### read title of webpage
+    page["title"] = get_meta_content(soup, {"property" : "og:title"})
+    if page["title"] == None and soup.title != None and soup.title.string != None:
+        page["title"] = str(soup.title.string)
+
+    ### read description of webpage
+    page["description"] = get_meta_content(soup, {"name" : "description"})
+    if page["description"] == None:
+        page["description"] = get_meta_content(soup, {"property" : "og:description"})
+
+    ### read image of webpage
+    page["image"] = get_meta_content(soup, {"property" : "og:image"})
+    if page["image"] == None:
+        page["image"] = get_meta_content(soup, {"name" : "twitter:image"})
+
+    ### read article times of webpage
+    page["article_published_time"] = get_meta_content(soup, {"property" : "article:published_time"})
+    page["article_modified_time"] = get_meta_content(soup, {"property" : "article:modified_time"})
+
+    ### read site information used for the domain
+    page["site_name"] = get_meta_content(soup, {"property" : "og:site_name"})
+    page["icon"] = find_best_icon(soup)
+
+    page["anchors"] = [read_anchor(anchor) for anchor in soup.find_all("a")]
+
+    page["is_wordpress"] = "/wp-json/" in text or "/wp-content/" in text
+
+    return page
+
+
+ICON_RELS = ["apple-touch-icon", "apple-touch-icon-precomposed", "shortcut icon", "icon"]
+
+
+def rel_matches(rel, value):
+    '''
+    Whether a 'rel' attribute matches 'value' the way BeautifulSoup matches it: either the whole
+    attribute or one of its space separated values
+    '''
+    return rel == value or value in rel.split()
+
+
+class HtmlExtractor:
+    '''
+    Parser target for lxml that collects what 'parse_html()' returns while the page is parsed,
+    without building a tree.
+
+    Every field is the first match in the page, like 'soup.find()'. An anchor's 'string' follows
+    BeautifulSoup's '.string': the anchor's text if it has a single child that is text, or a single
+    child that itself has a single string, otherwise None. Comments, CDATA sections and processing
+    instructions are children with a string of their own, as they are in BeautifulSoup.
+    '''
+
+    def __init__(self):
+        self.meta = {}
+        self.icons = {rel: [] for rel in ICON_RELS}
+        self.title = None
+        self.in_title = False
+        self.title_found = False
+        self.yoast_graph = None
+        self.in_yoast_graph = False
+        self.yoast_graph_found = False
+        self.anchors = []
+
+        # For the anchor being read: the child count of each element open inside it (the anchor first),
+        # whether every one of them has had a single child, and the text collected
+        self.anchor = None
+        self.anchor_children = []
+        self.anchor_single_chain = True
+        self.anchor_text = []
+        # lxml calls 'data()' once for each piece of text between entity references, which together
+        # are a single text child
+        self.last_event_was_text = False
+
+    def start(self, tag, attrib):
+        self.last_event_was_text = False
+        if self.anchor != None:
+            self.add_anchor_child()
+            self.anchor_children.append(0)
+
+        if tag == "a":
+            if self.anchor != None:
+                # Nested anchors aren't allowed, treat this one as closing the one before it
+                self.finish_anchor()
+            self.anchor = {
+                "href": attrib.get("href"),
+                "string": None,
+                "aria-label": attrib.get("aria-label"),
+                "title": attrib.get("title"),
+            }
+            self.anchor_children = [0]
+            self.anchor_single_chain = True
+            self.anchor_text = []
+            self.anchors.append(self.anchor)
+        elif tag == "meta":
+            for attribute in ["property", "name"]:
+                key = (attribute, attrib.get(attribute))
+                if key[1] != None and not key in self.meta:
+                    self.meta[key] = attrib.get("content")
+        elif tag == "link":
+            rel = attrib.get("rel")
+            if rel != None:
+                for icon_rel in ICON_RELS:
+                    if rel_matches(rel, icon_rel):
+                        self.icons[icon_rel].append(attrib)
+        elif tag == "title" and not self.title_found:
+            self.in_title = True
+            self.title_found = True
+            self.title = []
+        elif tag == "script" and not self.yoast_graph_found:
+            if attrib.get("type") == "application/ld+json" and "yoast-schema-graph" in (attrib.get("class") or "").split():
+                self.in_yoast_graph = True
+                self.yoast_graph_found = True
+                self.yoast_graph = []
+
+    def end(self, tag):
+        self.last_event_was_text = False
+        if self.anchor != None:
+            if tag == "a":
+                self.finish_anchor()
+            elif len(self.anchor_children) > 1:
+                self.anchor_children.pop()
+
+        if tag == "title":
+            self.in_title = False
+        elif tag == "script":
+            self.in_yoast_graph = False
+
+    def data(self, data):
+        if self.anchor != None:
+            if not self.last_event_was_text:
+                self.add_anchor_child()
+            self.anchor_text.append(data)
+        self.last_event_was_text = True
+        if self.in_title:
+            self.title.append(data)
+        if self.in_yoast_graph:
+            self.yoast_graph.append(data)
+
+    def comment(self, text):
+        # lxml's html parser reads CDATA sections and processing instructions as comments
+        if text.startswith("[CDATA[") and text.endswith("]]"):
+            text = text[7:-2]
+        elif text.startswith("?"):
+            text = text[1:]
+
+        self.last_event_was_text = False
+        if self.anchor != None:
+            self.add_anchor_child()
+            self.anchor_text.append(text)
+
+    def add_anchor_child(self):
+        self.anchor_children[-1] += 1
+        if self.anchor_children[-1] > 1:
+            self.anchor_single_chain = False
+
+    def finish_anchor(self):
+        if self.anchor_single_chain and len(self.anchor_text) > 0:
+            self.anchor["string"] = "".join(self.anchor_text)
+        self.anchor = None
+
+    def close(self):
+        if self.anchor != None:
+            self.finish_anchor()
+        return self
+
+
+def find_best_icon_href(icons):
+    '''
+    'find_best_icon()' for the icon links collected by HtmlExtractor
+    '''
+    for rel in ["apple-touch-icon", "apple-touch-icon-precomposed"]:
+        if len(icons[rel]) > 0:
+            return sorted(icons[rel], key=get_icon_size, reverse=True)[0].get("href")
+
+    if len(icons["shortcut icon"]) > 0:
+        return icons["shortcut icon"][0].get("href")
+
+    if len(icons["icon"]) > 0:
+        return sorted(icons["icon"], key=get_icon_size, reverse=True)[0].get("href")
+
+    return None
+
+
+# Comments, scripts and styles, whose content isn't markup, and the start and end of anchors
+ANCHOR_TAGS = re.compile(r"<!--.*?-->|<(script|style)\b.*?</\1\s*>|<(/?)a\b", re.IGNORECASE | re.DOTALL)
+
+
+def has_nested_anchors(text):
+    '''
+    Whether an anchor in the html 'text' starts before the one before it was closed. lxml closes
+    the open anchor, like browsers do, while BeautifulSoup nests the new anchor in it.
+    '''
+    is_open = False
+    for match in ANCHOR_TAGS.finditer(text):
+        if match.group(0).startswith("<!--") or match.group(1) != None:
+            continue
+        if match.group(2) == "/":
+            is_open = False
+        elif is_open:
+            return True
+        else:
+            is_open = True
+    return False
+
+
+def parse_html(body, encoding=None):
+    '''
+    Scrape the bytes of a html page, decoded with 'encoding' (utf-8 if not known), in a single pass
+    with lxml's parser. Returns the same dictionary as 'parse_html_soup()'.
+
+    Falls back to 'parse_html_soup()' if lxml can't read the page at all, or would read its
+    anchors differently (see 'has_nested_anchors()').
+    '''
+    text = body.decode(encoding or "utf-8", errors="replace")
+    if has_nested_anchors(text):
+        return parse_html_soup(body, encoding)
+
+    extractor = HtmlExtractor()
+    try:
+        parser = etree.HTMLParser(target=extractor)
+        parser.feed(text)
+        parser.close()
+    except etree.LxmlError:
+        return parse_html_soup(body, encoding)
+
+    page = {}
+
+    ### read dates from yoast schema graph if existing
+    page["yoast_date_modified"] = None
+    page["yoast_date_published"] = None
+    if extractor.yoast_graph != None:
+        try:
+            yoast_graph = json.loads("".join(extractor.yoast_graph))
+        except ValueError:
+            yoast_graph = {}
+        if "@graph" in yoast_graph:
+            for scheme in yoast_graph["@graph"]:
+                if "@type" in scheme:
+                    if scheme["@type"] == "WebPage":
+                        page["yoast_date_modified"] = scheme.get("dateModified")
+                        page["yoast_date_published"] = scheme.get("datePublished")
+                        break
+
+    meta = extractor.meta
+
+    page["title"] = meta.get(("property", "og:title"))
+    if page["title"] == None and extractor.title != None and len(extractor.title) > 0:
+        page["title"] = "".join(extractor.title)
+
+    page["description"] = meta.get(("name", "description"))
+    if page["description"] == None:
+        page["description"] = meta.get(("property", "og:description"))
+
+    page["image"] = meta.get(("property", "og:image"))
+    if page["image"] == None:
+        page["image"] = meta.get(("name", "twitter:image"))
+
+    page["article_published_time"] = meta.get(("property", "article:published_time"))
+    page["article_modified_time"] = meta.get(("property", "article:modified_time"))
+
+    page["site_name"] = meta.get(("property", "og:site_name"))
+    page["icon"] = find_best_icon_href(extractor.icons)
+
+    page["anchors"] = extractor.anchors
+
+    page["is_wordpress"] = "/wp-json/" in text or "/wp-content/" in text
+
+    return page
+
+
+# Markup that changes on every request without the page changing: html comments (which often
+# hold generation times), nonces and csrf tokens, cache busting query parameters and attributes
+# holding the time the page was generated. Dates and times in the page's text are left alone, on
+# an event listing they are what changes.
+VOLATILE_PATTERNS = re.compile("|".join([
+    r"<!--.*?-->",
+    r"(?:nonce|csrf|xsrf)[\w-]*[\"']?\s*[:=]\s*[\"'][^\"']*[\"']",
+    r"name=[\"'][^\"']*(?:nonce|csrf|token)[^\"']*[\"'][^>]*?value=[\"'][^\"']*[\"']",
+    r"[?&](?:ver|v|_|t|ts|cb)=[\w.-]+",
+    r"\s(?:data-)?(?:timestamp|ts|generated|generated-at|render-time|server-time|cache-time)=[\"'][^\"']*[\"']",
+    ]), re.IGNORECASE | re.DOTALL)
+
+
+def normalized_text_hash(body, encoding=None):
+    '''
+    sha256 of a html page with everything in VOLATILE_PATTERNS removed and whitespace collapsed,
+    so two responses of a page that only differ by a nonce or the time they were generated have
+    the same hash
+    '''
+    text = body.decode(encoding or "utf-8", errors="replace")
+    text = VOLATILE_PATTERNS.sub("", text)
+    text = " ".join(text.split())
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def parse_wordpress_item(item):
+    '''
+    Scrape an item from a wordpress REST api response. Returns a dictionary with its 'title',
+    'description' and the 'anchors' in its content (see 'read_anchor()')
+    '''
+    description = ""
+    if "excerpt" in item:
+        description = BeautifulSoup(item["excerpt"]["rendered"], "html.parser").get_text()
+    elif "caption" in item:
+        description = BeautifulSoup(item["caption"]["rendered"], "html.parser").get_text()
+
+    title = BeautifulSoup(item["title"]["rendered"], "html.parser").get_text()
+    if title == None:
+        title = item["guid"]["rendered"]
+
+    anchors = []
+    if "content" in item:
+        anchors = [read_anchor(anchor) for anchor in BeautifulSoup(item["content"]["rendered"], "html.parser").find_all("a")]
+
+    return {
+        "title": title,
+        "description": description,
+        "anchors": anchors,
+    }
+
+
+def parse_pdf(body):
+    '''
+    Read the bytes of a PDF file. Returns a dictionary with its 'title' and a 'description' made
+    from its metadata, and the urls of its 'hyperlinks'
+    '''
+    reader = PdfReader(BytesIO(body))
+
+    title = None
+    description = ""
+
+    meta = reader.metadata
+    if meta != None:
+        if meta.title:
+            title = str(meta.title)
+
+        meta_info = [
+            (f"{meta.keywords}", meta.keywords),
+            (f"Subject: {meta.subject}", meta.subject),
+            (f"Author: {meta.author}", meta.author),
+            (f"Creator: {meta.creator}", meta.creator),
+            (f"Producer: {meta.producer}", meta.producer),
+            (f"Created: {meta.creation_date}", meta.creation_date),
+            (f"Modified: {meta.modification_date}", meta.modification_date),
+        ]
+        description = "\n".join(map(lambda info: info[0], (filter(lambda info: info[1], meta_info))))
+
+    hyperlinks = []
+    for i in range(reader.get_num_pages()):
+        page = reader.pages[i]
+        if "/Annots" in page:
+            for annotation in page["/Annots"]:
+                if "/A" in annotation.get_object():
+                    if annotation.get_object()["/A"]["/S"] == "/URI":
+                        hyperlinks.append(str(annotation.get_object()["/A"]["/URI"]))
+
+    return {
+        "title": title,
+        "description": description,
+        "hyperlinks": hyperlinks,
+    }
@@ -0,0 +1,171 @@
+'''
+Record responses to a corpus file and replay them from a local server, so the crawler can be run
+and measured without making requests to live sites.
+
+Corpus format: one JSON object per line
+    url: The requested url
+    status: Status code of the response
+    headers: Response headers, as a dictionary
+    body: The body, if it is text
+    body_base64: The body encoded as base64, if it isn't text (PDFs)
+
+The replay server can't present certificates for the recorded hosts, so replayed corpora are
+downgraded to http: 'https://' becomes 'http://' in urls, 'Location' headers and text bodies.
+The crawler keeps any url it is given as http, so it only ever requests the replay server.
+'''
+
+import base64
+import json
+import socket
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+from urllib.parse import urlparse
+
+# Headers that describe how the recorded response was sent rather than what it was
+HOP_HEADERS = ["content-length", "content-encoding", "transfer-encoding", "connection", "keep-alive"]
+
+TEXT_CONTENT_TYPES = ["html", "json", "xml", "text", "javascript"]
+
+
+def is_text(content_type):
+    return any(text_type in content_type for text_type in TEXT_CONTENT_TYPES)
+
+
+def make_record(url, status, headers, body):
+    '''
+    Corpus record of a response
+    '''
+    headers = {name: value for name, value in headers.items() if not name.lower() in HOP_HEADERS}
+    record = {"url": url, "status": status, "headers": headers}
+
+    content_type = headers.get("Content-Type", headers.get("content-type", ""))
+    if is_text(content_type):
+        try:
+            record["body"] = body.decode("utf-8")
+            return record
+        except UnicodeDecodeError:
+            pass
+    record["body_base64"] = base64.b64encode(body).decode("ascii")
+    return record
+
+
+def record_body(record):
+    if "body" in record:
+        return record["body"].encode("utf-8")
+    return base64.b64decode(record.get("body_base64", ""))
+
+
+def downgrade(record):
+    '''
+    Rewrite a record to http, see the module docstring
+    '''
+    record = dict(record)
+    record["url"] = record["url"].replace("https://", "http://")
+    record["headers"] = {
+        name: value.replace("https://", "http://") if name.lower() == "location" else value
+        for name, value in record["headers"].items()
+        }
+    if "body" in record:
+        record["body"] = record["body"].replace("https://", "http://").replace("https:\\/\\/", "http:\\/\\/")
+    return record
+
+
+def load_corpus(path):
+    '''
+    Read a corpus file into a dictionary of downgraded records by url
+    '''
+    corpus = {}
+    with open(path) as file:
+        for line in file:
+            if line.strip() == "":
+                continue
+            record = downgrade(json.loads(line))
+            corpus[record["url"]] = record
+    return corpus
+
+
+def corpus_key(url):
+    '''
+    Url a request is looked up by: scheme, host and path with query, without a port or fragment
+    '''
+    url_parse = urlparse(url)
+    key = "http://" + (url_parse.hostname or "") + (url_parse.path or "/")
+    if url_parse.query:
+        key = key + "?" + url_parse.query
+    return key
+
+
+class ReplayResolver(AbstractResolver):
+    '''
+    Resolves every host to the replay server, so requests for any recorded url go to it
+    '''
+
+    def __init__(self, port, host="127.0.0.1"):
+        self.port = port
+        self.host = host
+
+    async def resolve(self, hostname, port=0, family=socket.AF_INET):
+        return [{
+            "hostname": hostname,
+            "host": self.host,
+            "port": self.port,
+            "family": socket.AF_INET,
+            "proto": 0,
+            "flags": socket.AI_NUMERICHOST,
+            }]
+
+    async def close(self):
+        pass
+
+
+class ReplayServer:
+    '''
+    Local aiohttp server answering requests with the records of a corpus. Requests for urls that
+    aren't in the corpus get a 404. Records with an 'ETag' or 'Last-Modified' header answer a
+    matching conditional request with '304 Not Modified', like the recorded server would.
+
+    Use as an async context manager, then make requests with a session using 'resolver()':
+        async with ReplayServer(corpus) as server:
+            session = create_session(resolver=server.resolver())
+    '''
+
+    def __init__(self, corpus, host="127.0.0.1", port=0):
+        self.corpus = {corpus_key(url): record for url, record in corpus.items()}
+        self.host = host
+        self.port = port
+        self.runner = None
+        self.requests = 0
+
+    async def handle(self, request):
+        self.requests = self.requests + 1
+
+        record = self.corpus.get(corpus_key("http://" + request.host + request.path_qs))
+        if record == None:
+            return web.Response(status=404)
+
+        headers = {name: value for name, value in record["headers"].items() if not name.lower() in HOP_HEADERS}
+        lower_headers = {name.lower(): value for name, value in headers.items()}
+
+        etag = lower_headers.get("etag")
+        last_modified = lower_headers.get("last-modified")
+        if (etag != None and request.headers.get("If-None-Match") == etag) or (last_modified != None and request.headers.get("If-Modified-Since") == last_modified):
+            return web.Response(status=304, headers=headers)
+
+        return web.Response(status=record["status"], headers=headers, body=record_body(record))
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.runner.cleanup()
+        self.runner = None
+
+    def resolver(self):
+        return ReplayResolver(self.port, self.host)
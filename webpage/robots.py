@@ -0,0 +1,149 @@
+import re
+import time
+from urllib.parse import urlparse
+
+from thoth.settings import ROBOTS_TXT_TTL
+
+# The product token we look for in 'User-agent:' lines
+ROBOTS_USER_AGENT = "thoth"
+
+# Compiled rules by hostname, each stored with the time.monotonic() they expire at
+ROBOTS_CACHE = {}
+
+
+def compile_path_pattern(pattern):
+    '''
+    Turn a robots.txt path pattern into a regex. '*' matches any sequence of characters and a
+    trailing '$' anchors the pattern to the end of the path
+    '''
+    anchored = pattern.endswith("$")
+    if anchored:
+        pattern = pattern[:-1]
+
+    regex = ".*".join(re.escape(part) for part in pattern.split("*"))
+    if anchored:
+        regex = regex + "$"
+    return re.compile(regex)
+
+
+class RobotsRules:
+    '''
+    The rules of a robots.txt file that apply to us, compiled so urls can be checked quickly.
+
+    Follows RFC 9309: the group for our user agent is used if there is one, otherwise the '*' group.
+    The longest matching rule decides whether a path is allowed and 'Allow' wins a tie.
+    '''
+
+    def __init__(self, rules=None, crawl_delay=None, sitemaps=None):
+        # List of (length of pattern, is allowed, compiled pattern)
+        self.rules = rules or []
+        self.crawl_delay = crawl_delay
+        self.sitemaps = sitemaps or []
+
+    @classmethod
+    def parse(cls, text):
+        '''
+        Parse the text of a robots.txt file. Missing or empty files allow everything
+        '''
+        if text == None:
+            return cls()
+
+        groups = []
+        sitemaps = []
+        agents = []
+        group = None
+
+        for line in text.splitlines():
+            line = line.split("#", 1)[0].strip()
+            if not ":" in line:
+                continue
+
+            field, value = line.split(":", 1)
+            field = field.strip().lower()
+            value = value.strip()
+
+            if field == "user-agent":
+                if group != None:
+                    # A user-agent line after rules starts a new group
+                    agents = []
+                    group = None
+                agents.append(value.lower())
+            elif field in ["allow", "disallow", "crawl-delay"]:
+                if group == None:
+                    if len(agents) == 0:
+                        continue
+                    group = {"agents": agents, "rules": [], "crawl_delay": None}
+                    groups.append(group)
+
+                if field == "crawl-delay":
+                    try:
+                        group["crawl_delay"] = float(value)
+                    except ValueError:
+                        pass
+                elif value != "":
+                    group["rules"].append((len(value), field == "allow", compile_path_pattern(value)))
+            elif field == "sitemap":
+                sitemaps.append(value)
+
+        matching = [g for g in groups if ROBOTS_USER_AGENT in g["agents"]]
+        if len(matching) == 0:
+            matching = [g for g in groups if "*" in g["agents"]]
+
+        rules = []
+        crawl_delay = None
+        for g in matching:
+            rules = rules + g["rules"]
+            if g["crawl_delay"] != None:
+                crawl_delay = g["crawl_delay"]
+
+        # Longest pattern first, with 'Allow' before 'Disallow' for patterns of the same length
+        rules.sort(key=lambda rule: (rule[0], rule[1]), reverse=True)
+
+        return cls(rules=rules, crawl_delay=crawl_delay, sitemaps=sitemaps)
+
+    def allowed(self, url):
+        '''
+        Return whether we are allowed to request 'url'
+        '''
+        url_parse = urlparse(url)
+        path = url_parse.path or "/"
+        if path == "/robots.txt":
+            return True
+        if url_parse.query:
+            path = path + "?" + url_parse.query
+
+        for length, allow, pattern in self.rules:
+            if pattern.match(path):
+                return allow
+        return True
+
+
+def cache_robots_rules(hostname, text):
+    '''
+    Compile the robots.txt 'text' of 'hostname' and keep it in memory for ROBOTS_TXT_TTL
+    '''
+    rules = RobotsRules.parse(text)
+    ROBOTS_CACHE[hostname] = (rules, time.monotonic() + ROBOTS_TXT_TTL)
+    return rules
+
+
+def cached_robots_rules(hostname):
+    '''
+    Return the compiled rules of 'hostname' if they are in memory and not expired, otherwise None
+    '''
+    if hostname in ROBOTS_CACHE:
+        rules, expires = ROBOTS_CACHE[hostname]
+        if expires > time.monotonic():
+            return rules
+        del ROBOTS_CACHE[hostname]
+    return None
+
+
+def prune_robots_cache():
+    '''
+    Drop every expired entry, so a long running crawl doesn't hold on to the rules of every
+    host it has seen
+    '''
+    now = time.monotonic()
+    for hostname in [hostname for hostname, (rules, expires) in ROBOTS_CACHE.items() if expires <= now]:
+        del ROBOTS_CACHE[hostname]
@@ -0,0 +1,131 @@
+import zlib
+import logging
+from lxml import etree
+from django.utils import timezone
+
+from thoth.settings import SITEMAP_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def parse_lastmod(text):
+    '''
+    Read a sitemap '<lastmod>' (W3C datetime, either a date or a date and time). Dates without
+    a timezone are taken to be in the current timezone. Returns None if it can't be read.
+    '''
+    if text == None:
+        return None
+    try:
+        lastmod = timezone.datetime.fromisoformat(text.strip())
+    except ValueError:
+        return None
+    if timezone.is_naive(lastmod):
+        lastmod = timezone.make_aware(lastmod)
+    return lastmod
+
+
+def local_name(tag):
+    '''
+    Tag name without its namespace, '{http://www.sitemaps.org/schemas/sitemap/0.9}loc' is 'loc'
+    '''
+    if not isinstance(tag, str):
+        return ""
+    return tag.rsplit("}", 1)[-1]
+
+
+class SitemapParser:
+    '''
+    Incremental parser for a sitemap or sitemap index. Feed it the body as it is downloaded and
+    collect the entries found so far with 'read_entries()', so a sitemap of 50,000 urls never has to
+    be held in memory at once. Gzipped sitemaps are recognised by their magic bytes and decompressed
+    on the fly.
+
+    Stops once SITEMAP_MAX_SIZE bytes of (uncompressed) xml have been read, which is the limit
+    from the sitemaps protocol, and sets 'is_truncated'.
+    '''
+
+    def __init__(self, max_size=SITEMAP_MAX_SIZE):
+        self.parser = etree.XMLPullParser(events=("end",), recover=True, resolve_entities=False, no_network=True)
+        self.decompressor = None
+        self.first_chunk = True
+        self.size = 0
+        self.max_size = max_size
+        self.is_truncated = False
+
+    def feed(self, chunk):
+        if self.first_chunk:
+            self.first_chunk = False
+            if chunk[:2] == b"\x1f\x8b":
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        if self.decompressor != None:
+            chunk = self.decompressor.decompress(chunk, self.max_size - self.size + 1)
+
+        if self.size + len(chunk) > self.max_size:
+            chunk = chunk[:self.max_size - self.size]
+            self.is_truncated = True
+
+        self.size = self.size + len(chunk)
+        self.parser.feed(chunk)
+
+    def read_entries(self):
+        '''
+        Return ('sitemap' or 'url', loc, lastmod) for every '<sitemap>' and '<url>' element that
+        ended since the last call. Parsed elements are cleared so memory stays flat.
+        '''
+        entries = []
+        for event, element in self.parser.read_events():
+            name = local_name(element.tag)
+            if name in ["url", "sitemap"]:
+                loc = None
+                lastmod = None
+                for child in element:
+                    child_name = local_name(child.tag)
+                    if child_name == "loc" and child.text != None:
+                        loc = child.text.strip()
+                    elif child_name == "lastmod":
+                        lastmod = parse_lastmod(child.text)
+
+                if loc:
+                    entries.append((name, loc, lastmod))
+
+                element.clear()
+                # Drop the elements before this one that the tree still holds on to
+                parent = element.getparent()
+                if parent != None:
+                    while element.getprevious() != None:
+                        del parent[0]
+        return entries
+
+    def close(self):
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError:
+            pass
+        return self.read_entries()
+
+
+async def read_sitemap(session, url):
+    '''
+    Request the sitemap at 'url' with 'session' and yield lists of its entries (see
+    'SitemapParser.read_entries()') as the response streams in. Yields nothing if the
+    request isn't successful.
+    '''
+    async with session.get(url) as r:
+        if r.status != 200:
+            logger.debug("sitemap %s %s", r.status, url)
+            return
+
+        parser = SitemapParser()
+        async for chunk in r.content.iter_chunked(64 * 1024):
+            parser.feed(chunk)
+            entries = parser.read_entries()
+            if len(entries) > 0:
+                yield entries
+            if parser.is_truncated:
+                logger.info("truncated sitemap %s", url)
+                break
+
+        entries = parser.close()
+        if len(entries) > 0:
+            yield entries
@@ -9,7 +9,8 @@ from rest_framework.response import Response
 from rest_framework import serializers, viewsets, filters, permissions
 
 import asyncio
-import aiohttp
+import threading
+import logging
 from asgiref.sync import async_to_sync, sync_to_async
 
 from pgvector.django import L2Distance
@@ -23,12 +24,16 @@ from io import BytesIO
 import urllib
 import math
 from pgvector.django import L2Distance
-from thoth.settings import SIMILARITY_MODEL, QUESTION_ANSWER_MODEL
+from thoth.settings import SIMILARITY_MODEL, QUESTION_ANSWER_MODEL, CRAWL_MAX_RUN_TIME
 
 import thoth.views as views
-from webpage.models import WebPage, Domain, Referral, Embeddings
+from webpage.models import WebPage, Domain, Referral, Embeddings, crawl_lock
+from webpage.crawl import CrawlScheduler, create_session
+from webpage.canonical import url_hash
 from organize_webpages.models import ThothTag
 
+logger = logging.getLogger(__name__)
+
 def is_non_whitespace(s):
     return any(char not in py_string.whitespace for char in s)
 
@@ -48,43 +53,38 @@ def read_domain(request):
     return HttpResponse("Hello, world. You're at the polls index.")
 
 
-@async_to_sync
-async def read_all():
-    DOMAIN_TIMEOUT = timezone.timedelta(minutes=30)
-    MAX_TASKS = 1
+def read_all():
+    '''
+    Read the webpages that are due in the crawl frontier, one leased batch at a time, until none
+    are left or CRAWL_MAX_RUN_TIME has passed. Domains are crawled concurrently with the limits
+    set by the CRAWL_* settings.
 
-    tasks = []
-    domain_query = Q(time_last_requested__lte=timezone.now() - DOMAIN_TIMEOUT) | Q(time_last_requested=None)
-    #async for domain in Domain.objects.filter(domain_query).order_by("-is_source", F("time_updated").desc(nulls_last=True), "time_discovered"):
-    async for domain in Domain.objects.filter(domain_query).order_by("time_last_requested"):
-        wps = await domain.read_webpages()
-        #tasks = tasks + wps
+    Does nothing if another 'read_all' or the 'crawl' daemon holds the crawl lock.
+    '''
+    with crawl_lock() as acquired:
+        if not acquired:
+            logger.info("another crawl is running, skipping scrape all")
+            return
+        crawl_all()
 
-        #if len(tasks) >= MAX_TASKS:
-        #    break
-        #    await asyncio.gather(*tasks)
-        #    tasks = []
 
-    #if len(tasks) > 0:
-    #    await asyncio.gather(*tasks)
+@async_to_sync
+async def crawl_all():
+    deadline = timezone.now() + timezone.timedelta(seconds=CRAWL_MAX_RUN_TIME)
 
-    print(f"finished scape all")
+    async with CrawlScheduler() as scheduler:
+        await scheduler.crawl_frontier(deadline=deadline)
+
+    logger.info("finished scape all, %s", scheduler.report())
 
 
 @async_to_sync
 async def read_single_domain(domain_url):
 
-    tasks = []
-    domain = await Domain.objects.aget(url=domain_url)
-
-    wps = await domain.read_webpages()
-    #tasks = tasks + wps
+    domain = await Domain.objects.aget(url_hash=url_hash(domain_url))
 
-    #if len(tasks) > 50:
-    #    await asyncio.gather(*tasks)
-    #    tasks = []
-
-    #await asyncio.gather(*tasks)
+    async with CrawlScheduler() as scheduler:
+        await scheduler.crawl([domain])
 
 # Serializers define the API representation.
 class WebPageSerializer(serializers.HyperlinkedModelSerializer):
@@ -173,11 +173,50 @@ class DomainViewSet(viewsets.ModelViewSet):
         return Domain.objects.filter(filter).order_by(F("time_updated").desc(nulls_last=True), F("time_last_requested").desc(nulls_last=True))
 
 
+ANSWER_LOOP = None
+ANSWER_LOOP_LOCK = threading.Lock()
+ANSWER_SESSION = None
+
+def get_answer_loop():
+    '''
+    Return the event loop that makes every request for the answer endpoint, starting it in a
+    background thread the first time it's needed. Each call to 'answer' runs in its own short lived
+    loop, so the pooled session has to live on a loop of its own to be reused between calls.
+    '''
+    global ANSWER_LOOP
+    with ANSWER_LOOP_LOCK:
+        if ANSWER_LOOP == None:
+            ANSWER_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=ANSWER_LOOP.run_forever, name="answer-http", daemon=True).start()
+    return ANSWER_LOOP
+
+async def answer_request(url):
+    '''
+    Request 'url' with the answer endpoint's pooled session. Only runs on the answer loop.
+    Returns the content type and the body (bytes for pdfs, text for html, None for anything else)
+    '''
+    global ANSWER_SESSION
+    if ANSWER_SESSION == None or ANSWER_SESSION.closed:
+        ANSWER_SESSION = create_session()
+
+    async with ANSWER_SESSION.get(url) as r:
+        if "pdf" in r.content_type:
+            return r.content_type, await r.read()
+        elif "html" in r.content_type:
+            return r.content_type, await r.text()
+        return r.content_type, None
+
+async def pooled_answer_request(url):
+    '''
+    Run 'answer_request()' on the answer loop and wait for it from whichever loop we are on
+    '''
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(answer_request(url), get_answer_loop()))
+
 @api_view()
 @permission_classes((permissions.AllowAny,))
 def answer(request):
 
-    print(f'recieve request')
+    logger.debug("recieve request")
     
     NUMBER_OF_ANSWERS = 3
     
@@ -185,11 +224,11 @@ def answer(request):
     
     start = timezone.now()
     query__retrieve_embedding = SIMILARITY_MODEL.encode(query)
-    print(f'encode query similarity {timezone.now() - start}')
+    logger.debug("encode query similarity %s", timezone.now() - start)
     
     start = timezone.now()
     query__answer_embedding = QUESTION_ANSWER_MODEL.encode(query)
-    print(f'encode query answer {timezone.now() - start}')
+    logger.debug("encode query answer %s", timezone.now() - start)
 
     webpage = request.GET.get('webpage', None)
 
@@ -198,19 +237,19 @@ def answer(request):
 
         start = timezone.now()
         passage_embedding = await sync_to_async(QUESTION_ANSWER_MODEL.encode)(strings)
-        print(f'encode passages {timezone.now() - start}')
+        logger.debug("encode passages %s", timezone.now() - start)
 
         top_k = max(math.ceil(len(strings) / 8), min(3, len(strings)))
 
         start = timezone.now()
         similarity_scores = (await sync_to_async(QUESTION_ANSWER_MODEL.similarity)(query__answer_embedding, passage_embedding))[0]
         scores, indices = torch.topk(similarity_scores, k=top_k)
-        print(f'rank passages {timezone.now() - start}')
+        logger.debug("rank passages %s", timezone.now() - start)
 
         for i in range(top_k):
-            print(f'  - {i}. {scores[i]:.4f} {strings[indices[i]]}')
+            logger.debug("  - %s. %.4f %s", i, scores[i], strings[indices[i]])
 
-        print(f'rank {timezone.now() - start}')
+        logger.debug("rank %s", timezone.now() - start)
 
         return scores, indices
 
@@ -234,7 +273,7 @@ def answer(request):
                 expanded_strings.append(string_firsts[i]-1)
             expanded_strings = list(filter(lambda first: first >=0 and first+length < len(full_strings), expanded_strings))
 
-            print(f'expand {timezone.now() - start}')
+            logger.debug("expand %s", timezone.now() - start)
 
             if len(expanded_strings) == 0:
                 return " ".join(full_strings[string_firsts[indices[0]]:string_firsts[indices[0]]+string_lengths]), scores[0]
@@ -245,67 +284,64 @@ def answer(request):
 
     async def retrieve_answer(url):
         
-        HEADER = {'user-agent': 'The Society of Thoth'}
         stripped_string = []
-        print(f'start\n  - {url}')
+        logger.debug("start\n  - %s", url)
         start = timezone.now()
         try:
-            async with aiohttp.ClientSession(headers=HEADER, max_line_size=8190 * 2, max_field_size=8190 * 2) as session:
-                async with session.get(url) as r:
-                    if "pdf" in r.content_type:
-                        reader = PdfReader(BytesIO(await r.read()))
-
-                        out = ""
-                        for i in range(reader.get_num_pages()):
-                            page = reader.pages[i]
-                            text = page.extract_text()
-                            out = out + text
-                        
-                        stripped_string = out.split("\n")
-
-                    elif "html" in r.content_type:
-                        page = await r.text()
-                        soup = BeautifulSoup(page, "html.parser")
-                        
-                        if len(soup.find_all('article')) == 1:
-                            stripped_string = soup.find('article').get_text()
-                        elif len(soup.find_all("main")) == 1:
-                            stripped_string = soup.find("main").get_text()
-                        else:
-                            for elem in soup.find_all('footer'):
-                                elem.decompose()
-                            for elem in soup.find_all('nav'):
-                                elem.decompose()
-                            for elem in soup.find_all('header'):
-                                elem.decompose()
-                            for elem in soup.find_all(class_='navbar'):
-                                elem.decompose()
-                            stripped_string = soup.get_text()
-
-                        while '\n\n' in stripped_string:
-                            stripped_string = stripped_string.replace('\n\n', '\n')
-                        stripped_string = stripped_string.split('\n')
-
-                        stripped_string = map(lambda string: map(remove_contiguous_whitespace, string.split(". ")), stripped_string)
-                        stripped_string = map(lambda strings: list(filter(is_non_whitespace, strings)), stripped_string)
-                        stripped_string = filter(lambda strings: len(strings) > 0, stripped_string)
-                        stripped_string = [string[0]+"." for string in [strings for strings in stripped_string]]
-
-                    else:
-                        print(f'{r.content_type} {url}')
-                        return url, 0
+            content_type, body = await pooled_answer_request(url)
+            if "pdf" in content_type:
+                reader = PdfReader(BytesIO(body))
+
+                out = ""
+                for i in range(reader.get_num_pages()):
+                    page = reader.pages[i]
+                    text = page.extract_text()
+                    out = out + text
+                
+                stripped_string = out.split("\n")
+
+            elif "html" in content_type:
+                soup = BeautifulSoup(body, "html.parser")
+                
+                if len(soup.find_all('article')) == 1:
+                    stripped_string = soup.find('article').get_text()
+                elif len(soup.find_all("main")) == 1:
+                    stripped_string = soup.find("main").get_text()
+                else:
+                    for elem in soup.find_all('footer'):
+                        elem.decompose()
+                    for elem in soup.find_all('nav'):
+                        elem.decompose()
+                    for elem in soup.find_all('header'):
+                        elem.decompose()
+                    for elem in soup.find_all(class_='navbar'):
+                        elem.decompose()
+                    stripped_string = soup.get_text()
+
+                while '\n\n' in stripped_string:
+                    stripped_string = stripped_string.replace('\n\n', '\n')
+                stripped_string = stripped_string.split('\n')
+
+                stripped_string = map(lambda string: map(remove_contiguous_whitespace, string.split(". ")), stripped_string)
+                stripped_string = map(lambda strings: list(filter(is_non_whitespace, strings)), stripped_string)
+                stripped_string = filter(lambda strings: len(strings) > 0, stripped_string)
+                stripped_string = [string[0]+"." for string in [strings for strings in stripped_string]]
+
+            else:
+                logger.debug("%s %s", content_type, url)
+                return url, 0
 
         except Exception as e: 
-            print(f"error: {url}, {e}")
+            logger.warning("error: %s, %s", url, e)
             return url, 0
 
-        print(f'request {timezone.now() - start}\n  - {url}')
+        logger.debug("request %s\n  - %s", timezone.now() - start, url)
 
         return await find_best(stripped_string, [i for i in range(len(stripped_string))], 1, 0)
 
     async def add_answer_from_matching_page(id, answers):
         webpage = await WebPage.objects.aget(id=id)
-        print(f'answering from {webpage.url}')
+        logger.debug("answering from %s", webpage.url)
         answer, score = await retrieve_answer(webpage.url)
         answers.append(
             {
@@ -320,7 +356,7 @@ def answer(request):
         answers = []
         start = timezone.now()
         embeds = Embeddings.objects.order_by(L2Distance('embedding', query__retrieve_embedding))
-        print(f'retrieve pages {timezone.now() - start}')
+        logger.debug("retrieve pages %s", timezone.now() - start)
 
         start = timezone.now()
         tasks = []
@@ -330,12 +366,12 @@ def answer(request):
 
         start = timezone.now()
         embed_count = await embeds.acount()
-        print(f'count embeds {timezone.now() - start}')
+        logger.debug("count embeds %s", timezone.now() - start)
 
         while i < embed_count:
-            print(f'another loop {timezone.now() - start}')
+            logger.debug("another loop %s", timezone.now() - start)
             async for embed in embeds[i:i+gap]:
-                print(f'unique webpage {embed.webpage_id} {timezone.now() - start}')
+                logger.debug("unique webpage %s %s", embed.webpage_id, timezone.now() - start)
                 if not embed.webpage_id in unique_pages:
                     tasks.append(asyncio.create_task(add_answer_from_matching_page(embed.webpage_id, answers)))
                     unique_pages.append(embed.webpage_id)
@@ -347,7 +383,7 @@ def answer(request):
 
             i = i + gap
 
-        print(f'get unique webpages {timezone.now() - start}')
+        logger.debug("get unique webpages %s", timezone.now() - start)
 
         await asyncio.gather(*tasks)
 